@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""多指数批量估值
+
+沪深300、中证800、300价值、基本面50等指数的成分股高度重合，逐个指数计算时同一只股票的估值会被反复读取。
+这里对所有指数成分股的并集每个日期只取一次估值，然后用 成分股矩阵(指数 × 股票) 乘以 估值向量(股票)，
+一次算出所有指数在所有日期的 pe, pb, roe。
+
+成分股矩阵只在指数调整成分股时才会变化，成分股相同的日期合并成一组，每组只做一次矩阵乘法。
+"""
+
+import numpy as np
+import pandas as pd
+from index_timeline import get_index_timeline
+from valuation_store import get_valuation_store, to_timestamp
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+def _membership_matrix(snapshots, positions):
+    """指数 × 股票 的0/1矩阵，有scipy时使用稀疏矩阵"""
+    rows, cols = [], []
+    for i, codes in enumerate(snapshots):
+        cols.extend(positions[code] for code in codes if code in positions)
+        rows.extend([i] * (len(cols) - len(rows)))
+
+    shape = (len(snapshots), len(positions))
+    if sparse is not None:
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+
+    matrix = np.zeros(shape)
+    matrix[rows, cols] = 1.0
+    return matrix
+
+
+def get_indexes_factors(index_codes, days, index_types=(0, 1), store=None):
+    """
+    批量计算多个指数在多个日期的估值，算法与 IndexStockBeta.get_index_beta_factor 一致
+
+    input:
+        index_codes: 指数代码列表
+        days: 日期列表
+        index_types: 需要计算的加权方式，1为等权重方式计算，0为按市值加权计算
+        store: 估值仓库，默认使用进程内共享的 ValuationStore
+
+    output:
+        DataFrame, 列为 date, index_code, index_type, pe, pb, roe，没有有效数据的组合不出现在结果中
+    """
+    columns = ['date', 'index_code', 'index_type', 'pe', 'pb', 'roe']
+    if len(index_codes) == 0 or len(days) == 0:
+        return pd.DataFrame(columns=columns)
+
+    store = store if store is not None else get_valuation_store()
+    timeline = get_index_timeline()
+
+    # 每个指数在每个日期所在的成分股快照
+    snapshot_positions, snapshots = {}, {}
+    for index_code in index_codes:
+        snapshot_positions[index_code], snapshots[index_code] = timeline.get_snapshots(index_code, days)
+
+    codes = sorted(set(code for index_code in index_codes
+                       for position in set(snapshot_positions[index_code]) if position >= 0
+                       for code in snapshots[index_code][position]))
+    panel = store.get_panel(days, codes)
+    code_positions = {code: i for i, code in enumerate(codes)}
+
+    # 成分股相同的日期合为一组
+    groups = {}
+    for i, day in enumerate(days):
+        if to_timestamp(day) in panel['pe_ratio'].index:
+            signature = tuple(snapshot_positions[index_code][i] for index_code in index_codes)
+            groups.setdefault(signature, []).append(to_timestamp(day))
+
+    results = []
+    for signature, group_days in groups.items():
+        group_days = sorted(set(group_days))
+        matrix = _membership_matrix(
+            [snapshots[index_code][position] if position >= 0 else []
+             for index_code, position in zip(index_codes, signature)],
+            code_positions
+        )
+
+        pe = panel['pe_ratio'].loc[group_days].values
+        pb = panel['pb_ratio'].loc[group_days].values
+        cap = panel['circulating_market_cap'].loc[group_days].values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valid = np.nan_to_num(pe) > 0
+
+            def reduce(values):
+                # 每个日期、每个指数对成分股求和，NaN按0处理，与pandas的sum一致
+                values = np.where(valid & ~np.isnan(values), values, 0.0)
+                return np.asarray(matrix.dot(values.T)).T
+
+            for index_type in index_types:
+                if index_type == 0:
+                    weight = reduce(cap)
+                    pe_values = weight / reduce(cap / pe)
+                    pb_values = weight / reduce(cap / pb)
+                else:
+                    weight = reduce(np.ones(pe.shape))
+                    pe_values = weight / reduce(1 / pe)
+                    pb_values = weight / reduce(1 / pb)
+                roe_values = pb_values / pe_values
+
+                # 日期 × 指数 展开成长表
+                results.append(pd.DataFrame({
+                    'date': np.repeat([day.date() for day in group_days], len(index_codes)),
+                    'index_code': np.tile(index_codes, len(group_days)),
+                    'index_type': index_type,
+                    'pe': pe_values.ravel(),
+                    'pb': pb_values.ravel(),
+                    'roe': roe_values.ravel(),
+                }, columns=columns))
+
+    if not results:
+        return pd.DataFrame(columns=columns)
+
+    result = pd.concat(results, ignore_index=True)
+    result = result.replace([np.inf, -np.inf], np.nan).dropna()
+    result = result[(result[['pe', 'pb', 'roe']] != 0).all(axis=1)]
+    return result.sort_values(['index_code', 'index_type', 'date']).reset_index(drop=True)
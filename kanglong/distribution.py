@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""历史估值分布
+
+对历史估值只排序一次，之后每次查询百分位都是二分查找，并且可以一次传入整个数组做向量化查询。
+
+两种百分位算法:
+    decile: 与原来的 get_quantile_of_history_factors 完全一致，先取11个十分位点，再在两个分位点之间线性插值
+    ecdf: 经验分布函数，历史上小于等于当前值的比例
+"""
+
+import numpy as np
+
+DECILE_MODE = 'decile'
+ECDF_MODE = 'ecdf'
+
+
+class HistoryDistribution(object):
+
+    def __init__(self, history_list, mode=DECILE_MODE):
+        """
+        input:
+            history_list: 历史估值列表, Series/list/ndarray，NaN会被忽略
+            mode: 百分位算法，decile 或 ecdf
+        """
+        if mode not in (DECILE_MODE, ECDF_MODE):
+            raise ValueError('不支持的百分位算法: {}'.format(mode))
+
+        values = np.asarray(history_list, dtype='float64')
+        self._values = np.sort(values[~np.isnan(values)])
+        self._mode = mode
+        # 与 pandas.Series.quantile 默认的线性插值一致
+        self._deciles = np.percentile(self._values, np.arange(11) * 10.0) if len(self._values) else None
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def deciles(self):
+        """11个十分位点: 最小值, 10%, 20% ... 90%, 最大值"""
+        return self._deciles
+
+    def mean(self):
+        return self._values.mean()
+
+    def quantile(self, factor, mode=None):
+        """
+        获取某个因子在历史上的百分位，比如当前PE处于历史上的70%区间，意味着历史PE有70%都在当前值之下
+
+        input:
+            factor: 单个值或数组
+            mode: 百分位算法，默认使用构造时指定的算法
+
+        output:
+            quantile: 历史估值百分位 (0.7)，输入为数组时返回同样长度的ndarray；没有历史数据时为NaN
+        """
+        mode = mode or self._mode
+        factors = np.asarray(factor, dtype='float64')
+
+        if len(self._values) == 0:
+            result = np.full(factors.shape, np.nan)
+        elif mode == ECDF_MODE:
+            result = np.searchsorted(self._values, factors, side='right') / float(len(self._values))
+        else:
+            deciles = self._deciles
+            idx = np.searchsorted(deciles, factors, side='right')
+            upper = deciles[np.minimum(idx, 10)]
+            # idx为0时与原算法一致，取 deciles[-1]
+            lower = deciles[idx - 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                quantile = (idx - (upper - factors) / (upper - lower)) / 10.0
+            result = np.where(idx < 10, quantile, 1.0)
+
+        if result.ndim == 0:
+            return float(result)
+        return result
+
+
+def decile_quantile(deciles, factors):
+    """
+    每行一组十分位点的向量化百分位，与 HistoryDistribution.quantile (decile) 一致
+
+    input:
+        deciles: (..., 11) 十分位点
+        factors: (...) 要查询的值
+    """
+    idx = (deciles <= factors[..., None]).sum(axis=-1)
+    upper = np.take_along_axis(deciles, np.minimum(idx, 10)[..., None], axis=-1)[..., 0]
+    lower = np.take_along_axis(deciles, ((idx - 1) % 11)[..., None], axis=-1)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quantile = (idx - (upper - factors) / (upper - lower)) / 10.0
+    return np.where(idx < 10, quantile, 1.0)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""指数成分股时间线
+
+指数成分股一般半年才调整一次，逐日调用 get_index_stocks 绝大部分时候拿到的都是同一份名单。
+这里按指数保存成分股的调入、调出日期，查询某天的成分股时二分查找，
+查询一段时间内每天的成分股时一次批量返回，并且落盘，历史扫描时不再逐日访问数据源。
+
+从数据源补齐时默认逐个交易日核对一次(每天一次查询，只在第一次补齐时发生，之后读本地)，记录成分股变化的日期。
+也可以用 probe_interval > 1 按间隔抽样，相邻两次抽样成分股不同时再二分查找具体的调整日，查询次数少得多，
+但有一个盲区: 两次抽样之间调整后又恢复原样(A→B→A)的成分股不会被记录，这几天的 get_members 会返回调整前的成分股。
+"""
+
+import bisect
+import os
+import pandas as pd
+from provider import get_provider, to_date
+
+# 默认的本地存储目录，设为None时只在内存中缓存
+INDEX_TIMELINE_PATH = os.path.join(os.path.expanduser('~'), '.kanglong', 'index_timeline')
+
+# 补齐数据时抽样的交易日间隔，为1时逐日核对；大于1时短于这个间隔又恢复原样的调整会被漏掉
+PROBE_INTERVAL = 1
+
+
+class IndexConstituentTimeline(object):
+    """每个指数保存一组成分股快照:
+
+        days: 成分股发生变化的交易日，升序
+        members: 从对应交易日开始生效的成分股集合
+        begin, end: 已经和数据源核对过的交易日区间
+
+    落盘时转换为调入、调出日期的变更记录:
+
+        path/<index_code>.csv: code, entry_date, exit_date (exit_date为空代表仍在指数中)
+        path/coverage.csv: index_code, begin, end
+    """
+
+    def __init__(self, path=INDEX_TIMELINE_PATH, probe_interval=PROBE_INTERVAL):
+        """
+        input:
+            path: 本地存储目录，为None时只缓存在内存中
+            probe_interval: 补齐数据时抽样的交易日间隔，默认为1，逐日核对，没有盲区
+        """
+        self._path = path
+        self._probe_interval = probe_interval
+        self._timelines = {}
+        self._trade_days = None
+
+    def _get_trade_days(self):
+        if self._trade_days is None:
+            self._trade_days = list(get_provider().get_all_trade_days())
+        return self._trade_days
+
+    def _last_trade_day(self, day):
+        """不晚于day的最近一个交易日"""
+        trade_days = self._get_trade_days()
+        idx = bisect.bisect_right(trade_days, to_date(day))
+        return trade_days[idx - 1] if idx > 0 else trade_days[0]
+
+    def _load(self, index_code):
+        if index_code in self._timelines:
+            return self._timelines[index_code]
+
+        timeline = None
+        coverage_file = os.path.join(self._path, 'coverage.csv') if self._path else None
+        if coverage_file and os.path.exists(coverage_file):
+            coverage = pd.read_csv(coverage_file, dtype={'index_code': str}).set_index('index_code')
+            if index_code in coverage.index:
+                intervals = pd.read_csv(os.path.join(self._path, '{}.csv'.format(index_code)), dtype={'code': str})
+                timeline = self._from_intervals(intervals,
+                                                to_date(coverage.loc[index_code, 'begin']),
+                                                to_date(coverage.loc[index_code, 'end']))
+
+        self._timelines[index_code] = timeline
+        return timeline
+
+    def _save(self, index_code):
+        if not self._path:
+            return
+
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+
+        timeline = self._timelines[index_code]
+        self._to_intervals(timeline).to_csv(os.path.join(self._path, '{}.csv'.format(index_code)), index=False)
+
+        coverage_file = os.path.join(self._path, 'coverage.csv')
+        if os.path.exists(coverage_file):
+            coverage = pd.read_csv(coverage_file, dtype={'index_code': str}).set_index('index_code')
+        else:
+            coverage = pd.DataFrame(columns=['begin', 'end'])
+        coverage.loc[index_code] = [timeline['begin'].strftime('%Y-%m-%d'), timeline['end'].strftime('%Y-%m-%d')]
+        coverage.to_csv(coverage_file, index_label='index_code')
+
+    @staticmethod
+    def _to_intervals(timeline):
+        """成分股快照 -> 调入、调出日期"""
+        rows = []
+        entries = {}
+        previous = frozenset()
+        for day, members in zip(timeline['days'], timeline['members']):
+            for code in members - previous:
+                entries[code] = day
+            for code in previous - members:
+                rows.append((code, entries.pop(code), day))
+            previous = members
+        for code, entry in entries.items():
+            rows.append((code, entry, None))
+
+        df = pd.DataFrame(rows, columns=['code', 'entry_date', 'exit_date'])
+        return df.sort_values(['entry_date', 'code']).reset_index(drop=True)
+
+    @staticmethod
+    def _from_intervals(intervals, begin, end):
+        """调入、调出日期 -> 成分股快照"""
+        entry_dates = pd.to_datetime(intervals['entry_date'])
+        exit_dates = pd.to_datetime(intervals['exit_date'])
+
+        days = sorted(set(entry_dates) | set(exit_dates.dropna()))
+        members = []
+        for day in days:
+            alive = (entry_dates <= day) & (exit_dates.isnull() | (exit_dates > day))
+            members.append(frozenset(intervals[alive]['code']))
+        return {'days': [day.date() for day in days], 'members': members, 'begin': begin, 'end': end}
+
+    def _scan(self, index_code, days, lo, hi, lo_members, hi_members, fetched):
+        """
+        在交易日 days[lo] ~ days[hi] 之间二分查找成分股的每一次调整
+
+        output:
+            [(调整日, 调整后的成分股)]
+        """
+        def fetch(idx):
+            if idx not in fetched:
+                fetched[idx] = frozenset(get_provider().get_index_stocks(index_code, days[idx]))
+            return fetched[idx]
+
+        fetched[lo] = lo_members
+        fetched[hi] = hi_members
+        changes = []
+        while lo_members != hi_members:
+            left, right = lo, hi
+            while right - left > 1:
+                mid = (left + right) // 2
+                if fetch(mid) == lo_members:
+                    left = mid
+                else:
+                    right = mid
+            lo, lo_members = right, fetch(right)
+            changes.append((days[lo], lo_members))
+        return changes
+
+    def _probe(self, index_code, days, members):
+        """
+        从 days[0] (成分股为 members) 开始，每隔 probe_interval 个交易日抽样，一直核对到 days[-1]；
+        相邻两次抽样之间调整后又恢复原样的成分股不会被发现
+
+        output:
+            [(调整日, 调整后的成分股)]
+        """
+        changes = []
+        fetched = {}
+        lo = 0
+        while lo < len(days) - 1:
+            hi = min(lo + self._probe_interval, len(days) - 1)
+            hi_members = frozenset(get_provider().get_index_stocks(index_code, days[hi]))
+            changes.extend(self._scan(index_code, days, lo, hi, members, hi_members, fetched))
+            lo, members = hi, hi_members
+        return changes
+
+    def fill(self, index_code, begin, end):
+        """
+        从数据源补齐 [begin, end] 之间的成分股变更，已经核对过的区间不再访问数据源
+
+        input:
+            index_code: 指数代码
+            begin, end: 日期
+        """
+        trade_days = self._get_trade_days()
+        begin = self._last_trade_day(begin)
+        end = self._last_trade_day(end)
+
+        timeline = self._load(index_code)
+        if timeline is not None and timeline['begin'] <= begin and timeline['end'] >= end:
+            return
+
+        if timeline is None:
+            members = frozenset(get_provider().get_index_stocks(index_code, begin))
+            timeline = {'days': [begin], 'members': [members], 'begin': begin, 'end': begin}
+
+        changes = list(zip(timeline['days'], timeline['members']))
+
+        if begin < timeline['begin']:
+            # 向前补齐
+            days = trade_days[bisect.bisect_left(trade_days, begin):bisect.bisect_right(trade_days, timeline['begin'])]
+            members = frozenset(get_provider().get_index_stocks(index_code, begin))
+            changes = [(begin, members)] + self._probe(index_code, days, members) + changes
+            timeline['begin'] = begin
+
+        if end > timeline['end']:
+            # 向后补齐
+            days = trade_days[bisect.bisect_left(trade_days, timeline['end']):bisect.bisect_right(trade_days, end)]
+            changes += self._probe(index_code, days, changes[-1][1])
+            timeline['end'] = end
+
+        # 合并相邻的相同快照
+        timeline['days'], timeline['members'] = [], []
+        for day, members in changes:
+            if not timeline['members'] or timeline['members'][-1] != members:
+                timeline['days'].append(day)
+                timeline['members'].append(members)
+
+        self._timelines[index_code] = timeline
+        self._save(index_code)
+
+    def get_members(self, index_code, day):
+        """
+        二分查找指定日期的成分股
+
+        output:
+            成分股代码列表
+        """
+        self.fill(index_code, day, day)
+        timeline = self._timelines[index_code]
+        idx = bisect.bisect_right(timeline['days'], self._last_trade_day(day))
+        return sorted(timeline['members'][idx - 1]) if idx > 0 else []
+
+    def get_members_on_days(self, index_code, days):
+        """
+        一次批量查询多个日期的成分股
+
+        output:
+            {日期: 成分股代码列表}
+        """
+        if len(days) == 0:
+            return {}
+
+        self.fill(index_code, min(days), max(days))
+        timeline = self._timelines[index_code]
+        result = {}
+        for day in days:
+            idx = bisect.bisect_right(timeline['days'], self._last_trade_day(day))
+            result[day] = sorted(timeline['members'][idx - 1]) if idx > 0 else []
+        return result
+
+    def get_snapshots(self, index_code, days):
+        """
+        批量查询多个日期所在的成分股快照，成分股没有变化的日期共用同一个快照
+
+        output:
+            (positions, snapshots): positions[i] 为 days[i] 所在快照的序号，-1代表当天没有成分股；
+                                    snapshots 为按时间排列的成分股集合列表
+        """
+        if len(days) == 0:
+            return [], []
+
+        self.fill(index_code, min(days), max(days))
+        timeline = self._timelines[index_code]
+        positions = [bisect.bisect_right(timeline['days'], self._last_trade_day(day)) - 1 for day in days]
+        return positions, timeline['members']
+
+    def get_members_between(self, index_code, begin, end):
+        """
+        查询 [begin, end] 区间内所有出现过的成分股及其调入、调出日期
+
+        output:
+            DataFrame, 列为 code, entry_date, exit_date，entry_date早于begin的按实际调入日期给出
+        """
+        self.fill(index_code, begin, end)
+        intervals = self._to_intervals(self._timelines[index_code])
+        entry_dates = pd.to_datetime(intervals['entry_date'])
+        exit_dates = pd.to_datetime(intervals['exit_date'])
+        alive = (entry_dates <= pd.Timestamp(to_date(end))) & \
+                (exit_dates.isnull() | (exit_dates > pd.Timestamp(to_date(begin))))
+        return intervals[alive].reset_index(drop=True)
+
+
+_index_timeline = None
+
+
+def get_index_timeline():
+    """进程内共享的成分股时间线"""
+    global _index_timeline
+    if _index_timeline is None:
+        _index_timeline = IndexConstituentTimeline()
+    return _index_timeline
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""KLYHStrategy 的整段历史仓位信号
+
+KLYHStrategy 每次只针对一个 base_date，要得到回测中每一天的信号需要逐日创建策略对象，每个对象各自读取历史窗口。
+这里对一个指数的整段日期一次算出推荐仓位:
+
+    signals = compute_signal_series('000300.XSHG', '2005-01-01', '2020-01-01')
+
+每天的 pe、pb 由估值面板一次算出；历史窗口 (day - history_days, day) 在采样序列上二分查找，
+相邻日期的窗口大多相同(采样间隔为7个交易日)，每个不同的窗口只计算一次十分位点和平均ROE。
+策略规则只依赖 pe、pb、十分位点和平均ROE(decile 百分位只用到11个十分位点)，所有日期向量化计算，
+结果与逐日的 KLYHStrategy(IndexStockBeta(index_code, base_date=day, history_days=history_days, incremental=True)) 一致。
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from distribution import decile_quantile
+from mstragegy import KLYHStrategy
+from provider import get_provider, to_date
+from valuation_history import compute_index_history, get_valuation_history
+
+# 策略参数，即 KLYHStrategy 的类属性
+STRATEGY_PARAMS = ['EXPECTED_EARN_RATE', 'EXPECTED_EARN_YEAR', 'SYSTEM_LOW_PE', 'SYSTEM_LOW_PB', 'SYSTEM_LOW_ROE',
+                   'SYSTEM_HIGH_PE', 'SYSTEM_HIGH_PB', 'BUY_QUANTILE', 'BUY_MAX_PB', 'BUY_DEBT_MULTIPLE',
+                   'BOTH_LOW_QUANTILE', 'SELL_QUANTILE', 'SELL_DEBT_MULTIPLE', 'SELL_LADDER']
+
+# 每个 指数 × 日期 的特征: pe, pb, 平均roe, pe十分位点(11个), pb十分位点(11个), 基金净值
+PE, PB, AVG_ROE = 0, 1, 2
+PE_DECILES = slice(3, 14)
+PB_DECILES = slice(14, 25)
+NAV = 25
+FEATURE_COUNT = 26
+
+
+def get_strategy_params(strategy_class=KLYHStrategy, params=None):
+    """
+    策略类当前的参数
+
+    input:
+        strategy_class: KLYHStrategy 或其子类
+        params: 覆盖其中的部分参数，参数名必须在 STRATEGY_PARAMS 中
+    """
+    unknown = set(params or {}) - set(STRATEGY_PARAMS)
+    if unknown:
+        raise ValueError('未知的策略参数: {}'.format(', '.join(sorted(unknown))))
+
+    result = {name: getattr(strategy_class, name) for name in STRATEGY_PARAMS}
+    result.update(params or {})
+    return result
+
+
+def compute_window_features(series, days, history_days=5*365):
+    """
+    每天的历史窗口特征，窗口与 IndexStockBeta(base_date=day, history_days) 一致，为 (day - history_days, day)，不包含两端
+
+    input:
+        series: 采样的历史估值序列，index为日期，列为pe，pb，roe，需要覆盖 (days[0] - history_days, days[-1])
+        days: 日期列表
+        history_days: 历史窗口的自然日数
+
+    output:
+        (日期个数, FEATURE_COUNT) 的特征矩阵，只填 AVG_ROE, PE_DECILES, PB_DECILES，其余为nan
+    """
+    features = np.full((len(days), FEATURE_COUNT), np.nan)
+    if len(days) == 0:
+        return features
+
+    series_days = np.array(list(series.index), dtype='datetime64[D]')
+    day_values = np.array([to_date(day) for day in days], dtype='datetime64[D]')
+    begins = np.searchsorted(series_days, day_values - np.timedelta64(history_days, 'D'), side='right')
+    ends = np.searchsorted(series_days, day_values, side='left')
+
+    # 相同的窗口只计算一次
+    windows, inverse = np.unique(np.stack([begins, ends], axis=1), axis=0, return_inverse=True)
+    inverse = np.asarray(inverse).reshape(-1)
+    window_features = np.full((len(windows), FEATURE_COUNT), np.nan)
+    columns = {column: series[column].astype('float64').values for column in ['pe', 'pb', 'roe']}
+    for k, (begin, end) in enumerate(windows):
+        for column, deciles in (('pe', PE_DECILES), ('pb', PB_DECILES)):
+            values = columns[column][begin:end]
+            values = values[~np.isnan(values)]
+            if len(values):
+                window_features[k, deciles] = np.percentile(values, np.arange(11) * 10.0)
+        roes = columns['roe'][begin:end]
+        roes = roes[~np.isnan(roes)]
+        if len(roes):
+            window_features[k, AVG_ROE] = roes.mean()
+
+    features[:] = window_features[inverse]
+    return features
+
+
+def get_positions(features, params, national_debt_rate=0.035):
+    """
+    对所有 指数 × 日期 一次算出推荐仓位，与 KLYHStrategy.get_trading_position 的规则一致
+
+    input:
+        features: (..., FEATURE_COUNT) 特征
+        params: 完整的参数字典，见 get_strategy_params
+        national_debt_rate: 国债利率，可以是与 features[..., 0] 形状相同的数组
+
+    output:
+        与 features[..., 0] 形状相同的仓位，-1 ~~ 1，没有估值数据时为0
+    """
+    pe, pb, avg_roe = features[..., PE], features[..., PB], features[..., AVG_ROE]
+    pe_deciles, pb_deciles = features[..., PE_DECILES], features[..., PB_DECILES]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pe_quantile = decile_quantile(pe_deciles, pe)
+        pb_quantile = decile_quantile(pb_deciles, pb)
+
+        system_low = (pe < params['SYSTEM_LOW_PE']) & (pb < params['SYSTEM_LOW_PB']) & (pb / pe > params['SYSTEM_LOW_ROE'])
+        system_high = (pe > params['SYSTEM_HIGH_PE']) | (pb > params['SYSTEM_HIGH_PB'])
+        buy = (((pe_quantile < params['BUY_QUANTILE']) & (pb_quantile < params['BUY_QUANTILE']) &
+                (pb < params['BUY_MAX_PB'])) |
+               ((pb_quantile < params['BUY_QUANTILE']) & (1.0 / pe > national_debt_rate * params['BUY_DEBT_MULTIPLE'])) |
+               ((pe_quantile < params['BOTH_LOW_QUANTILE']) & (pb_quantile < params['BOTH_LOW_QUANTILE'])))
+        sell = (((pe_quantile > params['SELL_QUANTILE']) & (pb_quantile > params['SELL_QUANTILE'])) |
+                (1.0 / pe < national_debt_rate * params['SELL_DEBT_MULTIPLE']))
+
+        # 买入: 凯利公式
+        odds = pow(1 + params['EXPECTED_EARN_RATE'], params['EXPECTED_EARN_YEAR'])
+        except_sell_pe = odds / np.power(1 + avg_roe, params['EXPECTED_EARN_YEAR']) * pe
+        win_rate = 1.0 - decile_quantile(pe_deciles, except_sell_pe)
+        buy_position = (odds * win_rate - (1.0 - win_rate)) / odds
+        buy_position = np.where(buy_position > 0, buy_position, 0.0)
+
+        # 卖出: 按PE百分位的阶梯
+        sell_position = np.zeros(pe.shape)
+        for lower, ladder_position in params['SELL_LADDER']:
+            sell_position = np.where(pe_quantile >= lower, ladder_position, sell_position)
+
+    return np.select([system_low, system_high, buy, sell], [1.0, -1.0, buy_position, sell_position], 0.0)
+
+
+def compute_signal_series(index_code, start_date=None, end_date=None, days=None, index_type=0, interval=7,
+                          history_days=5*365, params=None, strategy_class=KLYHStrategy, national_debt_rate=0.035):
+    """
+    一个指数在一段日期中每天的推荐仓位
+
+    input:
+        index_code: 指数代码
+        start_date, end_date: 日期区间，取其中的交易日
+        days: 直接给出日期列表，此时忽略 start_date, end_date
+        index_type, interval, history_days: 与 IndexStockBeta 的参数一致，mstragegy.weekly 使用 history_days=5*365
+        params: 覆盖策略类的参数，比如 {'BUY_QUANTILE': 0.25}
+        strategy_class: 提供默认参数的策略类
+        national_debt_rate: 国债利率，可以是与日期对齐的序列
+
+    output:
+        DataFrame, index为日期，列为 pe, pb, pe_quantile, pb_quantile, avg_roe, position；
+        没有估值数据的日期 pe, pb 为nan，仓位为0
+    """
+    params = get_strategy_params(strategy_class, params)
+    if days is None:
+        days = get_provider().get_trade_days(start_date=start_date, end_date=end_date)
+    days = sorted(set(to_date(day) for day in days))
+    columns = ['pe', 'pb', 'pe_quantile', 'pb_quantile', 'avg_roe', 'position']
+    if not days:
+        return pd.DataFrame(columns=columns)
+
+    series = get_valuation_history().get_history(index_code, index_type, interval,
+                                                 days[0] - timedelta(history_days), days[-1])
+    features = compute_window_features(series, days, history_days)
+    current = compute_index_history(index_code, index_type, days).reindex(days)
+    features[:, PE] = current['pe'].astype('float64').values
+    features[:, PB] = current['pb'].astype('float64').values
+
+    national_debt_rate = np.asarray(national_debt_rate, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pe_quantile = decile_quantile(features[:, PE_DECILES], features[:, PE])
+        pb_quantile = decile_quantile(features[:, PB_DECILES], features[:, PB])
+
+    return pd.DataFrame({
+        'pe': features[:, PE],
+        'pb': features[:, PB],
+        'pe_quantile': pe_quantile,
+        'pb_quantile': pb_quantile,
+        'avg_roe': features[:, AVG_ROE],
+        'position': get_positions(features, params, national_debt_rate),
+    }, index=days)[columns]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""KLYHStrategy 参数扫描
+
+KLYHStrategy 的买卖阈值(百分位、凯利公式的期望收益、卖出阶梯等)都是类属性，这里对一组参数网格逐个回测:
+
+    inputs = prepare_inputs(INDEX_STOCKS, '2014-01-01', '2020-01-01')
+    results = sweep(inputs, {'BUY_QUANTILE': [0.2, 0.3], 'EXPECTED_EARN_RATE': [0.12, 0.15]})
+
+prepare_inputs 在主进程中把每个指数每个调仓日的 pe、pb、历史估值的十分位点和平均ROE、基金净值一次算好，
+策略规则只依赖这些值(decile 百分位只用到11个十分位点)，与参数无关。
+sweep 把它们放在共享内存中，进程池的每个进程只映射这块内存，不再逐个任务序列化；
+每组参数对所有 指数 × 调仓日 向量化计算仓位，再按 mstragegy.weekly 的下单规则模拟组合，最后按收益排序。
+
+模拟时按调仓日的净值申购、赎回，不计费用(与 mstragegy.py 的设置一致)，赎回的资金下一个调仓日才能使用。
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from klyh_signal import (AVG_ROE, FEATURE_COUNT, NAV, PB, PE, STRATEGY_PARAMS, compute_window_features, get_positions,
+                         get_strategy_params)
+from mstragegy import KLYHStrategy
+from provider import get_provider, to_date
+from valuation_history import compute_index_history, get_valuation_history
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# 每年的交易日数
+TRADE_DAYS_PER_YEAR = 244
+
+# 可以扫描的参数，即 KLYHStrategy 的类属性
+SWEEP_PARAMS = STRATEGY_PARAMS
+
+
+def get_default_params(strategy_class=KLYHStrategy):
+    """策略类当前的参数"""
+    return get_strategy_params(strategy_class)
+
+
+def get_param_grid(grid):
+    """
+    参数网格 -> 参数组合列表
+
+    input:
+        grid: {参数名: 取值列表}，参数名为 SWEEP_PARAMS 中的类属性
+
+    output:
+        [{参数名: 值}]，所有组合
+    """
+    unknown = set(grid) - set(SWEEP_PARAMS)
+    if unknown:
+        raise ValueError('未知的策略参数: {}'.format(', '.join(sorted(unknown))))
+
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+class SweepInputs(object):
+    """所有参数组合共用的预计算数据"""
+
+    def __init__(self, index_codes, fund_codes, days, decision_positions, features, navs):
+        """
+        input:
+            index_codes, fund_codes: 指数代码及对应的基金代码
+            days: 回测区间的全部交易日
+            decision_positions: 调仓日在days中的位置
+            features: (指数个数, 调仓日个数, FEATURE_COUNT) 的特征矩阵
+            navs: (交易日个数, 指数个数) 的基金净值矩阵，用来每天估值
+        """
+        self.index_codes = index_codes
+        self.fund_codes = fund_codes
+        self.days = days
+        self.decision_positions = decision_positions
+        self.features = features
+        self.navs = navs
+
+
+def prepare_inputs(index_funds, start_date, end_date, weekday=4, index_type=0, interval=7, history_days=5*365):
+    """
+    预计算每个指数每个调仓日的策略输入，与 mstragegy.weekly 中 IndexStockBeta(history_days=5*365) 的取数一致
+
+    input:
+        index_funds: {指数代码: 基金代码}，比如 mstragegy.INDEX_STOCKS
+        start_date, end_date: 回测区间
+        weekday: 调仓日为每周的第几天(isoweekday)，mstragegy.weekly 在周四调仓
+        index_type, interval, history_days: 与 IndexStockBeta 的参数一致
+
+    output:
+        SweepInputs
+    """
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    index_codes = list(index_funds.keys())
+    fund_codes = [index_funds[index_code] for index_code in index_codes]
+    days = get_provider().get_trade_days(start_date=start_date, end_date=end_date)
+    decision_positions = np.array([i for i, day in enumerate(days) if day.isoweekday() == weekday], dtype=int)
+    decision_days = [days[i] for i in decision_positions]
+
+    history = get_valuation_history()
+    history.update_many(index_codes, [index_type], interval, start_date - timedelta(history_days), end_date)
+
+    navs = get_provider().get_price_panel(fund_codes, start_date - timedelta(30), end_date).ffill()
+    navs = navs.reindex(days)[fund_codes].values
+
+    features = np.full((len(index_codes), len(decision_days), FEATURE_COUNT), np.nan)
+    for i, index_code in enumerate(index_codes):
+        current = compute_index_history(index_code, index_type, decision_days).reindex(decision_days)
+        features[i, :, PE] = current['pe'].values
+        features[i, :, PB] = current['pb'].values
+
+        series = history.get_history(index_code, index_type, interval, start_date - timedelta(history_days), end_date)
+        window = compute_window_features(series, decision_days, history_days)
+        features[i, :, AVG_ROE:NAV] = window[:, AVG_ROE:NAV]
+        features[i, :, NAV] = navs[decision_positions, i]
+
+    return SweepInputs(index_codes, fund_codes, days, decision_positions, features, navs)
+
+
+def simulate(inputs, positions, total_cash=None, unit_cash=None):
+    """
+    按 mstragegy.weekly 的下单规则模拟组合
+
+        仓位>0且现金>10: 申购 unit_cash * 仓位，现金不够时申购全部现金
+        仓位<0: 赎回 int(持有份额 * -仓位) 份，资金下一个调仓日到账
+
+    input:
+        positions: (指数个数, 调仓日个数) 的仓位
+        total_cash, unit_cash: 初始资金和单位资金，默认与 mstragegy 的 TOTAL_CASH / UNIT_CASH 一致
+
+    output:
+        (每天的总资产 ndarray, 交易次数)
+    """
+    index_count = len(inputs.index_codes)
+    total_cash = total_cash if total_cash is not None else 50000 * index_count
+    unit_cash = unit_cash if unit_cash is not None else total_cash / index_count / 50
+
+    navs = inputs.features[:, :, NAV]
+    cash = float(total_cash)
+    # 赎回的资金下一个调仓日才能使用
+    transit_cash = 0.0
+    shares = np.zeros(index_count)
+    share_rows = np.zeros((len(inputs.decision_positions), index_count))
+    cash_rows = np.zeros(len(inputs.decision_positions))
+    trades = 0
+    for j in range(len(inputs.decision_positions)):
+        cash += transit_cash
+        transit_cash = 0.0
+        for i in range(index_count):
+            position, nav = positions[i, j], navs[i, j]
+            if not nav > 0:
+                continue
+            if position > 0 and cash > 10:
+                value = unit_cash * position if cash >= unit_cash * position else cash
+                shares[i] += value / nav
+                cash -= value
+                trades += 1
+            elif position < 0 and shares[i] > 0 and int(-shares[i] * position) > 0:
+                amount = int(-shares[i] * position)
+                shares[i] -= amount
+                transit_cash += amount * nav
+                trades += 1
+        share_rows[j] = shares
+        cash_rows[j] = cash + transit_cash
+
+    # 调仓日之间持仓不变，每天的总资产一次算出
+    rows = np.searchsorted(inputs.decision_positions, np.arange(len(inputs.days)), side='right') - 1
+    daily_shares = np.where(rows[:, None] >= 0, share_rows[np.maximum(rows, 0)], 0.0)
+    daily_cash = np.where(rows >= 0, cash_rows[np.maximum(rows, 0)], float(total_cash))
+    equity = daily_cash + (daily_shares * np.nan_to_num(inputs.navs)).sum(axis=1)
+    return equity, trades
+
+
+def evaluate(inputs, params, national_debt_rate=0.035):
+    """
+    回测一组参数
+
+    output:
+        dict: total_return(总收益率), annual_return(年化收益率), max_drawdown(最大回撤), trades(交易次数)
+    """
+    positions = get_positions(inputs.features, params, national_debt_rate)
+    equity, trades = simulate(inputs, positions)
+    years = max(len(equity) - 1, 1) / float(TRADE_DAYS_PER_YEAR)
+    total_return = equity[-1] / equity[0] - 1
+    return {
+        'total_return': total_return,
+        'annual_return': pow(1 + total_return, 1 / years) - 1,
+        'max_drawdown': (equity / np.maximum.accumulate(equity) - 1).min(),
+        'trades': trades,
+    }
+
+
+# 工作进程中映射的共享内存和预计算数据
+_worker_memory = []
+_worker_inputs = None
+
+
+def _share_array(array, memories):
+    """ndarray 复制到共享内存，返回 (名称, 形状)"""
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype='float64', buffer=memory.buf)[:] = array
+    memories.append(memory)
+    return memory.name, array.shape
+
+
+def _attach_array(name, shape):
+    memory = shared_memory.SharedMemory(name=name)
+    _worker_memory.append(memory)
+    return np.ndarray(shape, dtype='float64', buffer=memory.buf)
+
+
+def _init_worker(meta, features, navs):
+    """进程池初始化: 映射共享内存，不复制预计算数据"""
+    global _worker_inputs
+    if shared_memory is not None and isinstance(features, tuple):
+        features = _attach_array(*features)
+        navs = _attach_array(*navs)
+    _worker_inputs = SweepInputs(meta['index_codes'], meta['fund_codes'], meta['days'], meta['decision_positions'],
+                                 features, navs)
+
+
+def _evaluate_batch(batch, national_debt_rate):
+    return [evaluate(_worker_inputs, params, national_debt_rate) for params in batch]
+
+
+def sweep(inputs, grid, base_params=None, max_workers=4, batch_size=8, rank_by='annual_return',
+          national_debt_rate=0.035):
+    """
+    并行回测参数网格中的所有组合
+
+    input:
+        inputs: prepare_inputs 的结果
+        grid: {参数名: 取值列表}
+        base_params: 没有扫描的参数，默认为 KLYHStrategy 的类属性
+        max_workers: 进程数，为1时在当前进程顺序计算
+        batch_size: 每个任务包含的参数组合个数
+        rank_by: 排序的指标，从大到小
+
+    output:
+        DataFrame, 每组参数一行，列为扫描的参数和 evaluate 的指标，按 rank_by 排序，index为名次(从1开始)
+    """
+    base_params = dict(base_params or get_default_params())
+    combos = get_param_grid(grid)
+    params_list = [dict(base_params, **combo) for combo in combos]
+
+    if max_workers <= 1 or len(params_list) <= 1:
+        metrics = [evaluate(inputs, params, national_debt_rate) for params in params_list]
+    else:
+        meta = {
+            'index_codes': inputs.index_codes,
+            'fund_codes': inputs.fund_codes,
+            'days': inputs.days,
+            'decision_positions': inputs.decision_positions,
+        }
+        memories = []
+        try:
+            if shared_memory is not None:
+                features, navs = _share_array(inputs.features, memories), _share_array(inputs.navs, memories)
+            else:
+                # 没有共享内存时每个进程在初始化时复制一次
+                features, navs = inputs.features, inputs.navs
+
+            batches = [params_list[i:i + batch_size] for i in range(0, len(params_list), batch_size)]
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(meta, features, navs)) as executor:
+                results = executor.map(_evaluate_batch, batches, [national_debt_rate] * len(batches))
+                metrics = [metric for batch in results for metric in batch]
+        finally:
+            for memory in memories:
+                memory.close()
+                memory.unlink()
+
+    result = pd.concat([pd.DataFrame(combos), pd.DataFrame(metrics)], axis=1)
+    result = result.sort_values(rank_by, ascending=False, kind='mergesort').reset_index(drop=True)
+    result.index = result.index + 1
+    return result
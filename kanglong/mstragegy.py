@@ -3,9 +3,14 @@
 """低估值买入多指数组合策略
    聚宽平台运行
 """
-import bisect
-from jqdata import get_all_trade_days
+import pandas as pd
 from datetime import datetime, timedelta
+from distribution import HistoryDistribution
+from index_timeline import get_index_timeline
+from kelly_allocator import MAX_POSITION, allocate, estimate_correlation, get_index_returns
+from provider import get_provider
+from valuation_history import compute_index_history, get_valuation_history
+from valuation_store import get_valuation_store
 
 class KLYHStrategy(object):
 
@@ -15,10 +20,47 @@ class KLYHStrategy(object):
     # 期望5年达到平均收益
     EXPECTED_EARN_YEAR = 5
 
-    def __init__(self, index_stock):
+    # 系统性低估: PE<SYSTEM_LOW_PE, PB<SYSTEM_LOW_PB, ROE>SYSTEM_LOW_ROE 时满仓
+    SYSTEM_LOW_PE = 7.0
+    SYSTEM_LOW_PB = 1.0
+    SYSTEM_LOW_ROE = 0.18
+
+    # 系统性高估: PE>SYSTEM_HIGH_PE 或 PB>SYSTEM_HIGH_PB 时清仓
+    SYSTEM_HIGH_PE = 50.0
+    SYSTEM_HIGH_PB = 4.5
+
+    # 买入: PE、PB百分位都低于 BUY_QUANTILE 且 PB<BUY_MAX_PB，或 PB百分位低于 BUY_QUANTILE 且 1/PE>国债利率*BUY_DEBT_MULTIPLE，
+    #       或 PE、PB百分位都低于 BOTH_LOW_QUANTILE
+    BUY_QUANTILE = 0.3
+    BUY_MAX_PB = 2
+    BUY_DEBT_MULTIPLE = 3
+    BOTH_LOW_QUANTILE = 0.1
+
+    # 卖出: PE、PB百分位都高于 SELL_QUANTILE，或 1/PE<国债利率*SELL_DEBT_MULTIPLE
+    SELL_QUANTILE = 0.7
+    SELL_DEBT_MULTIPLE = 2
+
+    # 卖出仓位: PE百分位 >= 下限 时的仓位，从低到高排列
+    SELL_LADDER = ((0.8, -0.02), (0.85, -0.1), (0.9, -0.3), (0.95, -0.5), (0.97, -0.7), (0.99, -1))
+
+    def __init__(self, index_stock, params=None):
+        """
+        input:
+            index_stock: IndexStockBeta
+            params: 覆盖类属性中的参数，比如 {'BUY_QUANTILE': 0.25, 'EXPECTED_EARN_RATE': 0.12}
+        """
+        for name, value in (params or {}).items():
+            if not hasattr(type(self), name):
+                raise ValueError('未知的策略参数: {}'.format(name))
+            setattr(self, name, value)
+
         self._index_stock = index_stock
         self._pe, self._pb, self._roe = self._index_stock.get_index_beta_factor()
         self._history_factors = self._index_stock.get_index_beta_history_factors()
+        self._pe_distribution = HistoryDistribution(self._history_factors['pe'])
+        self._pb_distribution = HistoryDistribution(self._history_factors['pb'])
+        # (pe, 平均roe) -> (胜率, 赔率)，kelly() 算过之后 weekly 中不再重复计算
+        self._win_rate_and_odds = {}
 
     def get_trading_position(self, national_debt_rate=0.035):
         """
@@ -44,10 +86,8 @@ class KLYHStrategy(object):
         output:
             -1 ~~ 1, -1代表清仓，0代表持仓不动， 1代表全仓买入； -0.5代表清半仓，0.5代表半仓买入
         """
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pe, self._history_factors['pe'])
-        pb_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pb, self._history_factors['pb'])
+        pe_quantile = self._pe_distribution.quantile(self._pe)
+        pb_quantile = self._pb_distribution.quantile(self._pb)
 
         avg_roe = self._history_factors['roe'].mean()
 
@@ -55,23 +95,23 @@ class KLYHStrategy(object):
                                pe_quantile, self._pb, pb_quantile, avg_roe, national_debt_rate)
 
         # 当市场出现系统性机会时，满仓或清仓
-        if self._pe<7.0 and self._pb<1.0 and self._pb/self._pe>0.18:
+        if self._pe<self.SYSTEM_LOW_PE and self._pb<self.SYSTEM_LOW_PB and self._pb/self._pe>self.SYSTEM_LOW_ROE:
             print(debug_msg + '1.0')
             return 1.0
 
-        if self._pe>50.0 or self._pb>4.5:
+        if self._pe>self.SYSTEM_HIGH_PE or self._pb>self.SYSTEM_HIGH_PB:
             print(debug_msg + '-1.0')
             return -1.0
 
-        if (pe_quantile<0.3 and pb_quantile<0.3 and self._pb<2) or \
-           (pb_quantile<0.3 and 1.0/self._pe>national_debt_rate*3) or \
-           (pe_quantile<0.1 and pb_quantile<0.1):
+        if (pe_quantile<self.BUY_QUANTILE and pb_quantile<self.BUY_QUANTILE and self._pb<self.BUY_MAX_PB) or \
+           (pb_quantile<self.BUY_QUANTILE and 1.0/self._pe>national_debt_rate*self.BUY_DEBT_MULTIPLE) or \
+           (pe_quantile<self.BOTH_LOW_QUANTILE and pb_quantile<self.BOTH_LOW_QUANTILE):
             position =  self.kelly(self._pe, avg_roe, national_debt_rate, action=1)
             print("{}{:.2f}".format(debug_msg, position))
             return position
 
-        if (pe_quantile>0.7 and pb_quantile>0.7) or \
-           (1.0/self._pe<national_debt_rate*2):
+        if (pe_quantile>self.SELL_QUANTILE and pb_quantile>self.SELL_QUANTILE) or \
+           (1.0/self._pe<national_debt_rate*self.SELL_DEBT_MULTIPLE):
             position = self.kelly(self._pe, avg_roe, national_debt_rate, action=0)
             print("{}{:.2f}".format(debug_msg, position))
             return position
@@ -91,49 +131,62 @@ class KLYHStrategy(object):
         """
 
 
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        pe, self._history_factors['pe'])
+        pe_quantile = self._pe_distribution.quantile(pe)
         position = 0
         if action == 0:
-            if pe_quantile>=0.8 and pe_quantile<0.85:
-                position = -0.02
-            elif pe_quantile>=0.85 and pe_quantile<0.9:
-                position = -0.1
-            elif pe_quantile>=0.9 and pe_quantile<0.95:
-                position = -0.3
-            elif pe_quantile>=0.95 and pe_quantile<0.97:
-                position = -0.5
-            elif pe_quantile>=0.97 and pe_quantile<0.99:
-                position = -0.7
-            elif pe_quantile>=0.99:
-                position = -1
-            else:
-                pass
+            for lower, ladder_position in self.SELL_LADDER:
+                if pe_quantile >= lower:
+                    position = ladder_position
             return position
         else:
-            odds = pow(1 + self.EXPECTED_EARN_RATE, self.EXPECTED_EARN_YEAR)
-            except_sell_pe = odds / pow(1+history_avg_roe, self.EXPECTED_EARN_YEAR) * pe
-
-            win_rate = 1.0 - self._index_stock.get_quantile_of_history_factors(except_sell_pe,
-                                                                               self._history_factors['pe'])
-            print('历史平均roe:{},期待pe:{}, 胜率:{}, 赔率:{}'.format(history_avg_roe, except_sell_pe, win_rate, odds))
+            win_rate, odds = self.get_win_rate_and_odds(pe, history_avg_roe)
 
             position = (odds * win_rate - (1.0 - win_rate)) * 1.0 / odds
             return position if position > 0 else 0
 
+    def get_win_rate_and_odds(self, pe=None, history_avg_roe=None):
+        """
+        买入时凯利公式的胜率和赔率:
+            赔率: EXPECTED_EARN_YEAR 年达到 EXPECTED_EARN_RATE 年化收益
+            胜率: 按历史平均roe增长后，达到上述收益时的PE高于当前PE的历史比例
+
+        input:
+            pe: 当前pe，默认为 index_stock 的当前值
+            history_avg_roe: 历史平均roe，默认为历史估值中roe的平均值
+
+        output:
+            (win_rate, odds)，同样的 pe 和 history_avg_roe 只计算一次
+        """
+        pe = self._pe if pe is None else pe
+        history_avg_roe = self._history_factors['roe'].mean() if history_avg_roe is None else history_avg_roe
+        if (pe, history_avg_roe) in self._win_rate_and_odds:
+            return self._win_rate_and_odds[(pe, history_avg_roe)]
+
+        odds = pow(1 + self.EXPECTED_EARN_RATE, self.EXPECTED_EARN_YEAR)
+        except_sell_pe = odds / pow(1+history_avg_roe, self.EXPECTED_EARN_YEAR) * pe
+
+        win_rate = 1.0 - self._pe_distribution.quantile(except_sell_pe)
+        print('历史平均roe:{},期待pe:{}, 胜率:{}, 赔率:{}'.format(history_avg_roe, except_sell_pe, win_rate, odds))
+        self._win_rate_and_odds[(pe, history_avg_roe)] = (win_rate, odds)
+        return win_rate, odds
+
 
 class IndexStockBeta(object):
 
-    def __init__(self, index_code, index_type=0, base_date=None, history_days=365*8):
+    def __init__(self, index_code, index_type=0, base_date=None, history_days=365*8, store=None, incremental=False):
         """
         input:
             index_code: 要查询指数的代码
             index_type: 1为等权重方式计算，0为按市值加权计算
             base_date: 查询时间，格式为'yyyy-MM-dd'，默认为当天
             history_days: 默认历史区间位前八年
+            store: 本地估值仓库，默认使用进程内共享的 ValuationStore
+            incremental: get_index_beta_history_factors 的默认取数方式
         """
         self._index_code = index_code
         self._index_type = index_type
+        self._store = store if store is not None else get_valuation_store()
+        self._incremental = incremental
         if not base_date:
             self._base_date = datetime.now().date()
         else:
@@ -159,14 +212,10 @@ class IndexStockBeta(object):
         if not day:
             day = datetime.strptime(self._base_date, '%Y-%m-%d')
 
-        stocks = get_index_stocks(self._index_code, day)
-        q = query(
-            valuation.pe_ratio, valuation.pb_ratio, valuation.circulating_market_cap
-        ).filter(
-            valuation.code.in_(stocks)
-        )
+        stocks = get_index_timeline().get_members(self._index_code, day)
 
-        df = get_fundamentals(q, day)
+        # 先读本地估值仓库，本地没有的日期才会访问数据源
+        df = self._store.get_valuation(stocks, day)
 
         df = df[df['pe_ratio']>0]
 
@@ -181,36 +230,47 @@ class IndexStockBeta(object):
         else:
             return (None, None, None)
 
-    def get_index_beta_history_factors(self, interval=7):
+    def get_index_beta_history_factors(self, interval=7, bulk=True, incremental=None):
         """
         获取任意指数一段时间的历史 pe,pb 估值列表，通过计算当前的估值在历史估值的百分位，来判断当前市场的估值高低。
         由于加权方式可能不同，可能各个指数公开的估值数据有差异，但用于判断估值相对高低没有问题
 
         input：
             interval: 计算指数估值的间隔天数，增加间隔时间可提高计算性能
+            bulk: 为True时一次取出 成分股 × 日期 的估值面板，对所有采样日做一次向量化计算；
+                  为False时逐日调用 get_index_beta_factor
+            incremental: 为True时从本地保存的历史估值序列中切片，只补算缺失的采样日，
+                         此时采样日按整个交易日历对齐，而不是从 begin_date 开始数，采样日与为False时最多相差 interval-1 个交易日；
+                         为None时使用构造时的设置(默认为False)
 
         output：
             result:  指数历史估值的 DataFrame，index 为时间，列为pe，pb,roe
         """
-        all_days = get_all_trade_days()
+        if incremental is None:
+            incremental = self._incremental
 
-        pes = []
-        roes = []
-        pbs = []
-        days = []
+        if incremental:
+            return get_valuation_history().get_history(self._index_code, self._index_type, interval,
+                                                       self._begin_date, self._end_date)
+
+        all_days = get_provider().get_all_trade_days()
 
         begin = datetime.strptime(self._begin_date, '%Y-%m-%d').date()
         end = datetime.strptime(self._end_date, '%Y-%m-%d').date()
-        i = 0
-        for day in all_days:
-            if(day <= begin or day >= end):
-                continue
+        sample_days = [day for day in all_days if day > begin and day < end][interval-1::interval]
 
-            i += 1
+        # 一次性补齐本地仓库中缺失的日期，后续计算只读本地
+        self._store.fill(sample_days)
 
-            if(i % interval != 0):
-                continue
+        if bulk:
+            return compute_index_history(self._index_code, self._index_type, sample_days, self._store)
 
+        pes = []
+        roes = []
+        pbs = []
+        days = []
+
+        for day in sample_days:
             pe, pb, roe = self.get_index_beta_factor(day)
             if pe and pb and roe:
                 pes.append(pe)
@@ -232,13 +292,7 @@ class IndexStockBeta(object):
         output:
             quantile: 历史估值百分位 (0.7)
         """
-        factors = [history_list.quantile(i / 10.0)  for i in range(11)]
-        idx = bisect.bisect(factors, factor)
-        if idx < 10:
-            quantile = idx - (factors[idx] - factor) / (factors[idx] - factors[idx-1])
-            return quantile / 10.0
-        else:
-            return 1.0
+        return HistoryDistribution(history_list).quantile(factor)
 
 BENCHMARK_INDEX_STOCK = '000300.XSHG'
 INDEX_STOCKS = {
@@ -261,6 +315,14 @@ INDEX_STOCKS = {
 TOTAL_CASH = 50000 * len(INDEX_STOCKS)
 UNIT_CASH = TOTAL_CASH / len(INDEX_STOCKS) / 50
 
+# 为True时，同一天出现买入信号的指数由 kelly_allocator 在组合层面按相关性分配仓位，总仓位受控；
+# 为False时每个指数单独按 UNIT_CASH * 仓位 买入
+USE_KELLY_ALLOCATOR = False
+
+# 为True时在 initialize 中一次补齐回测区间内所有指数的历史估值(并保存到本地)，离线回测时打开；
+# 为False时 weekly 中按需补算，聚宽平台上不做额外的预取
+PREFETCH_VALUATION_HISTORY = False
+
 
 # =============================================================
 # 初始化函数，设定基准等等
@@ -293,6 +355,12 @@ def initialize(context):
 
     run_daily(weekly, time='every_bar')
 
+    if PREFETCH_VALUATION_HISTORY:
+        # 一次补齐回测区间内所有指数的历史估值，weekly 中只从保存的序列中切片
+        get_valuation_history().update_many(list(INDEX_STOCKS.keys()), [0], 7,
+                                            context.run_params.start_date - timedelta(5*365),
+                                            context.run_params.end_date)
+
 ## 开盘前运行函数
 def before_market_open(context):
     pass
@@ -310,6 +378,7 @@ def weekly(context):
         # 不在周四, 跳过执行
         return
 
+    buys = {}
     for stock_index, stock_fund in INDEX_STOCKS.items():
         fund_info = get_fund_info(stock_fund)
         cash = context.portfolio.available_cash
@@ -323,11 +392,15 @@ def weekly(context):
         print("cash:{}, fund:{}, fund_value:{}, fund_amount:{}".format(cash, fund_info['fund_name'], fund_value, fund_amount))
 
         current_date = context.current_dt.strftime("%Y-%m-%d")
-        stock = IndexStockBeta(stock_index, base_date=current_date, history_days=5*365)
+        # 每周调仓从本地保存的历史估值序列中切片，采样日按交易日历对齐，与 klyh_signal 一致
+        stock = IndexStockBeta(stock_index, base_date=current_date, history_days=5*365, incremental=True)
         stragety = KLYHStrategy(stock)
         position = stragety.get_trading_position()
 
-        if position > 0 and cash > 10:
+        if position > 0 and USE_KELLY_ALLOCATOR:
+            # kelly() 已经算过，这里直接取缓存的结果
+            buys[stock_index] = stragety.get_win_rate_and_odds()
+        elif position > 0 and cash > 10:
             if cash >= UNIT_CASH*position:
                 purchase(stock_fund, UNIT_CASH*position)
             else:
@@ -340,6 +413,35 @@ def weekly(context):
         else:
             print('HOLDING')
 
+    if buys:
+        purchase_by_allocator(context, buys)
+
+def purchase_by_allocator(context, buys):
+    """
+    按组合凯利仓位买入，目标市值为 仓位 * 总资产，已经持有的部分不重复买入
+
+    input:
+        buys: {指数代码: (胜率, 赔率)}，本次出现买入信号的指数
+    """
+    index_codes = list(buys.keys())
+    correlation = estimate_correlation(get_index_returns(index_codes, context.current_dt))
+
+    total_value = context.portfolio.total_value
+    fund_values = [context.portfolio.positions[INDEX_STOCKS[index_code]].value for index_code in index_codes]
+    # 没有买入信号的指数已经占用的仓位
+    other_value = context.portfolio.positions_value - sum(fund_values)
+    max_total = max(0.0, 1.0 - other_value / total_value)
+
+    positions = allocate([buys[index_code][0] for index_code in index_codes],
+                         [buys[index_code][1] for index_code in index_codes],
+                         correlation, MAX_POSITION, max_total)
+    for index_code, position, fund_value in zip(index_codes, positions, fund_values):
+        amount = position * total_value - fund_value
+        cash = context.portfolio.available_cash
+        print("fund:{}, kelly position:{:.2f}, amount:{:.2f}".format(INDEX_STOCKS[index_code], position, amount))
+        if amount > 10 and cash > 10:
+            purchase(INDEX_STOCKS[index_code], min(amount, cash))
+
 def period(context):
     pass
 
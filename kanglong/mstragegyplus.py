@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
 # 导入函数库
-import bisect
-from jqdata import get_all_trade_days
 from jqdata import *
 from datetime import datetime, timedelta
+from distribution import HistoryDistribution
+from provider import get_provider
+from valuation_history import get_stock_valuation_history
+from valuation_store import get_valuation_store
 
 class KLYHStrategy(object):
 
@@ -14,10 +16,45 @@ class KLYHStrategy(object):
     # 期望5年达到平均收益
     EXPECTED_EARN_YEAR = 5
 
-    def __init__(self, index_stock):
+    # 系统性低估: PE<SYSTEM_LOW_PE, PB<SYSTEM_LOW_PB, ROE>SYSTEM_LOW_ROE 时满仓
+    SYSTEM_LOW_PE = 7.0
+    SYSTEM_LOW_PB = 1.0
+    SYSTEM_LOW_ROE = 0.18
+
+    # 系统性高估: PE>SYSTEM_HIGH_PE 或 PB>SYSTEM_HIGH_PB 时清仓
+    SYSTEM_HIGH_PE = 50.0
+    SYSTEM_HIGH_PB = 6
+
+    # 买入: PE、PB百分位都低于 BUY_QUANTILE 且 PB<BUY_MAX_PB，或 PB百分位低于 BUY_QUANTILE 且 1/PE>国债利率*BUY_DEBT_MULTIPLE，
+    #       或 PE、PB百分位都低于 BOTH_LOW_QUANTILE
+    BUY_QUANTILE = 0.3
+    BUY_MAX_PB = 2
+    BUY_DEBT_MULTIPLE = 3
+    BOTH_LOW_QUANTILE = 0.1
+
+    # 卖出: PE、PB百分位都高于 SELL_QUANTILE，或 1/PE<国债利率*SELL_DEBT_MULTIPLE
+    SELL_QUANTILE = 0.7
+    SELL_DEBT_MULTIPLE = 2
+
+    # 卖出仓位: PE百分位 >= 下限 时的仓位，从低到高排列
+    SELL_LADDER = ((0.95, -0.1), (0.97, -0.2), (0.99, -0.7))
+
+    def __init__(self, index_stock, params=None):
+        """
+        input:
+            index_stock: StockBeta
+            params: 覆盖类属性中的参数，比如 {'BUY_QUANTILE': 0.25, 'EXPECTED_EARN_RATE': 0.12}
+        """
+        for name, value in (params or {}).items():
+            if not hasattr(type(self), name):
+                raise ValueError('未知的策略参数: {}'.format(name))
+            setattr(self, name, value)
+
         self._index_stock = index_stock
         self._pe, self._pb, self._roe = self._index_stock.get_stock_beta_factor()
         self._history_factors = self._index_stock.get_stock_beta_history_factors()
+        self._pe_distribution = HistoryDistribution(self._history_factors['pe'])
+        self._pb_distribution = HistoryDistribution(self._history_factors['pb'])
 
     def get_trading_position(self, national_debt_rate=0.035):
         """
@@ -43,33 +80,31 @@ class KLYHStrategy(object):
         output:
             -1 ~~ 1, -1代表清仓，0代表持仓不动， 1代表全仓买入； -0.5代表清半仓，0.5代表半仓买入
         """
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pe, self._history_factors['pe'])
-        pb_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pb, self._history_factors['pb'])
+        pe_quantile = self._pe_distribution.quantile(self._pe)
+        pb_quantile = self._pb_distribution.quantile(self._pb)
 
         avg_roe = self._history_factors['roe'].mean()
 
         debug_msg = "当前PE:{:.2f},百分位:{:.2f}，当前PB{:.2f},百分位:{:.2f},平均ROE:{:.2f}, 国债利率:{},推荐仓位:".format(self._pe,
                                pe_quantile, self._pb, pb_quantile, avg_roe, national_debt_rate)
         # 当市场出现系统性机会时，满仓或清仓
-        if self._pe<7.0 and self._pb<1.0 and self._pb/self._pe>0.18:
+        if self._pe<self.SYSTEM_LOW_PE and self._pb<self.SYSTEM_LOW_PB and self._pb/self._pe>self.SYSTEM_LOW_ROE:
             print(debug_msg + '1.0')
             return 1.0
 
-        if self._pe>50.0 or self._pb>6:
+        if self._pe>self.SYSTEM_HIGH_PE or self._pb>self.SYSTEM_HIGH_PB:
             print(debug_msg + '-1.0')
             return -1.0
 
-        if (pe_quantile<0.3 and pb_quantile<0.3 and self._pb<2) or \
-           (pb_quantile<0.3 and 1.0/self._pe>national_debt_rate*3) or \
-           (pe_quantile<0.1 and pb_quantile<0.1):
+        if (pe_quantile<self.BUY_QUANTILE and pb_quantile<self.BUY_QUANTILE and self._pb<self.BUY_MAX_PB) or \
+           (pb_quantile<self.BUY_QUANTILE and 1.0/self._pe>national_debt_rate*self.BUY_DEBT_MULTIPLE) or \
+           (pe_quantile<self.BOTH_LOW_QUANTILE and pb_quantile<self.BOTH_LOW_QUANTILE):
             position =  self.kelly(self._pe, avg_roe, national_debt_rate, action=1)
             print("{}{:.2f}".format(debug_msg, position))
             return position
 
-        if (pe_quantile>0.7 and pb_quantile>0.7) or \
-           (1.0/self._pe<national_debt_rate*2):
+        if (pe_quantile>self.SELL_QUANTILE and pb_quantile>self.SELL_QUANTILE) or \
+           (1.0/self._pe<national_debt_rate*self.SELL_DEBT_MULTIPLE):
             position = self.kelly(self._pe, avg_roe, national_debt_rate, action=0)
             print("{}{:.2f}".format(debug_msg, position))
             return position
@@ -90,26 +125,19 @@ class KLYHStrategy(object):
         """
 
 
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        pe, self._history_factors['pe'])
+        pe_quantile = self._pe_distribution.quantile(pe)
         position = 0
 
         if action == 0:
-            if pe_quantile>=0.95 and pe_quantile<0.97:
-                position = -0.1
-            elif pe_quantile>=0.97 and pe_quantile<0.99:
-                position = -0.2
-            elif pe_quantile>=0.99:
-                position = -0.7
-            else:
-                pass
+            for lower, ladder_position in self.SELL_LADDER:
+                if pe_quantile >= lower:
+                    position = ladder_position
             return position
         else:
             odds = pow(1 + self.EXPECTED_EARN_RATE, self.EXPECTED_EARN_YEAR)
             except_sell_pe = odds / pow(1+history_avg_roe, self.EXPECTED_EARN_YEAR) * pe
 
-            win_rate = 1.0 - self._index_stock.get_quantile_of_history_factors(except_sell_pe,
-                                                                               self._history_factors['pe'])
+            win_rate = 1.0 - self._pe_distribution.quantile(except_sell_pe)
             print('历史平均roe:{},期待pe:{}, 胜率:{}, 赔率:{}'.format(history_avg_roe, except_sell_pe, win_rate, odds))
 
             position = (odds * win_rate - (1.0 - win_rate)) * 1.0 / odds
@@ -118,16 +146,20 @@ class KLYHStrategy(object):
 
 class StockBeta(object):
 
-    def __init__(self, stock_code, index_type=0, base_date=None, history_days=365*8):
+    def __init__(self, stock_code, index_type=0, base_date=None, history_days=365*8, store=None, incremental=False):
         """
         input:
             index_code: 要查询指数的代码
             index_type: 1为等权重方式计算，0为按市值加权计算
             base_date: 查询时间，格式为'yyyy-MM-dd'，默认为当天
             history_days: 默认历史区间位前八年
+            store: 本地估值仓库，默认使用进程内共享的 ValuationStore
+            incremental: get_stock_beta_history_factors 的默认取数方式
         """
         self._stock_code = stock_code
         self._index_type = index_type
+        self._store = store if store is not None else get_valuation_store()
+        self._incremental = incremental
         if not base_date:
             self._base_date = datetime.now().date()
         else:
@@ -153,14 +185,8 @@ class StockBeta(object):
         if not day:
             day = datetime.strptime(self._base_date, '%Y-%m-%d')
 
-        stocks = [self._stock_code]
-        q = query(
-            valuation.pe_ratio, valuation.pb_ratio, valuation.circulating_market_cap
-        ).filter(
-            valuation.code.in_(stocks)
-        )
-
-        df = get_fundamentals(q, day)
+        # 先读本地估值仓库，本地没有的日期才会访问数据源
+        df = self._store.get_valuation([self._stock_code], day)
 
         df = df[df['pe_ratio']>0]
 
@@ -175,18 +201,28 @@ class StockBeta(object):
         else:
             return (None, None, None)
 
-    def get_stock_beta_history_factors(self, interval=7):
+    def get_stock_beta_history_factors(self, interval=7, incremental=None):
         """
         获取任意指数一段时间的历史 pe,pb 估值列表，通过计算当前的估值在历史估值的百分位，来判断当前市场的估值高低。
         由于加权方式可能不同，可能公开的估值数据有差异，但用于判断估值相对高低没有问题
 
         input：
             interval: 计算指数估值的间隔天数，增加间隔时间可提高计算性能
+            incremental: 为True时从进程内共享的股票历史估值序列中切片，只补算缺失的采样日，
+                         此时采样日按整个交易日历对齐，而不是从 begin_date 开始数，采样日与为False时最多相差 interval-1 个交易日；
+                         为False时逐日调用 get_stock_beta_factor；为None时使用构造时的设置(默认为False)
 
         output：
             result:  指数历史估值的 DataFrame，index 为时间，列为pe，pb,roe
         """
-        all_days = get_all_trade_days()
+        if incremental is None:
+            incremental = self._incremental
+
+        if incremental:
+            return get_stock_valuation_history().get_history(self._stock_code, self._index_type, interval,
+                                                             self._begin_date, self._end_date)
+
+        all_days = get_provider().get_all_trade_days()
 
         pes = []
         roes = []
@@ -226,13 +262,7 @@ class StockBeta(object):
         output:
             quantile: 历史估值百分位 (0.7)
         """
-        factors = [history_list.quantile(i / 10.0)  for i in range(11)]
-        idx = bisect.bisect(factors, factor)
-        if idx < 10:
-            quantile = idx - (factors[idx] - factor) / (factors[idx] - factors[idx-1])
-            return quantile / 10.0
-        else:
-            return 1.0
+        return HistoryDistribution(history_list).quantile(factor)
 
 BENCHMARK_INDEX_STOCK = '000300.XSHG'
 STOCKS = [
@@ -269,6 +299,10 @@ MAX_SINGLE_STOCK_VALUE = 0.2
 # 当推荐仓位大于0.2时，才能下单
 ORDER_POSITION = 0.2
 
+# 为True时在 initialize 中一次补齐回测区间内所有股票的历史估值(并保存到本地)，离线回测时打开；
+# 为False时 srun 中按需补算，聚宽平台上不做额外的预取
+PREFETCH_VALUATION_HISTORY = False
+
 # =============================================================
 # 初始化函数，设定基准等等
 def initialize(context):
@@ -297,6 +331,12 @@ def initialize(context):
     #run_weekly(srun, weekday=4, time='14:30', reference_security='000300.XSHG', force=False)
     run_monthly(srun, 3, time='14:30', reference_security='000300.XSHG', force=False)
 
+    if PREFETCH_VALUATION_HISTORY:
+        # 一次补齐回测区间内所有股票的历史估值，srun 中只从保存的序列中切片
+        get_stock_valuation_history().update_many(STOCKS, [0], 7,
+                                                  context.run_params.start_date - timedelta(5*365),
+                                                  context.run_params.end_date)
+
 ## 开盘前运行函数
 def before_market_open(context):
     # 输出运行时间
@@ -335,7 +375,8 @@ def srun(context):
         print("cash:{}, fund:{}, fund_value:{}, fund_amount:{}, total_fund_value:{}".format(cash, fund_info.display_name, fund_value, fund_amount, total_fund_value))
 
         current_date = context.current_dt.strftime("%Y-%m-%d")
-        stock = StockBeta(stock_index, base_date=current_date, history_days=5*365)
+        # 从进程内共享的股票历史估值序列中切片，采样日按交易日历对齐
+        stock = StockBeta(stock_index, base_date=current_date, history_days=5*365, incremental=True)
         stragety = KLYHStrategy(stock)
         position = stragety.get_trading_position()
 
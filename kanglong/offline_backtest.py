@@ -0,0 +1,679 @@
+# -*- coding: utf-8 -*-
+
+"""离线事件驱动回测
+
+mstragegy.py / mstragegyplus.py 只能在聚宽的回测环境中运行，这里在本地数据源上实现它们用到的聚宽接口:
+
+    initialize, run_daily / run_weekly / run_monthly,
+    purchase / redeem (场外基金), order / order_value / order_target / order_target_value (股票、场内基金),
+    set_subportfolios / SubPortfolioConfig, set_redeem_latency, set_order_cost / OrderCost,
+    set_benchmark, set_option, get_fund_info, get_security_info, get_trades, record, log, send_message
+
+策略文件不用修改，直接在本地运行:
+
+    set_provider(LocalDataProvider('/path/to/data'))
+    backtest = OfflineBacktest('kanglong/mstragegy.py', '2014-01-01', '2020-01-01',
+                               settings={'PREFETCH_VALUATION_HISTORY': True})
+    result = backtest.run()
+    print(summarize(result))
+
+交易日历和每个定时任务的运行日期在开始前一次算好；每只证券的行情在第一次下单时一次取出整个回测区间；
+逐日只执行定时任务和撮合，组合每天的市值最后用 持仓矩阵(日期 × 证券) 与 价格矩阵 一次性计算。
+
+使用日线数据，所有委托都按当天的收盘价(场外基金为单位净值)成交:
+
+    场外基金申购: T日扣款，份额T+1日才可赎回
+    场外基金赎回: T日扣减份额，资金按 set_redeem_latency 设置的交易日数到账，在途资金计入总资产
+    股票: 买入数量按100股取整，T+1日才可卖出，卖出资金当天可用
+"""
+
+import logging
+import sys
+import types
+import numpy as np
+import pandas as pd
+from datetime import datetime, time, timedelta
+from provider import get_provider, to_date
+
+# 每年的交易日数
+TRADE_DAYS_PER_YEAR = 244
+
+# 第一次取行情时多取的自然日数，用来填充回测开始时停牌、没有净值的证券
+PRICE_LOOKBACK_DAYS = 30
+
+# 没有 set_redeem_latency 时场外基金赎回资金到账的交易日数
+DEFAULT_REDEEM_LATENCY = 1
+
+# 场外基金类型，按这些类型查询证券信息
+FUND_TYPES = ('open_fund', 'stock_fund', 'bond_fund', 'mixture_fund', 'money_market_fund', 'QDII_fund', 'fund')
+
+# 运行时间 -> 当天的执行顺序
+BEFORE_OPEN = 'before_open'
+AFTER_CLOSE = 'after_close'
+MARKET_TIMES = {
+    BEFORE_OPEN: time(9, 0),
+    'open': time(9, 30),
+    'every_bar': time(9, 30),
+    AFTER_CLOSE: time(15, 30),
+}
+
+
+def get_run_time(run_time):
+    """定时任务的运行时间: 'before_open' / 'open' / 'every_bar' / 'after_close' / 'HH:MM'"""
+    if run_time in MARKET_TIMES:
+        return MARKET_TIMES[run_time]
+    return datetime.strptime(run_time, '%H:%M').time()
+
+
+def get_schedule_days(days, period, nth, force=True):
+    """
+    周期内第nth个交易日在日历中的位置
+
+    input:
+        days: 交易日列表
+        period: 'week' 或 'month'
+        nth: 从1开始，负数为倒数第几个交易日
+        force: 周期内的交易日不够nth个时，是否在最后(nth<0时为最先)一个交易日运行
+
+    output:
+        ndarray, days中的位置
+    """
+    dates = pd.to_datetime(pd.Series(days))
+    if period == 'week':
+        keys = dates.dt.isocalendar().year * 100 + dates.dt.isocalendar().week
+    else:
+        keys = dates.dt.year * 100 + dates.dt.month
+
+    groups = keys.groupby(keys)
+    position = groups.cumcount().values
+    size = groups.transform('size').values
+    target = nth - 1 if nth > 0 else size + nth
+    matched = position == target
+    if force:
+        matched |= (position == size - 1) & (target >= size) if nth > 0 else (position == 0) & (target < 0)
+    return np.flatnonzero(matched)
+
+
+class OrderCost(object):
+    """交易费用，与聚宽 OrderCost 参数一致，场外基金的申购、赎回费率用 open_commission, close_commission"""
+
+    def __init__(self, open_tax=0, close_tax=0, open_commission=0, close_commission=0, close_today_commission=0,
+                 min_commission=0):
+        self.open_tax = open_tax
+        self.close_tax = close_tax
+        self.open_commission = open_commission
+        self.close_commission = close_commission
+        self.close_today_commission = close_today_commission
+        self.min_commission = min_commission
+
+    def get_cost(self, value, is_buy):
+        """成交金额value的手续费和税"""
+        if value <= 0:
+            return 0.0
+        commission = value * (self.open_commission if is_buy else self.close_commission)
+        tax = value * (self.open_tax if is_buy else self.close_tax)
+        return max(commission, self.min_commission) + tax
+
+
+class SubPortfolioConfig(object):
+
+    def __init__(self, cash, type='stock'):
+        self.cash = cash
+        self.type = type
+
+
+class Position(object):
+    """持仓，price / value 每次执行定时任务前按当天价格更新"""
+
+    def __init__(self, security):
+        self.security = security
+        self.total_amount = 0.0
+        self.closeable_amount = 0.0
+        self.avg_cost = 0.0
+        self.price = 0.0
+        self.value = 0.0
+
+    @property
+    def amount(self):
+        return self.total_amount
+
+
+class Positions(dict):
+    """没有持仓的证券返回数量为0的 Position，与聚宽一致"""
+
+    def __missing__(self, security):
+        return Position(security)
+
+
+class SubPortfolio(object):
+
+    def __init__(self, config):
+        self.type = config.type
+        self.starting_cash = float(config.cash)
+        self.available_cash = float(config.cash)
+        # 赎回在途的资金
+        self.transit_cash = 0.0
+        self.positions = Positions()
+
+    @property
+    def positions_value(self):
+        return sum(position.value for position in self.positions.values())
+
+    @property
+    def total_value(self):
+        return self.available_cash + self.transit_cash + self.positions_value
+
+
+class Portfolio(object):
+    """所有子账户的汇总"""
+
+    def __init__(self, subportfolios):
+        self._subportfolios = subportfolios
+
+    @property
+    def available_cash(self):
+        return sum(sub.available_cash for sub in self._subportfolios)
+
+    @property
+    def transit_cash(self):
+        return sum(sub.transit_cash for sub in self._subportfolios)
+
+    @property
+    def starting_cash(self):
+        return sum(sub.starting_cash for sub in self._subportfolios)
+
+    @property
+    def positions_value(self):
+        return sum(sub.positions_value for sub in self._subportfolios)
+
+    @property
+    def total_value(self):
+        return sum(sub.total_value for sub in self._subportfolios)
+
+    @property
+    def positions(self):
+        if len(self._subportfolios) == 1:
+            return self._subportfolios[0].positions
+
+        positions = Positions()
+        for sub in self._subportfolios:
+            for security, position in sub.positions.items():
+                merged = positions.setdefault(security, Position(security))
+                merged.total_amount += position.total_amount
+                merged.closeable_amount += position.closeable_amount
+                merged.price = position.price
+                merged.value += position.value
+        return positions
+
+
+class RunParams(object):
+    """与聚宽 context.run_params 一致"""
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.type = 'simple_backtest'
+        self.frequency = 'day'
+
+
+class Context(object):
+
+    def __init__(self, subportfolios, run_params):
+        self.subportfolios = subportfolios
+        self.portfolio = Portfolio(subportfolios)
+        self.current_dt = None
+        self.previous_date = None
+        self.run_params = run_params
+
+
+class Order(object):
+
+    def __init__(self, order_id, security, amount, price, is_buy, commission, add_time):
+        self.order_id = order_id
+        self.security = security
+        self.amount = amount
+        self.filled = amount
+        self.price = price
+        self.is_buy = is_buy
+        self.commission = commission
+        self.add_time = add_time
+
+    def __repr__(self):
+        return 'Order({}, {}, amount={:.2f}, price={:.4f}, is_buy={})'.format(
+            self.add_time, self.security, self.amount, self.price, self.is_buy)
+
+
+class SecurityInfo(object):
+
+    def __init__(self, code, display_name, type):
+        self.code = code
+        self.display_name = display_name
+        self.name = display_name
+        self.type = type
+
+
+class _Log(object):
+    """聚宽 log 对象"""
+
+    def __init__(self):
+        self._logger = logging.getLogger('kanglong.backtest')
+
+    def debug(self, msg, *args):
+        self._logger.debug(msg, *args)
+
+    def info(self, msg, *args):
+        self._logger.info(msg, *args)
+
+    def warn(self, msg, *args):
+        self._logger.warning(msg, *args)
+
+    warning = warn
+
+    def error(self, msg, *args):
+        self._logger.error(msg, *args)
+
+    def set_level(self, name, level):
+        pass
+
+
+class OfflineBacktest(object):
+
+    def __init__(self, strategy, start_date, end_date, initial_cash=1000000.0, settings=None):
+        """
+        input:
+            strategy: 策略文件路径，或者包含 initialize 函数的模块
+            start_date, end_date: 回测区间
+            initial_cash: 没有调用 set_subportfolios 时股票账户的初始资金
+            settings: 在 initialize 之前覆盖策略中的全局变量，比如 {'PREFETCH_VALUATION_HISTORY': True}
+        """
+        self._strategy = strategy
+        self._settings = dict(settings or {})
+        self._initial_cash = initial_cash
+        self._days = get_provider().get_trade_days(start_date=start_date, end_date=end_date)
+        self._all_days = get_provider().get_all_trade_days()
+        self.log = _Log()
+
+        self._benchmark = None
+        self._options = {}
+        self._order_costs = {}
+        self._redeem_latency = {}
+        self._subportfolios = [SubPortfolio(SubPortfolioConfig(initial_cash))]
+        self.context = Context(self._subportfolios, RunParams(to_date(start_date), to_date(end_date)))
+        # (执行顺序, 注册序号, 运行时间, 函数, 运行日期位置的集合或None)
+        self._tasks = []
+
+        # 每只证券在 self._days 上的价格
+        self._prices = {}
+        self._security_info = None
+        self._day_index = 0
+        self._orders = []
+        self._order_id = 0
+        # (day_index, security, delta) 持仓变化，最后一次性计算每天的市值
+        self._share_events = []
+        # (解锁的day_index, 子账户, security, amount) 还不能卖出的份额
+        self._locked = []
+        # (到账的day_index, 子账户, cash) 赎回在途的资金
+        self._transit = []
+        self._cash_rows = []
+        self._records = {}
+
+    # ---------------------------------------------------------
+    # 聚宽接口
+
+    def get_api(self):
+        """注入到策略命名空间中的聚宽接口"""
+        return {
+            'log': self.log,
+            'OrderCost': OrderCost,
+            'SubPortfolioConfig': SubPortfolioConfig,
+            'set_benchmark': self.set_benchmark,
+            'set_option': self.set_option,
+            'set_order_cost': self.set_order_cost,
+            'set_slippage': self.set_slippage,
+            'set_subportfolios': self.set_subportfolios,
+            'set_redeem_latency': self.set_redeem_latency,
+            'run_daily': self.run_daily,
+            'run_weekly': self.run_weekly,
+            'run_monthly': self.run_monthly,
+            'purchase': self.purchase,
+            'redeem': self.redeem,
+            'order': self.order,
+            'order_value': self.order_value,
+            'order_target': self.order_target,
+            'order_target_value': self.order_target_value,
+            'get_fund_info': self.get_fund_info,
+            'get_security_info': self.get_security_info,
+            'get_trades': self.get_trades,
+            'record': self.record,
+            'send_message': self.send_message,
+        }
+
+    def set_benchmark(self, security):
+        self._benchmark = security
+
+    def set_option(self, name, value):
+        self._options[name] = value
+
+    def set_order_cost(self, cost, type='stock', ref=None):
+        self._order_costs[ref or type] = cost
+
+    def set_slippage(self, slippage, type=None, ref=None):
+        """按收盘价成交，不计滑点"""
+        pass
+
+    def set_subportfolios(self, configs):
+        self._subportfolios[:] = [SubPortfolio(config) for config in configs]
+
+    def set_redeem_latency(self, day, type='stock_fund'):
+        self._redeem_latency[type] = day
+
+    def _add_task(self, func, run_time, day_positions):
+        run_time = get_run_time(run_time)
+        self._tasks.append((run_time, len(self._tasks), func, day_positions))
+
+    def run_daily(self, func, time='every_bar', reference_security=None):
+        self._add_task(func, time, None)
+
+    def run_weekly(self, func, weekday, time='open', reference_security=None, force=True):
+        self._add_task(func, time, set(get_schedule_days(self._days, 'week', weekday, force)))
+
+    def run_monthly(self, func, monthday, time='open', reference_security=None, force=True):
+        self._add_task(func, time, set(get_schedule_days(self._days, 'month', monthday, force)))
+
+    def get_security_info(self, security):
+        if self._security_info is None:
+            frames = []
+            for security_type in ('stock', 'index', 'etf', 'lof') + FUND_TYPES:
+                names = get_provider().get_security_names(types=(security_type,))
+                frames.append(pd.DataFrame({'display_name': names, 'type': security_type}))
+            self._security_info = pd.concat(frames)
+            self._security_info = self._security_info[~self._security_info.index.duplicated()]
+
+        if security in self._security_info.index:
+            row = self._security_info.loc[security]
+            return SecurityInfo(security, row['display_name'], row['type'])
+        return SecurityInfo(security, security, 'open_fund' if security.endswith('.OF') else 'stock')
+
+    def get_fund_info(self, security, date=None):
+        info = self.get_security_info(security)
+        return {'fund_name': info.display_name, 'fund_type': info.type}
+
+    def get_trades(self):
+        """当天的成交，{order_id: Order}"""
+        today = self._days[self._day_index]
+        return {order.order_id: order for order in self._orders if order.add_time.date() == today}
+
+    def record(self, **kwargs):
+        today = self._days[self._day_index]
+        for name, value in kwargs.items():
+            self._records.setdefault(name, {})[today] = value
+
+    def send_message(self, message, channel='weixin'):
+        self.log.info(message)
+
+    # ---------------------------------------------------------
+    # 撮合
+
+    def _load_prices(self, securities):
+        """一次取出回测区间内的行情，停牌或没有净值的日期沿用前一个价格"""
+        missing = [security for security in securities if security not in self._prices]
+        if not missing or not self._days:
+            return
+
+        begin = self._days[0] - timedelta(PRICE_LOOKBACK_DAYS)
+        panel = get_provider().get_price_panel(missing, begin, self._days[-1]).ffill().reindex(self._days)
+        for security in missing:
+            self._prices[security] = panel[security].values
+
+    def _get_price(self, security):
+        self._load_prices([security])
+        return self._prices[security][self._day_index]
+
+    def _get_order_cost(self, security):
+        security_type = self.get_security_info(security).type
+        for key in (security, security_type, 'fund' if security_type in FUND_TYPES else 'stock'):
+            if key in self._order_costs:
+                return self._order_costs[key]
+        return OrderCost()
+
+    def _add_order(self, sub, security, amount, price, is_buy, commission):
+        self._order_id += 1
+        order = Order(self._order_id, security, amount, price, is_buy, commission, self.context.current_dt)
+        self._orders.append(order)
+        self._share_events.append((self._day_index, security, amount if is_buy else -amount))
+        self._mark()
+        return order
+
+    def _buy(self, sub, security, amount, price, cost, lock_days):
+        position = sub.positions.setdefault(security, Position(security))
+        position.avg_cost = (position.avg_cost * position.total_amount + amount * price) / (position.total_amount + amount)
+        position.total_amount += amount
+        self._locked.append((self._day_index + lock_days, sub, security, amount))
+        return self._add_order(sub, security, amount, price, True, cost)
+
+    def _sell(self, sub, security, amount, price, cost):
+        position = sub.positions[security]
+        position.total_amount -= amount
+        position.closeable_amount -= amount
+        if position.total_amount <= 1e-8:
+            del sub.positions[security]
+        return self._add_order(sub, security, amount, price, False, cost)
+
+    def _get_subportfolio(self, pindex):
+        return self._subportfolios[pindex]
+
+    def purchase(self, security, cash, pindex=0):
+        """场外基金申购cash元，份额T+1日才可赎回"""
+        sub = self._get_subportfolio(pindex)
+        price = self._get_price(security)
+        cash = min(cash, sub.available_cash)
+        if cash <= 0 or not price > 0:
+            self.log.warn('申购失败: {}, 金额{}, 净值{}'.format(security, cash, price))
+            return None
+
+        cost = self._get_order_cost(security).get_cost(cash, True)
+        sub.available_cash -= cash
+        return self._buy(sub, security, (cash - cost) / price, price, cost, 1)
+
+    def redeem(self, security, amount, pindex=0):
+        """场外基金赎回amount份，资金按 set_redeem_latency 设置的交易日数到账"""
+        sub = self._get_subportfolio(pindex)
+        price = self._get_price(security)
+        amount = min(amount, sub.positions[security].closeable_amount)
+        if amount <= 0 or not price > 0:
+            self.log.warn('赎回失败: {}, 份额{}, 净值{}'.format(security, amount, price))
+            return None
+
+        value = amount * price
+        cost = self._get_order_cost(security).get_cost(value, False)
+        security_type = self.get_security_info(security).type
+        latency = self._redeem_latency.get(security_type, DEFAULT_REDEEM_LATENCY)
+        sub.transit_cash += value - cost
+        self._transit.append((self._day_index + latency, sub, value - cost))
+        return self._sell(sub, security, amount, price, cost)
+
+    def order(self, security, amount, pindex=0):
+        """按股数下单，正数买入，负数卖出，买入按100股取整"""
+        sub = self._get_subportfolio(pindex)
+        price = self._get_price(security)
+        if not price > 0:
+            self.log.warn('下单失败: {} 没有行情'.format(security))
+            return None
+
+        order_cost = self._get_order_cost(security)
+        if amount > 0:
+            amount = int(amount // 100 * 100)
+            while amount > 0 and amount * price + order_cost.get_cost(amount * price, True) > sub.available_cash:
+                amount -= 100
+            if amount <= 0:
+                return None
+            cost = order_cost.get_cost(amount * price, True)
+            sub.available_cash -= amount * price + cost
+            return self._buy(sub, security, amount, price, cost, 1)
+
+        amount = min(-amount, sub.positions[security].closeable_amount)
+        if amount <= 0:
+            return None
+        cost = order_cost.get_cost(amount * price, False)
+        sub.available_cash += amount * price - cost
+        return self._sell(sub, security, amount, price, cost)
+
+    def order_value(self, security, value, pindex=0):
+        price = self._get_price(security)
+        if not price > 0:
+            return None
+        return self.order(security, value / price, pindex)
+
+    def order_target(self, security, amount, pindex=0):
+        sub = self._get_subportfolio(pindex)
+        return self.order(security, amount - sub.positions[security].total_amount, pindex)
+
+    def order_target_value(self, security, value, pindex=0):
+        price = self._get_price(security)
+        if not price > 0:
+            return None
+        return self.order_target(security, value / price, pindex)
+
+    # ---------------------------------------------------------
+    # 逐日运行
+
+    def _settle(self):
+        """开盘前解锁份额、赎回资金到账"""
+        locked = []
+        for day_index, sub, security, amount in self._locked:
+            if day_index > self._day_index:
+                locked.append((day_index, sub, security, amount))
+            elif security in sub.positions:
+                position = sub.positions[security]
+                position.closeable_amount = min(position.closeable_amount + amount, position.total_amount)
+        self._locked = locked
+
+        transit = []
+        for day_index, sub, cash in self._transit:
+            if day_index > self._day_index:
+                transit.append((day_index, sub, cash))
+            else:
+                sub.transit_cash -= cash
+                sub.available_cash += cash
+        self._transit = transit
+
+    def _mark(self):
+        """按当天价格更新持仓市值"""
+        for sub in self._subportfolios:
+            for security, position in sub.positions.items():
+                price = self._get_price(security)
+                if price == price:
+                    position.price = price
+                position.value = position.total_amount * position.price
+
+    def _load_strategy(self):
+        """执行策略文件，聚宽接口注入到策略的全局命名空间；策略中的 from jqdata import * 也从这里导入"""
+        api = self.get_api()
+        if not isinstance(self._strategy, str):
+            self._strategy.__dict__.update(api)
+            return self._strategy.__dict__
+
+        # 先确定数据源，避免数据源把临时的 jqdata 模块当作聚宽环境
+        get_provider()
+        jqdata = types.ModuleType('jqdata')
+        jqdata.__dict__.update(api)
+        saved = sys.modules.get('jqdata')
+        sys.modules['jqdata'] = jqdata
+        try:
+            namespace = dict(api, __name__='strategy', __file__=self._strategy)
+            with open(self._strategy, 'rb') as f:
+                exec(compile(f.read(), self._strategy, 'exec'), namespace)
+        finally:
+            if saved is not None:
+                sys.modules['jqdata'] = saved
+            else:
+                del sys.modules['jqdata']
+        return namespace
+
+    def run(self):
+        """
+        output:
+            DataFrame, index为交易日，列为:
+                cash: 可用资金 + 在途资金
+                positions_value: 持仓市值
+                total_value: 总资产
+                returns: 日收益率
+                drawdown: 相对历史最高总资产的回撤
+                benchmark: 基准按初始资金折算的市值(设置了基准时)
+            以及策略中 record 的值
+        """
+        if not self._days:
+            return pd.DataFrame(columns=['cash', 'positions_value', 'total_value', 'returns', 'drawdown'])
+
+        namespace = self._load_strategy()
+        namespace.update(self._settings)
+        self.context.current_dt = datetime.combine(self._days[0], MARKET_TIMES[BEFORE_OPEN])
+        if 'initialize' in namespace:
+            namespace['initialize'](self.context)
+        tasks = sorted(self._tasks, key=lambda task: (task[0], task[1]))
+
+        for day_index, day in enumerate(self._days):
+            self._day_index = day_index
+            previous = [d for d in self._all_days if d < day][-1:] if day_index == 0 else [self._days[day_index - 1]]
+            self.context.previous_date = previous[0] if previous else None
+            self._settle()
+
+            for run_time, _, func, day_positions in tasks:
+                if day_positions is not None and day_index not in day_positions:
+                    continue
+                self.context.current_dt = datetime.combine(day, run_time)
+                self._mark()
+                func(self.context)
+
+            self._cash_rows.append(sum(sub.available_cash + sub.transit_cash for sub in self._subportfolios))
+
+        return self._get_result()
+
+    def _get_result(self):
+        """持仓矩阵 × 价格矩阵，一次算出每天的市值"""
+        securities = sorted(set(security for _, security, _ in self._share_events))
+        self._load_prices(securities)
+
+        result = pd.DataFrame({'cash': self._cash_rows}, index=self._days)
+        if securities:
+            events = pd.DataFrame(self._share_events, columns=['day', 'security', 'delta'])
+            shares = events.pivot_table(index='day', columns='security', values='delta', aggfunc='sum')
+            shares = shares.reindex(index=range(len(self._days)), columns=securities).fillna(0.0).cumsum().values
+            prices = np.column_stack([self._prices[security] for security in securities])
+            # 没有价格的日期持仓按0计算，与逐日的 _mark 一致
+            result['positions_value'] = (np.where(np.abs(shares) > 1e-8, shares, 0.0) * np.nan_to_num(prices)).sum(axis=1)
+        else:
+            result['positions_value'] = 0.0
+
+        result['total_value'] = result['cash'] + result['positions_value']
+        result['returns'] = result['total_value'].pct_change().fillna(0.0)
+        result['drawdown'] = result['total_value'] / result['total_value'].cummax() - 1
+
+        if self._benchmark is not None:
+            self._load_prices([self._benchmark])
+            benchmark = pd.Series(self._prices[self._benchmark], index=self._days)
+            result['benchmark'] = benchmark / benchmark.dropna().iloc[0] * result['total_value'].iloc[0] \
+                if benchmark.notnull().any() else np.nan
+
+        for name, values in self._records.items():
+            result[name] = pd.Series(values).reindex(self._days)
+        return result
+
+
+def summarize(result):
+    """
+    回测结果的统计值
+
+    output:
+        dict: total_return(总收益率), annual_return(年化收益率), max_drawdown(最大回撤), benchmark_return(基准收益率)
+    """
+    years = max(len(result) - 1, 1) / float(TRADE_DAYS_PER_YEAR)
+    total_return = result['total_value'].iloc[-1] / result['total_value'].iloc[0] - 1
+    summary = {
+        'total_return': total_return,
+        'annual_return': pow(1 + total_return, 1 / years) - 1,
+        'max_drawdown': result['drawdown'].min(),
+    }
+    if 'benchmark' in result.columns:
+        summary['benchmark_return'] = result['benchmark'].iloc[-1] / result['benchmark'].iloc[0] - 1
+    return summary
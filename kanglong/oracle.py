@@ -2,9 +2,12 @@
 
 """简单的每日回测工具脚本"""
 
-import bisect
-from jqdata import get_all_trade_days
 from datetime import datetime, timedelta
+from distribution import HistoryDistribution
+from index_timeline import get_index_timeline
+from provider import get_provider
+from valuation_history import compute_index_history, get_valuation_history
+from valuation_store import get_valuation_store
 
 class KLYHStrategy(object):
 
@@ -18,6 +21,8 @@ class KLYHStrategy(object):
         self._index_stock = index_stock
         self._pe, self._pb, self._roe = self._index_stock.get_index_beta_factor()
         self._history_factors = self._index_stock.get_index_beta_history_factors()
+        self._pe_distribution = HistoryDistribution(self._history_factors['pe'])
+        self._pb_distribution = HistoryDistribution(self._history_factors['pb'])
 
     def get_trading_position(self, national_debt_rate=0.035):
         """
@@ -42,10 +47,8 @@ class KLYHStrategy(object):
         output:
             -1 ~~ 1, -1代表清仓，0代表持仓不动， 1代表全仓买入； -0.5代表清半仓，0.5代表半仓买入
         """
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pe, self._history_factors['pe'])
-        pb_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pb, self._history_factors['pb'])
+        pe_quantile = self._pe_distribution.quantile(self._pe)
+        pb_quantile = self._pb_distribution.quantile(self._pb)
 
         avg_roe = self._history_factors['roe'].mean()
 
@@ -90,8 +93,7 @@ class KLYHStrategy(object):
         """
 
 
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        pe, self._history_factors['pe'])
+        pe_quantile = self._pe_distribution.quantile(pe)
         position = 0
         if action == 0:
             if pe_quantile>=0.8 and pe_quantile<0.85:
@@ -113,8 +115,7 @@ class KLYHStrategy(object):
             odds = pow(1 + self.EXPECTED_EARN_RATE, self.EXPECTED_EARN_YEAR)
             except_sell_pe = odds / pow(1+history_avg_roe, self.EXPECTED_EARN_YEAR) * pe
 
-            win_rate = 1.0 - self._index_stock.get_quantile_of_history_factors(except_sell_pe,
-                                                                               self._history_factors['pe'])
+            win_rate = 1.0 - self._pe_distribution.quantile(except_sell_pe)
             print('历史平均roe:{},期待pe:{}, 胜率:{}, 赔率:{}'.format(history_avg_roe, except_sell_pe, win_rate, odds))
 
             position = (odds * win_rate - (1.0 - win_rate)) * 1.0 / odds
@@ -122,16 +123,20 @@ class KLYHStrategy(object):
 
 class IndexStockBeta(object):
 
-    def __init__(self, index_code, index_type=0, base_date=None, history_days=365*8):
+    def __init__(self, index_code, index_type=0, base_date=None, history_days=365*8, store=None, incremental=False):
         """
         input:
             index_code: 要查询指数的代码
             index_type: 1为等权重方式计算，0为按市值加权计算
             base_date: 查询时间，格式为'yyyy-MM-dd'，默认为当天
             history_days: 默认历史区间位前八年
+            store: 本地估值仓库，默认使用进程内共享的 ValuationStore
+            incremental: get_index_beta_history_factors 的默认取数方式
         """
         self._index_code = index_code
         self._index_type = index_type
+        self._store = store if store is not None else get_valuation_store()
+        self._incremental = incremental
         if not base_date:
             self._base_date = datetime.now().date()
         else:
@@ -157,14 +162,10 @@ class IndexStockBeta(object):
         if not day:
             day = datetime.strptime(self._base_date, '%Y-%m-%d')
 
-        stocks = get_index_stocks(self._index_code, day)
-        q = query(
-            valuation.pe_ratio, valuation.pb_ratio, valuation.circulating_market_cap
-        ).filter(
-            valuation.code.in_(stocks)
-        )
+        stocks = get_index_timeline().get_members(self._index_code, day)
 
-        df = get_fundamentals(q, day)
+        # 先读本地估值仓库，本地没有的日期才会访问数据源
+        df = self._store.get_valuation(stocks, day)
 
         df = df[df['pe_ratio']>0]
 
@@ -179,36 +180,47 @@ class IndexStockBeta(object):
         else:
             return (None, None, None)
 
-    def get_index_beta_history_factors(self, interval=7):
+    def get_index_beta_history_factors(self, interval=7, bulk=True, incremental=None):
         """
         获取任意指数一段时间的历史 pe,pb 估值列表，通过计算当前的估值在历史估值的百分位，来判断当前市场的估值高低。
         由于加权方式可能不同，可能各个指数公开的估值数据有差异，但用于判断估值相对高低没有问题
 
         input：
             interval: 计算指数估值的间隔天数，增加间隔时间可提高计算性能
+            bulk: 为True时一次取出 成分股 × 日期 的估值面板，对所有采样日做一次向量化计算；
+                  为False时逐日调用 get_index_beta_factor
+            incremental: 为True时从本地保存的历史估值序列中切片，只补算缺失的采样日，
+                         此时采样日按整个交易日历对齐，而不是从 begin_date 开始数，采样日与为False时最多相差 interval-1 个交易日；
+                         为None时使用构造时的设置(默认为False)
 
         output：
             result:  指数历史估值的 DataFrame，index 为时间，列为pe，pb,roe
         """
-        all_days = get_all_trade_days()
+        if incremental is None:
+            incremental = self._incremental
 
-        pes = []
-        roes = []
-        pbs = []
-        days = []
+        if incremental:
+            return get_valuation_history().get_history(self._index_code, self._index_type, interval,
+                                                       self._begin_date, self._end_date)
+
+        all_days = get_provider().get_all_trade_days()
 
         begin = datetime.strptime(self._begin_date, '%Y-%m-%d').date()
         end = datetime.strptime(self._end_date, '%Y-%m-%d').date()
-        i = 0
-        for day in all_days:
-            if(day <= begin or day >= end):
-                continue
+        sample_days = [day for day in all_days if day > begin and day < end][interval-1::interval]
 
-            i += 1
+        # 一次性补齐本地仓库中缺失的日期，后续计算只读本地
+        self._store.fill(sample_days)
 
-            if(i % interval != 0):
-                continue
+        if bulk:
+            return compute_index_history(self._index_code, self._index_type, sample_days, self._store)
 
+        pes = []
+        roes = []
+        pbs = []
+        days = []
+
+        for day in sample_days:
             pe, pb, roe = self.get_index_beta_factor(day)
             if pe and pb and roe:
                 pes.append(pe)
@@ -230,13 +242,7 @@ class IndexStockBeta(object):
         output:
             quantile: 历史估值百分位 (0.7)
         """
-        factors = [history_list.quantile(i / 10.0)  for i in range(11)]
-        idx = bisect.bisect(factors, factor)
-        if idx < 10:
-            quantile = idx - (factors[idx] - factor) / (factors[idx] - factors[idx-1])
-            return quantile / 10.0
-        else:
-            return 1.0
+        return HistoryDistribution(history_list).quantile(factor)
 
 # 测试
 # 测试
@@ -282,6 +288,11 @@ index_stocks = {
     '399975.XSHE':'中证全指证券公司' #502010.OF 易方达证券公司分级
 }
 
+# 所有指数的历史估值一次批量补齐，成分股重合的指数共用同一份估值数据
+base_date = (datetime.now() - timedelta(1)).strftime('%Y-%m-%d')
+get_valuation_history().update_many(list(index_stocks.keys()), [0, 1], 7,
+                                    datetime.strptime(base_date, '%Y-%m-%d') - timedelta(365*5), base_date)
+
 for index_code, index_name in index_stocks.items():
     base_date = (datetime.now() - timedelta(1)).strftime('%Y-%m-%d')
     #base_date = '2014-05-10' # 后视镜市场低点
@@ -1,6 +1,6 @@
-import bisect
-from jqdata import get_all_trade_days
 from datetime import datetime, timedelta
+from distribution import HistoryDistribution
+from provider import get_provider
 
 class KLYHStrategy(object):
 
@@ -14,6 +14,8 @@ class KLYHStrategy(object):
         self._index_stock = index_stock
         self._pe, self._pb, self._roe = self._index_stock.get_stock_beta_factor()
         self._history_factors = self._index_stock.get_stock_beta_history_factors()
+        self._pe_distribution = HistoryDistribution(self._history_factors['pe'])
+        self._pb_distribution = HistoryDistribution(self._history_factors['pb'])
 
     def get_trading_position(self, national_debt_rate=0.035):
         """
@@ -39,10 +41,8 @@ class KLYHStrategy(object):
         output:
             -1 ~~ 1, -1代表清仓，0代表持仓不动， 1代表全仓买入； -0.5代表清半仓，0.5代表半仓买入
         """
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pe, self._history_factors['pe'])
-        pb_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        self._pb, self._history_factors['pb'])
+        pe_quantile = self._pe_distribution.quantile(self._pe)
+        pb_quantile = self._pb_distribution.quantile(self._pb)
 
         avg_roe = self._history_factors['roe'].mean()
 
@@ -86,8 +86,7 @@ class KLYHStrategy(object):
         """
 
 
-        pe_quantile = self._index_stock.get_quantile_of_history_factors(
-                                        pe, self._history_factors['pe'])
+        pe_quantile = self._pe_distribution.quantile(pe)
         position = 0
 
         if action == 0:
@@ -104,8 +103,7 @@ class KLYHStrategy(object):
             odds = pow(1 + self.EXPECTED_EARN_RATE, self.EXPECTED_EARN_YEAR)
             except_sell_pe = odds / pow(1+history_avg_roe, self.EXPECTED_EARN_YEAR) * pe
 
-            win_rate = 1.0 - self._index_stock.get_quantile_of_history_factors(except_sell_pe,
-                                                                               self._history_factors['pe'])
+            win_rate = 1.0 - self._pe_distribution.quantile(except_sell_pe)
             print('历史平均roe:{},期待pe:{}, 胜率:{}, 赔率:{}'.format(history_avg_roe, except_sell_pe, win_rate, odds))
 
             position = (odds * win_rate - (1.0 - win_rate)) * 1.0 / odds
@@ -149,14 +147,7 @@ class StockBeta(object):
         if not day:
             day = datetime.strptime(self._base_date, '%Y-%m-%d')
 
-        stocks = [self._stock_code]
-        q = query(
-            valuation.pe_ratio, valuation.pb_ratio, valuation.circulating_market_cap
-        ).filter(
-            valuation.code.in_(stocks)
-        )
-
-        df = get_fundamentals(q, day)
+        df = get_provider().get_valuation(day, [self._stock_code])
 
         df = df[df['pe_ratio']>0]
 
@@ -182,7 +173,7 @@ class StockBeta(object):
         output：
             result:  指数历史估值的 DataFrame，index 为时间，列为pe，pb,roe
         """
-        all_days = get_all_trade_days()
+        all_days = get_provider().get_all_trade_days()
 
         pes = []
         roes = []
@@ -222,13 +213,7 @@ class StockBeta(object):
         output:
             quantile: 历史估值百分位 (0.7)
         """
-        factors = [history_list.quantile(i / 10.0)  for i in range(11)]
-        idx = bisect.bisect(factors, factor)
-        if idx < 10:
-            quantile = idx - (factors[idx] - factor) / (factors[idx] - factors[idx-1])
-            return quantile / 10.0
-        else:
-            return 1.0
+        return HistoryDistribution(history_list).quantile(factor)
 
 # 测试
 
@@ -5,14 +5,16 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import bisect
 
+from index_timeline import get_index_timeline
+from provider import get_provider
+
 import warnings
 warnings.filterwarnings("ignore")
 
 #指定日期的指数PE(市值加权)
 def get_index_pe_date(index_code,date):
-    stocks = get_index_stocks(index_code, date)
-    q = query(valuation).filter(valuation.code.in_(stocks))
-    df = get_fundamentals(q, date)
+    stocks = get_index_timeline().get_members(index_code, date)
+    df = get_provider().get_valuation(date, stocks)
     df = df[df['pe_ratio'] > 0]
     if len(df) > 0:
         #pe = len(df)/sum([1/p if p>0 else 0 for p in df.pe_ratio])
@@ -24,9 +26,8 @@ def get_index_pe_date(index_code,date):
 
 #指定日期的指数PB(市值加权)
 def get_index_pb_date(index_code,date):
-    stocks = get_index_stocks(index_code, date)
-    q = query(valuation).filter(valuation.code.in_(stocks))
-    df = get_fundamentals(q, date)
+    stocks = get_index_timeline().get_members(index_code, date)
+    df = get_provider().get_valuation(date, stocks)
     df = df[df['pb_ratio']>0]
     if len(df)>0:
         #pb = len(df)/sum([1/p if p>0 else 0 for p in df.pb_ratio])
@@ -55,7 +56,7 @@ def get_index_pe_pb(index_code):
     return PB_PE
 
 
-all_index = get_all_securities(['index'])
+all_index = get_provider().get_security_names(['index'])
 
 index_choose = [
     '399902.XSHE', # 中证流通
@@ -77,7 +78,7 @@ frames =pd.DataFrame()
 today = pd.datetime.today()
 
 for code in index_choose:
-    index_name = all_index.ix[code].display_name
+    index_name = all_index[code]
     print('正在处理: ', index_name)
     df_pe_pb = get_index_pe_pb(code)
 
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+
+"""数据源接口
+
+所有策略脚本(IndexStockBeta, StockBeta, ConvertBondBeta, PE/股息率分析等)
+都通过 get_provider() 拿到的数据源取数，不再直接调用聚宽的全局函数:
+
+    JQDataProvider: 聚宽平台(研究环境/回测)中使用
+    LocalDataProvider: 读取本地 CSV/SQLite/Parquet 文件，可以在笔记本上离线运行和做性能分析
+
+在聚宽研究环境中使用时，把本文件和策略脚本放在同一目录下即可。
+"""
+
+import bisect
+import os
+import sqlite3
+import pandas as pd
+from datetime import datetime, timedelta
+
+# 估值字段
+VALUATION_FIELDS = ['pe_ratio', 'pb_ratio', 'circulating_market_cap']
+
+# 本地数据目录，可以通过环境变量 KANGLONG_DATA_PATH 指定
+LOCAL_DATA_PATH = os.environ.get(
+    'KANGLONG_DATA_PATH', os.path.join(os.path.expanduser('~'), '.kanglong', 'data'))
+
+# 可转债类型
+CONBOND_TYPE_ID = 703013
+
+# 正常上市，未上市
+CONBOND_LIST_STATUS_IDS = ['301001', '301099']
+
+# bond.CONBOND_BASIC_INFO 中到期赎回价(元/张，含最后一期利息)的列
+CONBOND_REDEMPTION_PRICE_FIELD = 'redemption_price'
+
+# 聚宽 run_query 单次最多返回的行数
+JQ_QUERY_LIMIT = 5000
+
+# 批量取每只转债最新一条记录时，先只查最近这么多天，查不到的转债再查全部历史
+LAST_ROW_WINDOW_DAYS = 30
+
+
+def to_date(day):
+    """统一把 'yyyy-MM-dd' / date / datetime / Timestamp 转成 datetime.date"""
+    if isinstance(day, str):
+        return datetime.strptime(day, '%Y-%m-%d').date()
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, pd.Timestamp):
+        return day.date()
+    return day
+
+
+def last_rows(df, key='code'):
+    """
+    每个 key 取最后一条记录(按 date 升序)，与逐只转债查询后取 iloc[-1] 一致
+
+    output:
+        DataFrame, index为key
+    """
+    if 'date' in df.columns:
+        df = df.sort_values('date', kind='mergesort')
+    return df.groupby(key).tail(1).set_index(key)
+
+
+class DataProvider(object):
+    """数据源接口，子类实现具体的取数方式"""
+
+    def get_all_trade_days(self):
+        """
+        output:
+            全部交易日列表，元素为datetime.date，升序
+        """
+        raise NotImplementedError
+
+    def get_trade_days(self, start_date=None, end_date=None, count=None):
+        """
+        与聚宽 get_trade_days 相同: 给出 start_date 时取 [start_date, end_date] 之间的交易日，
+        否则取截止到 end_date 的最近 count 个交易日
+        """
+        days = self.get_all_trade_days()
+        if end_date is not None:
+            days = [day for day in days if day <= to_date(end_date)]
+        if start_date is not None:
+            return [day for day in days if day >= to_date(start_date)]
+        if count is not None:
+            return days[-count:]
+        return days
+
+    def get_index_stocks(self, index_code, day):
+        """
+        output:
+            指定日期指数的成分股代码列表
+        """
+        raise NotImplementedError
+
+    def get_valuation(self, day, codes=None):
+        """
+        input:
+            day: 日期
+            codes: 股票代码列表，None代表全市场
+
+        output:
+            DataFrame, index为股票代码，列为 VALUATION_FIELDS
+        """
+        raise NotImplementedError
+
+    def get_price(self, code, end_date, count=1, fields=('close',)):
+        """
+        output:
+            DataFrame, index为日期，截止到end_date的最近count个交易日行情
+        """
+        raise NotImplementedError
+
+    def get_price_panel(self, codes, start_date, end_date, field='close'):
+        """
+        output:
+            DataFrame, index为 [start_date, end_date] 之间的交易日(datetime.date)，列为代码，没有行情的为NaN
+        """
+        days = self.get_trade_days(start_date=start_date, end_date=end_date)
+        frames = {}
+        for code in codes:
+            df = self.get_price(code, end_date=end_date, count=len(days), fields=[field])
+            frames[code] = pd.Series(df[field].values, index=[to_date(day) for day in df.index], dtype='float64')
+        return pd.DataFrame(frames, index=days, columns=list(codes), dtype='float64')
+
+    def get_security_names(self, types=('index',)):
+        """
+        output:
+            Series, index为代码，值为显示名称
+        """
+        raise NotImplementedError
+
+    def get_conbond_basic_info(self, day):
+        """
+        output:
+            指定日期处于计息期内(interest_begin_date < day <= last_cash_date)的可转债基本信息
+            即 bond.CONBOND_BASIC_INFO 表，按code排序
+        """
+        raise NotImplementedError
+
+    def get_all_conbond_basic_info(self):
+        """
+        output:
+            所有正常上市、未上市的可转债基本信息(不按日期过滤)，即 bond.CONBOND_BASIC_INFO 表，按code排序
+        """
+        raise NotImplementedError
+
+    def get_bond_basic_info(self, codes):
+        """
+        output:
+            bond.BOND_BASIC_INFO 表中指定债券的基本信息
+        """
+        raise NotImplementedError
+
+    def get_bond_coupon(self, codes):
+        """
+        output:
+            bond.BOND_COUPON 表中指定债券的票面利率，每个计息期一行: code, coupon_start_date, coupon_end_date, coupon(%)
+        """
+        raise NotImplementedError
+
+    def get_conbond_redemption_prices(self, codes):
+        """
+        output:
+            Series, index为转债代码，值为到期赎回价(元/张，含最后一期利息)，
+            即 bond.CONBOND_BASIC_INFO 表的 CONBOND_REDEMPTION_PRICE_FIELD 列，没有数据的转债不在结果中
+        """
+        raise NotImplementedError
+
+    def get_conbond_daily_convert(self, codes, end_date):
+        """
+        output:
+            bond.CONBOND_DAILY_CONVERT 表中指定转债截止到end_date的转股数据，按日期升序
+        """
+        raise NotImplementedError
+
+    def get_conbond_daily_price(self, codes, end_date):
+        """
+        output:
+            bond.CONBOND_DAILY_PRICE 表中指定转债截止到end_date的日行情，按日期升序
+        """
+        raise NotImplementedError
+
+    def get_conbond_last_convert(self, codes, end_date):
+        """
+        output:
+            每只转债截止到end_date的最后一条转股数据，index为code，没有转股数据的转债不在结果中
+        """
+        return last_rows(self.get_conbond_daily_convert(codes, end_date))
+
+    def get_conbond_last_price(self, codes, end_date):
+        """
+        output:
+            每只转债截止到end_date的最后一条日行情，index为code，没有行情的转债不在结果中
+        """
+        return last_rows(self.get_conbond_daily_price(codes, end_date))
+
+    def get_last_prices(self, codes, end_date, count=7, field='close'):
+        """
+        output:
+            Series, index为代码，值为截止到end_date的最近count个交易日行情中最后一天的field
+        """
+        return pd.Series({code: self.get_price(code, end_date=end_date, count=count, fields=[field])[field].iloc[-1]
+                          for code in codes}, dtype='float64')
+
+    def get_index_quote(self, codes, days):
+        """
+        output:
+            中证指数行情(聚源 QT_CSIIndexQuote)，index为(TradingDay, SecuCode)，
+            包含 IndexPERatio2(市盈率)、IndexDYRatio2(股息率)等列
+        """
+        raise NotImplementedError
+
+
+class JQDataProvider(DataProvider):
+    """聚宽数据源"""
+
+    def get_all_trade_days(self):
+        from jqdata import get_all_trade_days
+        return list(get_all_trade_days())
+
+    def get_index_stocks(self, index_code, day):
+        from jqdata import get_index_stocks
+        return get_index_stocks(index_code, day)
+
+    def get_valuation(self, day, codes=None):
+        from jqdata import query, valuation, get_fundamentals
+
+        q = query(
+            valuation.code, valuation.pe_ratio, valuation.pb_ratio, valuation.circulating_market_cap
+        )
+        if codes is not None:
+            q = q.filter(valuation.code.in_(codes))
+        df = get_fundamentals(q, day)
+        return df.set_index('code')[VALUATION_FIELDS]
+
+    def get_price(self, code, end_date, count=1, fields=('close',)):
+        from jqdata import get_price
+        return get_price(code, count=count, end_date=end_date, frequency='daily', fields=list(fields))
+
+    def get_price_panel(self, codes, start_date, end_date, field='close'):
+        from jqdata import get_price
+
+        days = self.get_trade_days(start_date=start_date, end_date=end_date)
+        if len(codes) == 0:
+            return pd.DataFrame(index=days, dtype='float64')
+
+        df = get_price(list(codes), start_date=start_date, end_date=end_date, frequency='daily', fields=[field],
+                       panel=False)
+        df['time'] = [to_date(day) for day in df['time']]
+        return df.pivot(index='time', columns='code', values=field).reindex(index=days, columns=list(codes)).astype('float64')
+
+    def get_security_names(self, types=('index',)):
+        from jqdata import get_all_securities
+        return get_all_securities(list(types))['display_name']
+
+    def get_conbond_basic_info(self, day):
+        from jqdata import bond, query
+
+        return bond.run_query(
+            query(bond.CONBOND_BASIC_INFO).filter(
+                bond.CONBOND_BASIC_INFO.bond_type_id == CONBOND_TYPE_ID,
+                bond.CONBOND_BASIC_INFO.list_status_id.in_(CONBOND_LIST_STATUS_IDS),
+                bond.CONBOND_BASIC_INFO.interest_begin_date < day,
+                bond.CONBOND_BASIC_INFO.last_cash_date >= day
+            ).order_by('code').limit(10000)
+        )
+
+    def get_all_conbond_basic_info(self):
+        from jqdata import bond, query
+
+        return self._run_query_all(bond.run_query, query(bond.CONBOND_BASIC_INFO).filter(
+            bond.CONBOND_BASIC_INFO.bond_type_id == CONBOND_TYPE_ID,
+            bond.CONBOND_BASIC_INFO.list_status_id.in_(CONBOND_LIST_STATUS_IDS)
+        ).order_by(bond.CONBOND_BASIC_INFO.code))
+
+    def get_conbond_daily_convert(self, codes, end_date):
+        from jqdata import bond, query
+
+        return bond.run_query(
+            query(bond.CONBOND_DAILY_CONVERT).filter(
+                bond.CONBOND_DAILY_CONVERT.code.in_(codes),
+                bond.CONBOND_DAILY_CONVERT.date <= end_date,
+            ).order_by(bond.CONBOND_DAILY_CONVERT.date)
+        )
+
+    def get_conbond_daily_price(self, codes, end_date):
+        from jqdata import bond, query
+
+        return bond.run_query(
+            query(bond.CONBOND_DAILY_PRICE).filter(
+                bond.CONBOND_DAILY_PRICE.code.in_(codes),
+                bond.CONBOND_DAILY_PRICE.date <= end_date,
+            ).order_by(bond.CONBOND_DAILY_PRICE.date)
+        )
+
+    @staticmethod
+    def _run_query_all(run_query, q):
+        """run_query 单次最多返回 JQ_QUERY_LIMIT 行，超过时分页取全"""
+        frames = []
+        offset = 0
+        while True:
+            df = run_query(q.offset(offset).limit(JQ_QUERY_LIMIT))
+            frames.append(df)
+            if len(df) < JQ_QUERY_LIMIT:
+                break
+            offset += JQ_QUERY_LIMIT
+        return pd.concat(frames, ignore_index=True)
+
+    def _get_conbond_last(self, table, codes, end_date):
+        """
+        一次查询所有转债截止到end_date的最后一条记录:
+        先只查最近 LAST_ROW_WINDOW_DAYS 天，窗口内没有记录的少数转债(长期停牌等)再查全部历史
+        """
+        from jqdata import bond, query
+
+        if len(codes) == 0:
+            return pd.DataFrame().rename_axis('code')
+
+        begin_date = to_date(end_date) - timedelta(LAST_ROW_WINDOW_DAYS)
+        df = self._run_query_all(bond.run_query, query(table).filter(
+            table.code.in_(codes),
+            table.date <= end_date,
+            table.date > begin_date,
+        ).order_by(table.date, table.code))
+
+        missing = sorted(set(codes) - set(df['code']))
+        if missing:
+            df = pd.concat([self._run_query_all(bond.run_query, query(table).filter(
+                table.code.in_(missing),
+                table.date <= begin_date,
+            ).order_by(table.date, table.code)), df], ignore_index=True)
+        return last_rows(df)
+
+    def get_bond_basic_info(self, codes):
+        from jqdata import bond, query
+
+        return self._run_query_all(bond.run_query, query(bond.BOND_BASIC_INFO).filter(
+            bond.BOND_BASIC_INFO.code.in_(codes)
+        ).order_by(bond.BOND_BASIC_INFO.code))
+
+    def get_bond_coupon(self, codes):
+        from jqdata import bond, query
+
+        return self._run_query_all(bond.run_query, query(bond.BOND_COUPON).filter(
+            bond.BOND_COUPON.code.in_(codes)
+        ).order_by(bond.BOND_COUPON.code, bond.BOND_COUPON.coupon_start_date))
+
+    def get_conbond_redemption_prices(self, codes):
+        from jqdata import bond, query
+
+        table = bond.CONBOND_BASIC_INFO
+        if not hasattr(table, CONBOND_REDEMPTION_PRICE_FIELD):
+            return pd.Series(dtype='float64')
+
+        df = self._run_query_all(bond.run_query, query(
+            table.code, getattr(table, CONBOND_REDEMPTION_PRICE_FIELD)
+        ).filter(table.code.in_(codes)).order_by(table.code))
+        return df.set_index('code')[CONBOND_REDEMPTION_PRICE_FIELD].dropna().astype('float64')
+
+    def get_conbond_last_convert(self, codes, end_date):
+        from jqdata import bond
+        return self._get_conbond_last(bond.CONBOND_DAILY_CONVERT, codes, end_date)
+
+    def get_conbond_last_price(self, codes, end_date):
+        from jqdata import bond
+        return self._get_conbond_last(bond.CONBOND_DAILY_PRICE, codes, end_date)
+
+    def get_last_prices(self, codes, end_date, count=7, field='close'):
+        from jqdata import get_price
+
+        if len(codes) == 0:
+            return pd.Series(dtype='float64')
+
+        df = get_price(list(codes), count=count, end_date=end_date, frequency='daily', fields=[field], panel=False)
+        return df.sort_values('time', kind='mergesort').groupby('code')[field].last().astype('float64')
+
+    def get_index_quote(self, codes, days):
+        from jqdata import jy, query
+
+        codes = sorted(code[:6] for code in codes)
+        code_df = jy.run_query(query(
+            jy.SecuMain.InnerCode, jy.SecuMain.SecuCode, jy.SecuMain.ChiName
+        ).filter(
+            jy.SecuMain.SecuCode.in_(codes)).order_by(jy.SecuMain.SecuCode))
+
+        df = jy.run_query(query(
+            jy.QT_CSIIndexQuote).filter(
+            jy.QT_CSIIndexQuote.IndexCode.in_(code_df.InnerCode),
+            jy.QT_CSIIndexQuote.TradingDay.in_(days),
+        ))
+        df = pd.merge(code_df, df, left_on='InnerCode', right_on='IndexCode').set_index(['TradingDay', 'SecuCode'])
+
+        return df.drop(['InnerCode', 'IndexCode', 'ID', 'UpdateTime', 'JSID', 'OpenInterest', 'SettleValue', 'IndexCSIType'],
+                       axis=1)
+
+
+class LocalDataProvider(DataProvider):
+    """
+    本地文件数据源，每张表可以是 root 目录下的 <表名>.parquet、<表名>.csv，
+    或者 root/data.sqlite 中的同名表，按这个顺序查找:
+
+        trade_days: date
+        index_stocks: index_code, date, code (每个调仓日一份成分股快照)
+        valuation: date, code, pe_ratio, pb_ratio, circulating_market_cap
+        price: date, code, close, ...
+        securities: code, display_name, type
+        CONBOND_BASIC_INFO / BOND_BASIC_INFO / BOND_COUPON / CONBOND_DAILY_CONVERT / CONBOND_DAILY_PRICE: 与聚宽bond表字段一致，
+            CONBOND_BASIC_INFO 可以有到期赎回价列 redemption_price
+        QT_CSIIndexQuote: TradingDay, SecuCode, IndexPERatio2, IndexDYRatio2, ...
+    """
+
+    # 需要转换为datetime.date的日期列
+    DATE_COLUMNS = ['date', 'TradingDay', 'interest_begin_date', 'last_cash_date', 'list_date', 'delist_Date',
+                    'coupon_start_date', 'coupon_end_date']
+
+    def __init__(self, root=LOCAL_DATA_PATH):
+        self._root = root
+        self._tables = {}
+        # 表名 -> (有数据的日期列表, {日期: 当天的行})，按日期查询的大表只分组一次
+        self._day_groups = {}
+        # 指数代码 -> (快照日期列表, {日期: 成分股列表})
+        self._index_snapshots = {}
+
+    def _read_table(self, name):
+        if name in self._tables:
+            return self._tables[name]
+
+        parquet_path = os.path.join(self._root, '{}.parquet'.format(name))
+        csv_path = os.path.join(self._root, '{}.csv'.format(name))
+        sqlite_path = os.path.join(self._root, 'data.sqlite')
+
+        if os.path.exists(parquet_path):
+            df = pd.read_parquet(parquet_path)
+        elif os.path.exists(csv_path):
+            df = pd.read_csv(csv_path, dtype={'code': str, 'company_code': str, 'SecuCode': str,
+                                              'list_status_id': str})
+        elif os.path.exists(sqlite_path):
+            with sqlite3.connect(sqlite_path) as conn:
+                df = pd.read_sql('SELECT * FROM "{}"'.format(name), conn)
+        else:
+            raise IOError('本地数据表 {} 不存在: {}'.format(name, self._root))
+
+        for column in self.DATE_COLUMNS:
+            if column in df.columns:
+                # 与聚宽一致，空日期为None
+                dates = pd.to_datetime(df[column])
+                df[column] = dates.dt.date.astype(object).where(dates.notnull(), None)
+
+        self._tables[name] = df
+        return df
+
+    def _read_day(self, name, day):
+        """
+        表中截止到指定日期的最后一天的行，与聚宽 get_fundamentals 一致，周末、节假日取之前最近一个有数据的日期；
+        每张表第一次查询时按date分组，之后每天的查询不再扫描全表
+        """
+        if name not in self._day_groups:
+            df = self._read_table(name)
+            groups = {key: group for key, group in df.groupby('date', sort=False)}
+            self._day_groups[name] = (sorted(groups), groups)
+
+        days, groups = self._day_groups[name]
+        position = bisect.bisect_right(days, to_date(day))
+        if position == 0:
+            return self._read_table(name).iloc[:0]
+        return groups[days[position - 1]]
+
+    def get_all_trade_days(self):
+        return sorted(self._read_table('trade_days')['date'])
+
+    def get_index_stocks(self, index_code, day):
+        # 每个指数的快照只分组一次，逐日查询成分股时不再扫描全表
+        if index_code not in self._index_snapshots:
+            df = self._read_table('index_stocks')
+            groups = {key: list(group['code']) for key, group in df[df['index_code'] == index_code].groupby('date')}
+            self._index_snapshots[index_code] = (sorted(groups), groups)
+
+        days, groups = self._index_snapshots[index_code]
+        position = bisect.bisect_right(days, to_date(day))
+        return list(groups[days[position - 1]]) if position > 0 else []
+
+    def get_valuation(self, day, codes=None):
+        df = self._read_day('valuation', day)
+        if codes is not None:
+            df = df[df['code'].isin(codes)]
+        return df.set_index('code')[VALUATION_FIELDS]
+
+    def get_price(self, code, end_date, count=1, fields=('close',)):
+        df = self._read_table('price')
+        df = df[(df['code'] == code) & (df['date'] <= to_date(end_date))]
+        return df.sort_values('date').set_index('date')[list(fields)].tail(count)
+
+    def get_price_panel(self, codes, start_date, end_date, field='close'):
+        days = self.get_trade_days(start_date=start_date, end_date=end_date)
+        df = self._read_table('price')
+        df = df[df['code'].isin(codes) & (df['date'] >= to_date(start_date)) & (df['date'] <= to_date(end_date))]
+        return df.pivot(index='date', columns='code', values=field).reindex(index=days, columns=list(codes)).astype('float64')
+
+    def get_security_names(self, types=('index',)):
+        df = self._read_table('securities')
+        return df[df['type'].isin(types)].set_index('code')['display_name']
+
+    def get_conbond_basic_info(self, day):
+        day = to_date(day)
+        df = self._read_table('CONBOND_BASIC_INFO')
+        df = df[(df['bond_type_id'] == CONBOND_TYPE_ID) &
+                (df['list_status_id'].astype(str).isin(CONBOND_LIST_STATUS_IDS)) &
+                (df['interest_begin_date'] < day) &
+                (df['last_cash_date'] >= day)]
+        return df.sort_values('code').reset_index(drop=True)
+
+    def get_all_conbond_basic_info(self):
+        df = self._read_table('CONBOND_BASIC_INFO')
+        df = df[(df['bond_type_id'] == CONBOND_TYPE_ID) &
+                (df['list_status_id'].astype(str).isin(CONBOND_LIST_STATUS_IDS))]
+        return df.sort_values('code').reset_index(drop=True)
+
+    def get_bond_basic_info(self, codes):
+        df = self._read_table('BOND_BASIC_INFO')
+        return df[df['code'].isin(codes)].reset_index(drop=True)
+
+    def get_bond_coupon(self, codes):
+        df = self._read_table('BOND_COUPON')
+        return df[df['code'].isin(codes)].sort_values(['code', 'coupon_start_date']).reset_index(drop=True)
+
+    def get_conbond_redemption_prices(self, codes):
+        df = self._read_table('CONBOND_BASIC_INFO')
+        if CONBOND_REDEMPTION_PRICE_FIELD not in df.columns:
+            return pd.Series(dtype='float64')
+
+        df = df[df['code'].isin(codes)]
+        return df.set_index('code')[CONBOND_REDEMPTION_PRICE_FIELD].dropna().astype('float64')
+
+    def get_conbond_daily_convert(self, codes, end_date):
+        df = self._read_table('CONBOND_DAILY_CONVERT')
+        df = df[df['code'].isin(codes) & (df['date'] <= to_date(end_date))]
+        return df.sort_values('date').reset_index(drop=True)
+
+    def get_conbond_daily_price(self, codes, end_date):
+        df = self._read_table('CONBOND_DAILY_PRICE')
+        df = df[df['code'].isin(codes) & (df['date'] <= to_date(end_date))]
+        return df.sort_values('date').reset_index(drop=True)
+
+    def get_last_prices(self, codes, end_date, count=7, field='close'):
+        # 与聚宽 get_price(count=count) 一致，只看截止到end_date的最近count个交易日
+        days = self.get_trade_days(end_date=end_date, count=count)
+        if len(days) == 0:
+            return pd.Series(dtype='float64')
+
+        df = self._read_table('price')
+        df = df[df['code'].isin(codes) & (df['date'] >= days[0]) & (df['date'] <= to_date(end_date))]
+        return last_rows(df)[field].astype('float64')
+
+    def get_index_quote(self, codes, days):
+        codes = [code[:6] for code in codes]
+        days = set(to_date(day) for day in days)
+        df = self._read_table('QT_CSIIndexQuote')
+        df = df[df['SecuCode'].isin(codes) & df['TradingDay'].isin(days)]
+        return df.set_index(['TradingDay', 'SecuCode'])
+
+
+_provider = None
+
+
+def set_provider(provider):
+    """替换全局数据源，比如离线回测时 set_provider(LocalDataProvider('/path/to/data'))"""
+    global _provider
+    _provider = provider
+
+
+def get_provider():
+    """获取全局数据源，在聚宽平台中默认使用聚宽数据，否则使用本地文件"""
+    global _provider
+    if _provider is None:
+        try:
+            import jqdata
+            _provider = JQDataProvider()
+        except ImportError:
+            _provider = LocalDataProvider()
+    return _provider
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""滑动窗口百分位
+
+"当前值在过去N年中处于什么位置" 原来每次查询都要对整个窗口重新排序。这里把序列中出现过的值离散化后放进树状数组(Fenwick tree)，
+窗口向前滑动时只插入新进入、删除移出窗口的值，每次 O(log n):
+
+    插入/删除: 对应值的计数 +1/-1
+    小于等于x的个数(ecdf): 前缀和
+    第k小的值(十分位点): 在树状数组上二分
+
+decile 百分位需要11个十分位点，与 np.percentile 一样取相邻两个顺序统计量做线性插值，结果与 HistoryDistribution 一致。
+重复值共用一个计数，NaN 不进入窗口，查询 NaN 时返回 NaN。PE、PB、转债平均价格、平均溢价率等序列都可以用:
+
+    # 每个采样日的PE在之前5年中的百分位(不包含当天)
+    rolling_quantile(history['pe'], history_days=5*365)
+
+    # 每天的PE在之前5年采样序列中的百分位
+    rolling_quantile(history['pe'], history_days=5*365, queries=daily['pe'])
+
+    # 转债平均价格在之前250个交易日中的百分位
+    rolling_quantile(factors['avg_prices'], window=250, mode=ECDF_MODE)
+"""
+
+import numpy as np
+import pandas as pd
+from distribution import DECILE_MODE, ECDF_MODE, decile_quantile
+
+# 十分位点对应的百分比
+DECILE_PERCENTS = np.arange(11) * 10.0
+
+
+class RollingRank(object):
+    """一组可增删的值，值域为构造时给出的 universe，支持 O(log n) 的排名和顺序统计量查询"""
+
+    def __init__(self, universe):
+        """
+        input:
+            universe: 所有可能加入的值，NaN会被忽略
+        """
+        values = np.asarray(universe, dtype='float64')
+        self._values = np.unique(values[~np.isnan(values)])
+        self._size = len(self._values)
+        self._tree = [0] * (self._size + 1)
+        self._count = 0
+        # 树状数组上二分的最高位
+        self._top = 1 << (self._size.bit_length() - 1) if self._size else 0
+
+    def __len__(self):
+        return self._count
+
+    def _update(self, position, delta):
+        i = position + 1
+        tree = self._tree
+        while i <= self._size:
+            tree[i] += delta
+            i += i & -i
+        self._count += delta
+
+    def _prefix(self, end):
+        """前 end 个离散值的计数之和"""
+        total = 0
+        tree = self._tree
+        while end > 0:
+            total += tree[end]
+            end -= end & -end
+        return total
+
+    def get_positions(self, values):
+        """
+        值在离散化后的位置
+
+        output:
+            int ndarray，NaN为-1，不在 universe 中时抛出 ValueError
+        """
+        values = np.asarray(values, dtype='float64')
+        positions = np.searchsorted(self._values, values)
+        valid = ~np.isnan(values)
+        found = positions[valid]
+        if np.any(found >= self._size) or np.any(self._values[np.minimum(found, self._size - 1)] != values[valid]):
+            raise ValueError('值不在 universe 中')
+        return np.where(valid, positions, -1)
+
+    def add(self, value):
+        """加入一个值，NaN忽略"""
+        position = int(self.get_positions([value])[0])
+        if position >= 0:
+            self._update(position, 1)
+
+    def remove(self, value):
+        """移除一个值，NaN忽略"""
+        position = int(self.get_positions([value])[0])
+        if position >= 0:
+            self._update(position, -1)
+
+    def count_less_equal(self, value):
+        """小于等于value的个数"""
+        return self._prefix(int(np.searchsorted(self._values, value, side='right')))
+
+    def kth(self, k):
+        """第k小的值，k从0开始"""
+        if not 0 <= k < self._count:
+            raise IndexError('k超出范围: {}'.format(k))
+
+        position = 0
+        tree = self._tree
+        step = self._top
+        while step:
+            if position + step <= self._size and tree[position + step] <= k:
+                position += step
+                k -= tree[position]
+            step >>= 1
+        return self._values[position]
+
+    def percentile(self, percents):
+        """
+        与 np.percentile(窗口中的值, percents) 的线性插值一致
+
+        input:
+            percents: 0 ~~ 100 的数组
+
+        output:
+            ndarray，窗口为空时为NaN
+        """
+        percents = np.asarray(percents, dtype='float64')
+        if self._count == 0:
+            return np.full(percents.shape, np.nan)
+
+        previous, following, gamma = _interpolation_indexes(self._count, percents)
+        stats = {k: self.kth(k) for k in set(previous.tolist()) | set(following.tolist())}
+        lower = np.array([stats[k] for k in previous.tolist()])
+        upper = np.array([stats[k] for k in following.tolist()])
+        return _lerp(lower, upper, gamma)
+
+    def deciles(self):
+        """11个十分位点: 最小值, 10%, 20% ... 90%, 最大值"""
+        return self.percentile(DECILE_PERCENTS)
+
+    def quantile(self, factor, mode=DECILE_MODE):
+        """
+        factor在当前窗口中的百分位，与 HistoryDistribution(窗口中的值, mode).quantile(factor) 一致
+
+        output:
+            float，窗口为空或factor为NaN时为NaN
+        """
+        if self._count == 0 or factor != factor:
+            return np.nan
+        if mode == ECDF_MODE:
+            return self.count_less_equal(factor) / float(self._count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return float(decile_quantile(self.deciles(), np.float64(factor)))
+
+
+def _interpolation_indexes(count, percents):
+    """np.percentile 线性插值(method='linear')用到的两个顺序统计量位置和权重"""
+    virtual = (count - 1) * np.true_divide(percents, 100)
+    previous = np.floor(virtual)
+    following = previous + 1
+    previous[virtual >= count - 1] = count - 1
+    following[virtual >= count - 1] = count - 1
+    previous[virtual < 0] = 0
+    following[virtual < 0] = 0
+    previous = previous.astype(int)
+    following = following.astype(int)
+    return previous, following, virtual - previous
+
+
+def _lerp(a, b, t):
+    """与 numpy 内部的插值公式一致，t>=0.5时从b反向插值"""
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def _to_days(index):
+    return pd.to_datetime(pd.Index(index)).values.astype('datetime64[D]')
+
+
+def get_window_bounds(series, queries=None, window=None, history_days=None, include_current=False):
+    """
+    每个查询点对应的窗口在 series 中的位置 [begin, end)
+
+    input:
+        series: 历史序列，history_days 或 queries 不为None时 index 为升序的日期
+        queries: 查询点，index为日期的Series；为None时查询 series 自身的每个点
+        window: 窗口包含的点数，为None时不限制
+        history_days: 窗口的自然日数，即 (day - history_days, day)，为None时不限制
+        include_current: 窗口是否包含查询点当天(queries为None时即该点自身)
+
+    output:
+        (begins, ends) ndarray
+    """
+    if queries is None and history_days is None:
+        ends = np.arange(len(series)) + (1 if include_current else 0)
+        begins = np.zeros(len(series), dtype=int)
+    else:
+        series_days = _to_days(series.index)
+        query_days = series_days if queries is None else _to_days(queries.index)
+        ends = np.searchsorted(series_days, query_days, side='right' if include_current else 'left')
+        if history_days is not None:
+            begins = np.searchsorted(series_days, query_days - np.timedelta64(history_days, 'D'), side='right')
+        else:
+            begins = np.zeros(len(query_days), dtype=int)
+
+    if window is not None:
+        begins = np.maximum(begins, ends - window)
+    return begins, ends
+
+
+def _slide(values, begins, ends):
+    """按查询顺序滑动窗口，每个查询点生成一次 (查询序号, RollingRank)"""
+    rank = RollingRank(values)
+    positions = rank.get_positions(values).tolist()
+    # 窗口的两端都随查询日期单调移动，按窗口排序后每个值只插入、删除一次
+    order = np.lexsort((begins, ends)).tolist()
+    begins, ends = begins.tolist(), ends.tolist()
+    begin = end = 0
+    for i in order:
+        while end < ends[i]:
+            if positions[end] >= 0:
+                rank._update(positions[end], 1)
+            end += 1
+        while begin < begins[i]:
+            if positions[begin] >= 0:
+                rank._update(positions[begin], -1)
+            begin += 1
+        yield i, rank
+
+
+def rolling_quantile(series, window=None, history_days=None, queries=None, mode=DECILE_MODE, include_current=False):
+    """
+    每个点在之前窗口中的百分位
+
+    input:
+        series: 历史序列(Series)，NaN不进入窗口
+        window, history_days, include_current: 窗口的定义，见 get_window_bounds
+        queries: 要查询的值(Series，index为日期)，为None时查询 series 自身
+        mode: 百分位算法，decile 或 ecdf
+
+    output:
+        Series，index与查询点一致，窗口为空时为NaN
+    """
+    if mode not in (DECILE_MODE, ECDF_MODE):
+        raise ValueError('不支持的百分位算法: {}'.format(mode))
+
+    target = series if queries is None else queries
+    values = series.astype('float64').values
+    factors = target.astype('float64').values
+    begins, ends = get_window_bounds(series, queries, window, history_days, include_current)
+
+    result = np.full(len(target), np.nan)
+    if mode == ECDF_MODE:
+        for i, rank in _slide(values, begins, ends):
+            result[i] = rank.quantile(factors[i], mode)
+    else:
+        deciles = _collect_deciles(values, begins, ends)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = decile_quantile(deciles, factors)
+        result[np.isnan(factors)] = np.nan
+    return pd.Series(result, index=target.index)
+
+
+def _collect_deciles(values, begins, ends):
+    deciles = np.full((len(begins), len(DECILE_PERCENTS)), np.nan)
+    for i, rank in _slide(values, begins, ends):
+        deciles[i] = rank.deciles()
+    return deciles
+
+
+def rolling_deciles(series, window=None, history_days=None, queries=None, include_current=False):
+    """
+    每个点之前窗口的11个十分位点，与对窗口调用 np.percentile(values, DECILE_PERCENTS) 一致
+
+    input:
+        与 rolling_quantile 相同，queries 只用到日期
+
+    output:
+        (查询点个数, 11) 的 ndarray，窗口为空时为NaN
+    """
+    begins, ends = get_window_bounds(series, queries, window, history_days, include_current)
+    return _collect_deciles(series.astype('float64').values, begins, ends)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""离线测试用的小数据集
+
+用固定的随机种子生成 LocalDataProvider 的数据表: 交易日、每个指数的成分股、成分股每天的估值、基金净值，
+覆盖 mstragegy.INDEX_STOCKS 中的所有指数。所有缓存(估值仓库、历史估值、成分股时间线)都只放在内存中，
+测试不会读写 ~/.kanglong。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+KANGLONG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if KANGLONG_DIR not in sys.path:
+    sys.path.insert(0, KANGLONG_DIR)
+
+import index_timeline
+import provider
+import valuation_history
+import valuation_store
+from mstragegy import BENCHMARK_INDEX_STOCK, INDEX_STOCKS
+
+DATA_BEGIN_DATE = '2011-01-03'
+DATA_END_DATE = '2015-06-30'
+
+# 股票池大小和每个指数的成分股个数
+STOCK_COUNT = 60
+MEMBER_COUNT = 8
+
+
+def write_dataset(root, seed=0):
+    """在 root 下生成 LocalDataProvider 的数据表"""
+    rng = np.random.RandomState(seed)
+    days = pd.bdate_range(DATA_BEGIN_DATE, DATA_END_DATE)
+    day_strings = days.strftime('%Y-%m-%d')
+    pd.DataFrame({'date': day_strings}).to_csv(os.path.join(root, 'trade_days.csv'), index=False)
+
+    pool = ['{:06d}.XSHE'.format(i) for i in range(STOCK_COUNT)]
+    rows = [(index_code, DATA_BEGIN_DATE, code)
+            for index_code in sorted(INDEX_STOCKS) for code in rng.choice(pool, MEMBER_COUNT, replace=False)]
+    pd.DataFrame(rows, columns=['index_code', 'date', 'code']).to_csv(os.path.join(root, 'index_stocks.csv'), index=False)
+
+    # 估值是随机游走，几年中既有低估也有高估
+    shape = (len(days), STOCK_COUNT)
+    log_pe = np.log(15) + np.cumsum(rng.normal(0, 0.02, shape), axis=0)
+    log_pb = np.log(1.8) + np.cumsum(rng.normal(0, 0.015, shape), axis=0)
+    log_cap = np.log(100) + np.cumsum(rng.normal(0, 0.01, shape), axis=0)
+    pd.DataFrame({
+        'date': np.repeat(day_strings, STOCK_COUNT),
+        'code': np.tile(pool, len(days)),
+        'pe_ratio': np.exp(log_pe).ravel().round(3),
+        'pb_ratio': np.exp(log_pb).ravel().round(3),
+        'circulating_market_cap': np.exp(log_cap).ravel().round(2),
+    }).to_csv(os.path.join(root, 'valuation.csv'), index=False)
+
+    codes = list(INDEX_STOCKS.values()) + list(INDEX_STOCKS)
+    navs = np.exp(np.cumsum(rng.normal(0.0002, 0.012, (len(days), len(codes))), axis=0))
+    pd.DataFrame({
+        'date': np.repeat(day_strings, len(codes)),
+        'code': np.tile(codes, len(days)),
+        'close': navs.ravel().round(4),
+    }).to_csv(os.path.join(root, 'price.csv'), index=False)
+
+    securities = [(code, '基金' + code, 'open_fund') for code in INDEX_STOCKS.values()]
+    securities += [(code, '指数' + code, 'index') for code in sorted(set(INDEX_STOCKS) | {BENCHMARK_INDEX_STOCK})]
+    pd.DataFrame(securities, columns=['code', 'display_name', 'type']).to_csv(
+        os.path.join(root, 'securities.csv'), index=False)
+
+
+@pytest.fixture(scope='session')
+def local_data(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('kanglong_data'))
+    write_dataset(root)
+    return root
+
+
+@pytest.fixture
+def local_provider(local_data):
+    """全局数据源换成本地数据集，缓存全部放在内存中，测试结束后恢复"""
+    saved = (provider._provider, valuation_store._valuation_store, valuation_history._valuation_history,
+             valuation_history._stock_valuation_history, index_timeline._index_timeline)
+
+    provider.set_provider(provider.LocalDataProvider(local_data))
+    store = valuation_store.ValuationStore(path=None)
+    valuation_store._valuation_store = store
+    valuation_history._valuation_history = valuation_history.ValuationHistory(path=None, store=store)
+    valuation_history._stock_valuation_history = valuation_history.StockValuationHistory(path=None, store=store)
+    index_timeline._index_timeline = index_timeline.IndexConstituentTimeline(path=None)
+    try:
+        yield provider.get_provider()
+    finally:
+        (provider._provider, valuation_store._valuation_store, valuation_history._valuation_history,
+         valuation_history._stock_valuation_history, index_timeline._index_timeline) = saved
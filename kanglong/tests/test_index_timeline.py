@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, timedelta
+
+import pytest
+
+import provider
+from index_timeline import IndexConstituentTimeline
+
+DAYS = [date(2020, 1, 1) + timedelta(i) for i in range(40)]
+
+# 01-08、01-09 两天 A 被 B 替换，01-10 又换回 A
+SWAP_BEGIN, SWAP_END = date(2020, 1, 8), date(2020, 1, 10)
+
+
+class SwapProvider(provider.DataProvider):
+
+    def get_all_trade_days(self):
+        return DAYS
+
+    def get_index_stocks(self, index_code, day):
+        return ['B', 'C'] if SWAP_BEGIN <= day < SWAP_END else ['A', 'C']
+
+
+@pytest.fixture
+def swap_provider():
+    saved = provider._provider
+    provider.set_provider(SwapProvider())
+    try:
+        yield
+    finally:
+        provider._provider = saved
+
+
+def test_default_probe_records_change_that_reverts(swap_provider):
+    timeline = IndexConstituentTimeline(path=None)
+    members = timeline.get_members_on_days('X', [DAYS[0], SWAP_BEGIN, date(2020, 1, 9), SWAP_END, DAYS[-1]])
+
+    assert members == {
+        DAYS[0]: ['A', 'C'],
+        SWAP_BEGIN: ['B', 'C'],
+        date(2020, 1, 9): ['B', 'C'],
+        SWAP_END: ['A', 'C'],
+        DAYS[-1]: ['A', 'C'],
+    }
+    assert timeline.get_members('X', date(2020, 1, 9)) == ['B', 'C']
+
+
+def test_sparse_probe_misses_change_that_reverts(swap_provider):
+    # probe_interval > 1 时的已知盲区: 两次抽样都是 A，中间的调整不会被记录
+    timeline = IndexConstituentTimeline(path=None, probe_interval=20)
+    assert timeline.get_members_on_days('X', [DAYS[0], SWAP_BEGIN, DAYS[-1]])[SWAP_BEGIN] == ['A', 'C']
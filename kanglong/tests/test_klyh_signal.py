@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from klyh_signal import compute_signal_series
+from mstragegy import INDEX_STOCKS, IndexStockBeta, KLYHStrategy
+from provider import get_provider
+
+HISTORY_DAYS = 5 * 365
+
+
+def test_signal_series_matches_per_date_strategy(local_provider):
+    days = get_provider().get_trade_days(start_date='2014-07-01', end_date='2015-06-30')[::10]
+
+    positions = []
+    for index_code in sorted(INDEX_STOCKS):
+        signals = compute_signal_series(index_code, days=days, history_days=HISTORY_DAYS)
+        expected = [
+            KLYHStrategy(IndexStockBeta(index_code, base_date=day.strftime('%Y-%m-%d'),
+                                        history_days=HISTORY_DAYS, incremental=True)).get_trading_position()
+            for day in days
+        ]
+
+        np.testing.assert_allclose(signals['position'].values, expected, rtol=1e-9, atol=1e-12)
+        positions.extend(expected)
+
+    # 数据集中同时出现买入和卖出信号，比较覆盖了两种规则
+    assert max(positions) > 0 and min(positions) < 0
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from distribution import HistoryDistribution
+from mstragegy import IndexStockBeta
+from offline_backtest import OfflineBacktest
+from provider import get_provider
+
+STRATEGY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mstragegy.py')
+
+# mstragegy 在 conftest 数据集上 2014-07-01 ~ 2015-06-30 的总资产，每21个交易日取一个
+EXPECTED_TOTAL_VALUES = [
+    700000.0, 700035.9548, 699892.58023, 699889.02089, 700243.889488, 700453.127448, 699847.124485,
+    699554.713463, 699756.48594, 698393.939073, 697156.967483, 696754.898229, 696441.605995,
+]
+
+# 000300.XSHG 在 2015-03-05 前一年的 pe 十分位点: 默认从 begin_date 开始每7个交易日采样，
+# incremental=True 时采样日按交易日历对齐(数据集中比前者早2个交易日)，十分位点有小的差异
+EXPECTED_PE_DECILES = [
+    9.689737, 9.955748, 10.202058, 10.344281, 10.507241, 10.635147, 10.712639, 10.819958, 10.884874,
+    11.157908, 11.442712,
+]
+EXPECTED_INCREMENTAL_PE_DECILES = [
+    9.656409, 10.011692, 10.297298, 10.412212, 10.494212, 10.628654, 10.713964, 10.797101, 10.866909,
+    11.106214, 11.539193,
+]
+
+
+def run_backtest(settings=None):
+    return OfflineBacktest(STRATEGY_PATH, '2014-07-01', '2015-06-30', settings=settings).run()
+
+
+@pytest.mark.parametrize('settings', [{'PREFETCH_VALUATION_HISTORY': True}, None])
+def test_mstragegy_total_values(local_provider, settings):
+    result = run_backtest(settings)
+
+    assert result['positions_value'].iloc[-1] > 0
+    np.testing.assert_allclose(result['total_value'].iloc[::21].values, EXPECTED_TOTAL_VALUES, rtol=1e-9)
+
+
+def test_history_factors_without_incremental(local_provider):
+    stock = IndexStockBeta('000300.XSHG', base_date='2015-03-05', history_days=365)
+    bulk = stock.get_index_beta_history_factors(incremental=False)
+    daily = stock.get_index_beta_history_factors(bulk=False, incremental=False)
+
+    assert len(bulk) > 0
+    pd.testing.assert_frame_equal(daily, bulk, check_exact=False, rtol=1e-12)
+
+
+def test_history_factors_sample_days(local_provider):
+    stock = IndexStockBeta('000300.XSHG', base_date='2015-03-05', history_days=365)
+    old = stock.get_index_beta_history_factors()
+    new = stock.get_index_beta_history_factors(incremental=True)
+
+    window = get_provider().get_trade_days(start_date='2014-03-06', end_date='2015-03-04')
+    assert list(old.index) == list(window[6::7])
+    assert list(new.index) == list(window[4::7])
+
+    np.testing.assert_allclose(HistoryDistribution(old['pe']).deciles, EXPECTED_PE_DECILES, rtol=1e-6)
+    np.testing.assert_allclose(HistoryDistribution(new['pe']).deciles, EXPECTED_INCREMENTAL_PE_DECILES, rtol=1e-6)
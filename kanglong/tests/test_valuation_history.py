@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from valuation_history import StockValuationHistory
+from valuation_store import get_valuation_store
+
+STOCK_CODES = ['000001.XSHE', '000002.XSHE']
+
+
+def test_cleanup_removes_idle_series(local_provider, tmp_path):
+    history = StockValuationHistory(path=str(tmp_path), store=get_valuation_store())
+    assert history.update_many(STOCK_CODES, [0], 1, '2015-01-01', '2015-03-01') > 0
+    idle_file, active_file = [os.path.join(str(tmp_path), '{}_0_1.csv'.format(code)) for code in STOCK_CODES]
+    idle_time = time.time() - 31 * 24 * 3600
+    os.utime(idle_file, (idle_time, idle_time))
+
+    assert history.cleanup(max_idle_days=30) == 1
+    assert not os.path.exists(idle_file) and os.path.exists(active_file)
+
+    # 删除后再查询时重新计算并保存
+    assert len(history.get_history(STOCK_CODES[0], 0, 1, '2015-01-01', '2015-03-01')) > 0
+    assert os.path.exists(idle_file)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""指数历史估值序列
+
+按 (指数代码, 加权方式, 采样间隔) 保存指数历史 pe, pb, roe 序列，只追加缺失的交易日，
+可以按任意 history_days 窗口切片。每天刷新时只需要计算新增的交易日，耗时与历史长度无关。
+
+为了让不同窗口、不同日期的查询共用一份序列，采样日按整个交易日历对齐：
+交易日历中第 interval, 2*interval, ... 个交易日为采样日。
+
+StockValuationHistory 以同样的方式保存单只股票的历史序列(即只有一只成分股的指数)，供 mstragegyplus 的 StockBeta
+和 qianlong 双低策略的正股估值使用。
+回测或实盘运行期间每次调仓只补算新增的采样日，调仓的耗时不随历史窗口长度和股票个数增长。
+"""
+
+import os
+import time
+import pandas as pd
+from datetime import timedelta
+from batch_valuation import get_indexes_factors
+from index_timeline import get_index_timeline
+from provider import get_provider, to_date
+from valuation_store import compute_index_factors, get_valuation_store
+
+# 默认的本地存储目录，设为None时只在内存中缓存
+VALUATION_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.kanglong', 'valuation_history')
+STOCK_VALUATION_HISTORY_PATH = os.path.join(VALUATION_HISTORY_PATH, 'stocks')
+
+# 超过这个天数没有更新的序列文件在 cleanup 时删除
+SERIES_MAX_IDLE_DAYS = 30
+
+
+def compute_index_history(index_code, index_type, days, store=None):
+    """
+    一次性计算指数在多个日期的 pe, pb, roe
+
+    input:
+        index_code: 指数代码
+        index_type: 1为等权重方式计算，0为按市值加权计算
+        days: 日期列表
+        store: 估值仓库，默认使用进程内共享的 ValuationStore
+
+    output:
+        DataFrame, index为日期，列为pe，pb，roe
+    """
+    if len(days) == 0:
+        return pd.DataFrame(columns=['pe', 'pb', 'roe'])
+
+    store = store if store is not None else get_valuation_store()
+    members = get_index_timeline().get_members_on_days(index_code, days)
+    codes = sorted(set(code for stocks in members.values() for code in stocks))
+    panel = store.get_panel(days, codes)
+    return compute_index_factors(panel, members, index_type)
+
+
+def compute_stocks_history(stock_codes, days, index_types=(0,), store=None):
+    """
+    一次性计算多只股票在多个日期的 pe, pb, roe，与 StockBeta.get_stock_beta_factor 的算法一致
+
+    output:
+        DataFrame, 列为 date, index_code, index_type, pe, pb, roe，index_code 即股票代码，没有有效数据的组合不出现在结果中
+    """
+    columns = ['date', 'index_code', 'index_type', 'pe', 'pb', 'roe']
+    if len(stock_codes) == 0 or len(days) == 0:
+        return pd.DataFrame(columns=columns)
+
+    store = store if store is not None else get_valuation_store()
+    panel = store.get_panel(days, list(stock_codes))
+    frames = []
+    for stock_code in stock_codes:
+        stock_panel = {field: frame[[stock_code]] for field, frame in panel.items()}
+        for index_type in index_types:
+            factors = compute_index_factors(stock_panel, {day: [stock_code] for day in days}, index_type)
+            frames.append(factors.rename_axis('date').reset_index().assign(index_code=stock_code, index_type=index_type))
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+def get_sample_days(interval, begin, end):
+    """
+    交易日历对齐的采样日
+
+    output:
+        begin < day < end 范围内的采样日列表
+    """
+    begin, end = to_date(begin), to_date(end)
+    all_days = get_provider().get_all_trade_days()
+    return [day for i, day in enumerate(all_days)
+            if (i + 1) % interval == 0 and day > begin and day < end]
+
+
+class ValuationHistory(object):
+    """每个 (index_code, index_type, interval) 一份历史序列:
+
+        path/<index_code>_<index_type>_<interval>.csv: date, pe, pb, roe
+    """
+
+    def __init__(self, path=VALUATION_HISTORY_PATH, store=None):
+        """
+        input:
+            path: 本地存储目录，为None时只缓存在内存中
+            store: 估值仓库，默认使用进程内共享的 ValuationStore
+        """
+        self._path = path
+        self._store = store
+        self._series = {}
+        # 本次进程内已经计算过、没有有效估值的采样日
+        self._checked = {}
+
+    def _series_file(self, key):
+        return os.path.join(self._path, '{}_{}_{}.csv'.format(*key))
+
+    def _load(self, key):
+        if key not in self._series:
+            if self._path and os.path.exists(self._series_file(key)):
+                df = pd.read_csv(self._series_file(key), index_col=0)
+                df.index = pd.to_datetime(df.index).date
+                self._series[key] = df
+            else:
+                self._series[key] = pd.DataFrame(columns=['pe', 'pb', 'roe'])
+        return self._series[key]
+
+    def _save(self, key):
+        if not self._path:
+            return
+
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+        self._series[key].to_csv(self._series_file(key), index_label='date')
+
+    def _compute(self, code, index_type, days):
+        return compute_index_history(code, index_type, days, self._store)
+
+    def _compute_many(self, codes, days, index_types):
+        return get_indexes_factors(codes, days, index_types, self._store)
+
+    def _missing_days(self, key, sample_days):
+        series = self._load(key)
+        checked = self._checked.get(key, set())
+        return [day for day in sample_days if day not in series.index and day not in checked]
+
+    def _mark_checked(self, key, days):
+        # 估值仓库中已有数据、但没有有效估值的日期(比如上市之前、成分股都亏损)，本次进程内不再重复计算
+        store = self._store if self._store is not None else get_valuation_store()
+        self._checked.setdefault(key, set()).update(day for day in days if store.has_date(day))
+
+    def update(self, index_code, index_type, interval, begin, end):
+        """
+        补齐 (begin, end) 之间缺失的采样日
+
+        output:
+            新增的采样日个数
+        """
+        key = (index_code, index_type, interval)
+        series = self._load(key)
+
+        missing_days = self._missing_days(key, get_sample_days(interval, begin, end))
+        if not missing_days:
+            return 0
+
+        new_series = self._compute(index_code, index_type, missing_days)
+        self._mark_checked(key, missing_days)
+        if len(new_series) == 0:
+            return 0
+
+        self._series[key] = pd.concat([series, new_series]).sort_index()
+        self._save(key)
+        return len(new_series)
+
+    def update_many(self, index_codes, index_types, interval, begin, end):
+        """
+        一次补齐多个指数、多种加权方式缺失的采样日，所有指数成分股的并集每个日期只读取一次估值
+
+        output:
+            新增的采样日个数
+        """
+        sample_days = get_sample_days(interval, begin, end)
+        keys = [(index_code, index_type, interval) for index_code in index_codes for index_type in index_types]
+
+        missing = {key: self._missing_days(key, sample_days) for key in keys}
+        missing_days = sorted(set(day for days in missing.values() for day in days))
+        if not missing_days:
+            return 0
+
+        factors = self._compute_many(index_codes, missing_days, index_types)
+        for key in keys:
+            self._mark_checked(key, missing[key])
+
+        count = 0
+        for (index_code, index_type), new_series in factors.groupby(['index_code', 'index_type']):
+            key = (index_code, index_type, interval)
+            series = self._load(key)
+            new_series = new_series.set_index('date')[['pe', 'pb', 'roe']]
+            new_series = new_series[~new_series.index.isin(series.index)]
+            if len(new_series) == 0:
+                continue
+
+            self._series[key] = pd.concat([series, new_series]).sort_index()
+            self._save(key)
+            count += len(new_series)
+        return count
+
+    def get_history(self, index_code, index_type, interval, begin, end):
+        """
+        获取指数 (begin, end) 之间的历史估值，缺失的采样日先补齐
+
+        input:
+            index_code: 指数代码
+            index_type: 1为等权重方式计算，0为按市值加权计算
+            interval: 采样间隔的交易日数
+            begin, end: 日期，不包含这两天
+
+        output:
+            DataFrame, index为日期，列为pe，pb，roe
+        """
+        self.update(index_code, index_type, interval, begin, end)
+
+        series = self._series[(index_code, index_type, interval)]
+        begin, end = to_date(begin), to_date(end)
+        return series[(series.index > begin) & (series.index < end)].astype('float64')
+
+    def get_recent_history(self, index_code, index_type, interval, history_days, end):
+        """按 history_days 窗口切片，与 IndexStockBeta 的 history_days 含义一致"""
+        end = to_date(end)
+        return self.get_history(index_code, index_type, interval, end - timedelta(history_days), end)
+
+    def cleanup(self, max_idle_days=SERIES_MAX_IDLE_DAYS):
+        """
+        删除超过 max_idle_days 天没有更新的序列文件(比如转债已经退市、不再查询的正股)，同时从内存中移除，
+        之后再查询时重新从估值仓库计算
+
+        output:
+            删除的序列个数
+        """
+        if not self._path or not os.path.exists(self._path):
+            return 0
+
+        deadline = time.time() - max_idle_days * 24 * 3600
+        count = 0
+        for name in os.listdir(self._path):
+            series_file = os.path.join(self._path, name)
+            if not name.endswith('.csv') or os.path.getmtime(series_file) >= deadline:
+                continue
+
+            index_code, index_type, interval = name[:-len('.csv')].rsplit('_', 2)
+            key = (index_code, int(index_type), int(interval))
+            self._series.pop(key, None)
+            self._checked.pop(key, None)
+            os.remove(series_file)
+            count += 1
+        return count
+
+
+_valuation_history = None
+
+
+def get_valuation_history():
+    """进程内共享的历史估值序列"""
+    global _valuation_history
+    if _valuation_history is None:
+        _valuation_history = ValuationHistory()
+    return _valuation_history
+
+
+class StockValuationHistory(ValuationHistory):
+    """每个 (stock_code, index_type, interval) 一份历史序列，采样日、本地存储与 ValuationHistory 一致"""
+
+    def __init__(self, path=STOCK_VALUATION_HISTORY_PATH, store=None):
+        super(StockValuationHistory, self).__init__(path, store)
+
+    def _compute(self, code, index_type, days):
+        factors = self._compute_many([code], days, [index_type])
+        return factors.set_index('date')[['pe', 'pb', 'roe']].rename_axis(None)
+
+    def _compute_many(self, codes, days, index_types):
+        return compute_stocks_history(codes, days, index_types, self._store)
+
+
+_stock_valuation_history = None
+
+
+def get_stock_valuation_history():
+    """进程内共享的股票历史估值序列"""
+    global _stock_valuation_history
+    if _stock_valuation_history is None:
+        _stock_valuation_history = StockValuationHistory()
+    return _stock_valuation_history
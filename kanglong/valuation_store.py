@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""本地列式估值仓库
+
+按 日期 × 股票代码 的宽表保存全市场的 pe_ratio, pb_ratio, circulating_market_cap，
+每个字段一张表，按年份分区落盘。
+
+查询时优先读本地，只有本地没见过的日期才去数据源拉一次全市场估值，
+同一天内所有指数共用这一次拉取结果，重复运行时几乎不再访问网络。
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from provider import VALUATION_FIELDS, get_provider
+
+# 默认的本地存储目录，设为None时只在内存中缓存
+VALUATION_STORE_PATH = os.path.join(os.path.expanduser('~'), '.kanglong', 'valuation')
+
+
+def fetch_market_valuation(day):
+    """
+    从全局数据源获取指定日期全市场的估值数据
+
+    input:
+        day: datetime.date类型
+
+    output:
+        DataFrame, index为股票代码，列为 VALUATION_FIELDS
+    """
+    return get_provider().get_valuation(day)
+
+
+def to_timestamp(day):
+    """统一把 'yyyy-MM-dd' / date / datetime 转成按天对齐的 Timestamp"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, '%Y-%m-%d')
+    return pd.Timestamp(day).normalize()
+
+
+class ValuationStore(object):
+    """日期 × 股票代码 的估值宽表，每个字段一张表，按年分区保存在 path 下:
+
+        path/2020/pe_ratio.pkl
+        path/2020/pb_ratio.pkl
+        path/2020/circulating_market_cap.pkl
+    """
+
+    def __init__(self, path=VALUATION_STORE_PATH, fetcher=fetch_market_valuation):
+        """
+        input:
+            path: 本地存储目录，为None时只缓存在内存中
+            fetcher: 数据源函数，输入日期，返回当天全市场估值 DataFrame (index为股票代码)
+        """
+        self._path = path
+        self._fetcher = fetcher
+        # year -> {field: DataFrame}
+        self._partitions = {}
+        # 全部交易日(Timestamp)，第一次用到时从数据源读取
+        self._trade_days = None
+
+    def _partition_file(self, year, field):
+        return os.path.join(self._path, str(year), '{}.pkl'.format(field))
+
+    def _load_partition(self, year):
+        if year not in self._partitions:
+            frames = {}
+            for field in VALUATION_FIELDS:
+                if self._path and os.path.exists(self._partition_file(year, field)):
+                    frames[field] = pd.read_pickle(self._partition_file(year, field))
+                else:
+                    frames[field] = pd.DataFrame(dtype='float32')
+            self._partitions[year] = frames
+        return self._partitions[year]
+
+    def _save_partition(self, year):
+        if not self._path:
+            return
+
+        year_path = os.path.join(self._path, str(year))
+        if not os.path.exists(year_path):
+            os.makedirs(year_path)
+
+        for field, frame in self._partitions[year].items():
+            frame.to_pickle(self._partition_file(year, field))
+
+    def has_date(self, day):
+        """本地是否已经有该日期的估值数据"""
+        day = to_timestamp(day)
+        return day in self._load_partition(day.year)['pe_ratio'].index
+
+    def _get_data_day(self, day):
+        """
+        数据源对 day 实际返回的是哪一天的估值: 截止到 day 的最近一个交易日(与 get_fundamentals 一致)，
+        非交易日的数据按这个交易日保存，不会以非交易日为key重复记录
+
+        output:
+            Timestamp，day 之前没有交易日时为None
+        """
+        if self._trade_days is None:
+            self._trade_days = pd.DatetimeIndex([to_timestamp(day) for day in get_provider().get_all_trade_days()])
+        position = self._trade_days.searchsorted(day, side='right')
+        return self._trade_days[position - 1] if position > 0 else None
+
+    def _is_final(self, day):
+        """当天(收盘前)及以后的数据源结果是前一个交易日的数据，不能以当天为key落盘"""
+        return day < to_timestamp(datetime.now())
+
+    def fill(self, days):
+        """
+        从数据源补齐本地没有的日期，每个日期只拉取一次全市场估值，按年落盘一次；
+        非交易日按之前最近的交易日补齐，今天及以后的日期不补
+
+        input:
+            days: 日期列表
+
+        output:
+            实际从数据源拉取的日期个数
+        """
+        data_days = set(self._get_data_day(to_timestamp(day)) for day in days)
+        rows = {}
+        for day in sorted(day for day in data_days if day is not None and self._is_final(day)):
+            if self.has_date(day):
+                continue
+
+            df = self._fetcher(day.date())
+            if df is None or len(df) == 0:
+                # 数据源当天还没有数据，不记录，下次再取
+                continue
+            rows.setdefault(day.year, {})[day] = df
+
+        for year, year_rows in rows.items():
+            frames = self._load_partition(year)
+            for field in VALUATION_FIELDS:
+                new_frame = pd.DataFrame(
+                    {day: df[field].astype('float32') for day, df in year_rows.items()}
+                ).T
+                frames[field] = pd.concat([frames[field], new_frame]).sort_index()
+            self._save_partition(year)
+
+        return sum(len(year_rows) for year_rows in rows.values())
+
+    def get_valuation(self, codes, day):
+        """
+        获取指定日期一组股票的估值，本地没有时先从数据源补齐；今天及以后的日期直接查询数据源，不落盘
+
+        input:
+            codes: 股票代码列表
+            day: 日期
+
+        output:
+            DataFrame, index为股票代码，列为 VALUATION_FIELDS，没有数据的股票不出现在结果中
+        """
+        day = to_timestamp(day)
+        if not self._is_final(day):
+            df = self._fetcher(day.date())
+            if df is None or len(df) == 0:
+                return pd.DataFrame(columns=VALUATION_FIELDS)
+            return df.reindex(codes)[VALUATION_FIELDS].astype('float32').astype('float64').dropna(how='all')
+
+        data_day = self._get_data_day(day)
+        self.fill([day])
+
+        if data_day is None or not self.has_date(data_day):
+            return pd.DataFrame(columns=VALUATION_FIELDS)
+
+        frames = self._load_partition(data_day.year)
+        df = pd.DataFrame(
+            {field: frames[field].loc[data_day].reindex(codes) for field in VALUATION_FIELDS},
+            columns=VALUATION_FIELDS
+        ).astype('float64')
+        return df.dropna(how='all')
+
+    def get_panel(self, days, codes):
+        """
+        一次取出 日期 × 股票代码 的估值面板，本地没有的日期先从数据源补齐；
+        非交易日取之前最近一个交易日的估值，今天及以后的日期直接查询数据源，不落盘
+
+        input:
+            days: 日期列表
+            codes: 股票代码列表
+
+        output:
+            {field: DataFrame}，每个字段一张 日期 × 股票代码 的宽表，数据源没有数据的日期不出现在结果中
+        """
+        days = sorted(set(to_timestamp(day) for day in days))
+        final_days = [day for day in days if self._is_final(day)]
+        self.fill(final_days)
+
+        # 请求的日期 -> 保存数据的交易日
+        data_days = {}
+        for day in final_days:
+            data_day = self._get_data_day(day)
+            if data_day is not None and self.has_date(data_day):
+                data_days[day] = data_day
+
+        recent = {}
+        for day in days[len(final_days):]:
+            df = self._fetcher(day.date())
+            if df is not None and len(df):
+                recent[day] = df
+
+        years = sorted(set(day.year for day in data_days.values()))
+        panel = {}
+        for field in VALUATION_FIELDS:
+            frames = []
+            for year in years:
+                frame = self._load_partition(year)[field]
+                year_days = [day for day, data_day in data_days.items() if data_day.year == year]
+                year_frame = frame.reindex(index=[data_days[day] for day in year_days], columns=codes)
+                year_frame.index = year_days
+                frames.append(year_frame)
+            if recent:
+                frames.append(pd.DataFrame({day: df[field].astype('float32') for day, df in recent.items()}).T
+                              .reindex(columns=codes))
+            if frames:
+                panel[field] = pd.concat(frames).sort_index().astype('float64')
+            else:
+                panel[field] = pd.DataFrame(columns=codes, dtype='float64')
+        return panel
+
+def compute_index_factors(panel, members, index_type=0):
+    """
+    在估值面板上一次性向量化计算每个日期的指数 pe, pb, roe，与 IndexStockBeta.get_index_beta_factor 的算法一致:
+    剔除 pe<=0 的成分股后，按市值加权或等权计算调和平均
+
+    input:
+        panel: ValuationStore.get_panel 返回的 {field: 日期 × 股票代码} 面板
+        members: {日期: 成分股代码列表}，或与面板对齐的 日期 × 股票代码 bool 矩阵
+        index_type: 1为等权重方式计算，0为按市值加权计算
+
+    output:
+        DataFrame, index为日期(datetime.date)，列为pe，pb，roe；没有有效数据的日期不出现在结果中
+    """
+    pe = panel['pe_ratio']
+    pb = panel['pb_ratio']
+    cap = panel['circulating_market_cap']
+
+    if isinstance(members, dict):
+        member_days = {to_timestamp(day): codes for day, codes in members.items()}
+        positions = {code: i for i, code in enumerate(pe.columns)}
+        values = np.zeros(pe.shape, dtype=bool)
+        for row, day in enumerate(pe.index):
+            values[row, [positions[code] for code in member_days.get(day, []) if code in positions]] = True
+        mask = pd.DataFrame(values, index=pe.index, columns=pe.columns)
+    else:
+        mask = members.reindex(index=pe.index, columns=pe.columns, fill_value=False).astype(bool)
+
+    mask = mask & (pe > 0)
+
+    if index_type == 0:
+        cap_sum = cap.where(mask).sum(axis=1)
+        pe_values = cap_sum / (cap / pe).where(mask).sum(axis=1)
+        pb_values = cap_sum / (cap / pb).where(mask).sum(axis=1)
+    else:
+        size = mask.sum(axis=1)
+        pe_values = size / (1 / pe).where(mask).sum(axis=1)
+        pb_values = size / (1 / pb).where(mask).sum(axis=1)
+
+    result = pd.DataFrame({'pe': pe_values, 'pb': pb_values, 'roe': pb_values / pe_values},
+                          columns=['pe', 'pb', 'roe'])
+    result = result.replace([float('inf'), -float('inf')], float('nan')).dropna()
+    result = result[(result != 0).all(axis=1)]
+    result.index = [day.date() for day in result.index]
+    return result
+
+
+_valuation_store = None
+
+
+def get_valuation_store():
+    """进程内共享的估值仓库"""
+    global _valuation_store
+    if _valuation_store is None:
+        _valuation_store = ValuationStore()
+    return _valuation_store
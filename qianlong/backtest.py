@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""双低轮动回测
+
+从转债快照仓库读出 转债 × 日期 的长表，每隔 rebalance_interval 个交易日调仓一次:
+按双低策略的筛选条件筛选，取双低值最小的 items_count 只转债等权买入，计入手续费和滑点。
+转债强赎、到期或退市后快照中不再出现，最后一个快照日之后的第一个交易日按最后的价格兑付为现金，不计手续费和滑点。
+
+调仓只在调仓日逐日计算(几百次)，每天的组合市值用 持仓矩阵(日期 × 转债) 与 价格矩阵 一次性计算，
+2018年至今的回测在几秒内完成，可以用来检验 DOUBLE_LOW_VALUE 等筛选参数在历史上的效果。
+
+筛选条件默认与 DLowStrategy.BASE_FILTERS 一致，也可以传入自定义的 screen，比如在 notebook 中:
+
+    screen = lambda bonds, day: DLowStrategy(bonds, day.strftime('%Y-%m-%d')).select(DLowStrategy.BASE_FILTERS)
+"""
+
+import bisect
+import numpy as np
+import pandas as pd
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from bond_panel import get_bond_panel
+from provider import get_provider, to_date
+from redemption import REDEMPTION_WINDOW, compute_redemption_status
+from ytm import compute_ytm
+
+# 回测需要从快照中读取的列
+BACKTEST_COLUMNS = ['code', 'short_name', 'stock_code', 'last_cash_date', 'raise_fund_volume', 'current_fund_volume',
+                    'convert_price', 'price', 'money', 'stock_price']
+
+# 每年的交易日数
+TRADE_DAYS_PER_YEAR = 244
+
+
+def prepare_bonds(panel):
+    """
+    快照长表 -> 与 ConvertBondBeta.get_bonds 相同字段的长表，剔除没有行情和停牌(价格小于1)的转债
+
+    output:
+        DataFrame, 增加 day_market_volume, convert_premium_ratio, double_low, ytm, ytm_after_tax, days_to_trigger 列
+    """
+    bonds = panel[panel['price'] >= 1].rename(columns={'money': 'day_market_volume'})
+    convert_value = 100 / bonds['convert_price'] * bonds['stock_price']
+    bonds = bonds.assign(convert_premium_ratio=(bonds['price'] - convert_value) / convert_value)
+    bonds['double_low'] = bonds['price'] + bonds['convert_premium_ratio'] * 100
+    bonds['ytm'], bonds['ytm_after_tax'] = compute_ytm(bonds['code'], bonds['price'], bonds['date'])
+
+    # 强赎状态按全部快照计算，停牌的日期也计入
+    status = compute_redemption_status(panel).set_index(['date', 'code'])['days_to_trigger']
+    bonds['days_to_trigger'] = status.reindex(pd.MultiIndex.from_arrays([bonds['date'], bonds['code']])).values
+    return bonds.reset_index(drop=True)
+
+
+def double_low_screen(bonds, double_low_value=130, premium_ratio=0.15, min_fund_volume=pow(10, 8),
+                      max_fund_volume=pow(10, 9), min_market_volume=pow(10, 6), min_cash_days=360, min_ytm_after_tax=None,
+                      exclude_redemption=False):
+    """
+    双低策略的默认筛选条件，对整张长表一次算出布尔掩码，与 DLowStrategy.BASE_FILTERS 一致:
+
+        剩余规模>1亿，且<10亿元
+        当日市场成交额>100万
+        溢价率小于15%
+        双低小于double_low_value
+        到期时间>360天
+        min_ytm_after_tax不为None时，到期税后收益率>min_ytm_after_tax (DLowStrategy 的 filter_ytm 对应 0)
+        exclude_redemption为True时，剔除已经触发强赎条件的转债
+
+    output:
+        布尔 Series
+    """
+    cash_days = pd.to_datetime(bonds['last_cash_date']) - pd.to_datetime(bonds['date'])
+    mask = ((bonds['current_fund_volume'] > min_fund_volume) & (bonds['current_fund_volume'] < max_fund_volume) &
+            (bonds['day_market_volume'] > min_market_volume) &
+            (bonds['convert_premium_ratio'] < premium_ratio) &
+            (bonds['double_low'] < double_low_value) &
+            (cash_days > pd.Timedelta(days=min_cash_days)))
+    if min_ytm_after_tax is not None:
+        mask &= bonds['ytm_after_tax'] > min_ytm_after_tax
+    if exclude_redemption:
+        mask &= bonds['days_to_trigger'] > 0
+    return mask
+
+
+class DoubleLowBacktest(object):
+
+    def __init__(self, begin, end, items_count=20, rebalance_interval=5, fee_rate=0.0003, slippage=0.001,
+                 initial_capital=1000000.0, screen=None, screen_params=None, panel=None):
+        """
+        input:
+            begin, end: 回测区间
+            items_count: 持有的转债个数，与 DLowStrategy.EXPECTED_ITEMS_COUNT 含义一致
+            rebalance_interval: 调仓间隔的交易日数
+            fee_rate: 单边手续费率
+            slippage: 单边滑点，买入价为 price * (1+slippage)，卖出价为 price * (1-slippage)
+            initial_capital: 初始资金
+            screen: 自定义筛选函数 screen(bonds, day)，输入当天的转债 DataFrame，返回筛选后的 DataFrame；
+                    为None时使用 double_low_screen
+            screen_params: 传给 double_low_screen 的参数，比如 {'double_low_value': 125}
+            panel: 转债快照仓库，默认使用进程内共享的 BondPanelStore
+        """
+        self._begin = to_date(begin)
+        self._end = to_date(end)
+        self._items_count = items_count
+        self._rebalance_interval = rebalance_interval
+        self._fee_rate = fee_rate
+        self._slippage = slippage
+        self._initial_capital = initial_capital
+        self._screen = screen
+        self._screen_params = screen_params or {}
+        self._panel = panel if panel is not None else get_bond_panel()
+
+    def _get_targets(self, bonds, rebalance_days):
+        """每个调仓日要持有的转债，按双低值从小到大取前 items_count 只"""
+        if self._screen is None:
+            selected = bonds[double_low_screen(bonds, **self._screen_params) & bonds['date'].isin(rebalance_days)]
+        else:
+            frames = []
+            for day, day_bonds in bonds[bonds['date'].isin(rebalance_days)].groupby('date'):
+                frames.append(pd.DataFrame(self._screen(day_bonds, day)).assign(date=day))
+            selected = pd.concat(frames, ignore_index=True) if frames else bonds.iloc[:0]
+
+        selected = selected.sort_values(['date', 'double_low'], kind='mergesort').groupby('date').head(self._items_count)
+        return selected.groupby('date')['code'].apply(list).to_dict()
+
+    def run(self):
+        """
+        output:
+            DataFrame, index为交易日，列为:
+                equity: 组合市值
+                returns: 日收益率
+                drawdown: 相对历史最高市值的回撤
+                turnover: 调仓日的换手率(买卖总额 / 组合市值)，其它日期为0
+                holdings: 持有的转债个数
+        """
+        all_days = get_provider().get_all_trade_days()
+        days = [day for day in all_days if self._begin <= day <= self._end]
+
+        # 多读 REDEMPTION_WINDOW 个交易日，回测开始时的强赎计数才是完整的
+        history_days = [day for day in all_days if day < self._begin][-REDEMPTION_WINDOW:]
+        panel = self._panel.get_panel(history_days + days, BACKTEST_COLUMNS)
+        bonds = prepare_bonds(panel)
+        bonds = bonds[bonds['date'] >= self._begin]
+
+        # 日期 × 转债 的价格矩阵，停牌期间沿用最后一个价格
+        prices = bonds.pivot(index='date', columns='code', values='price').reindex(days).ffill()
+        price_values = prices.values
+        code_positions = {code: i for i, code in enumerate(prices.columns)}
+        day_positions = {day: i for i, day in enumerate(days)}
+
+        # 快照(包含停牌的日期)在回测结束之前就没有了的转债，最后一个快照日之后的第一个交易日兑付
+        cash_outs = {}
+        last_days = panel.groupby('code')['date'].max()
+        for code, last_day in last_days[last_days < days[-1]].items():
+            if code in code_positions:
+                cash_out_day = days[bisect.bisect_right(days, last_day)]
+                cash_outs.setdefault(cash_out_day, []).append(code_positions[code])
+
+        rebalance_days = days[::self._rebalance_interval]
+        targets = self._get_targets(bonds, rebalance_days)
+        cost_rate = self._fee_rate + self._slippage
+
+        # 只在调仓日和兑付日顺序计算持仓，区间内每天的市值之后一次性计算
+        shares = np.zeros(len(prices.columns))
+        cash = self._initial_capital
+        event_days = sorted(set(rebalance_days) | set(cash_outs))
+        rebalance_set = set(rebalance_days)
+        share_rows, cash_rows, turnovers = [], [], []
+        for day in event_days:
+            price = price_values[day_positions[day]]
+
+            if day in cash_outs:
+                positions = cash_outs[day]
+                cash += np.dot(shares[positions], price[positions])
+                shares = shares.copy()
+                shares[positions] = 0.0
+
+            if day in rebalance_set:
+                valid = ~np.isnan(price)
+                equity = cash + np.dot(shares[valid], price[valid])
+
+                target_shares = np.zeros(len(shares))
+                codes = targets.get(day, [])
+                if codes:
+                    positions = [code_positions[code] for code in codes]
+                    target_value = equity * (1 - cost_rate) / len(positions)
+                    target_shares[positions] = target_value / price[positions]
+
+                delta = np.where(valid, target_shares - shares, 0.0)
+                trade_price = np.where(valid, price, 0.0)
+                buy_value = np.dot(np.clip(delta, 0, None), trade_price)
+                sell_value = -np.dot(np.clip(delta, None, 0), trade_price)
+                cash += sell_value * (1 - cost_rate) - buy_value * (1 + cost_rate)
+                shares = shares + delta
+                turnovers.append((buy_value + sell_value) / equity if equity else 0.0)
+
+            share_rows.append(shares)
+            cash_rows.append(cash)
+
+        share_matrix = pd.DataFrame(share_rows, index=event_days).reindex(days).ffill().values
+        cash_series = pd.Series(cash_rows, index=event_days).reindex(days).ffill()
+        equity = cash_series.values + (share_matrix * np.nan_to_num(price_values)).sum(axis=1)
+
+        result = pd.DataFrame({'equity': equity}, index=days)
+        result['returns'] = result['equity'].pct_change().fillna(0.0)
+        result['drawdown'] = result['equity'] / result['equity'].cummax() - 1
+        result['turnover'] = pd.Series(turnovers, index=rebalance_days).reindex(days).fillna(0.0)
+        result['holdings'] = (share_matrix > 0).sum(axis=1)
+        return result
+
+
+def summarize(result):
+    """
+    回测结果的统计值
+
+    output:
+        dict: total_return(总收益率), annual_return(年化收益率), max_drawdown(最大回撤), annual_turnover(年化换手率)
+    """
+    years = max(len(result) - 1, 1) / float(TRADE_DAYS_PER_YEAR)
+    total_return = result['equity'].iloc[-1] / result['equity'].iloc[0] - 1
+    return {
+        'total_return': total_return,
+        'annual_return': pow(1 + total_return, 1 / years) - 1,
+        'max_drawdown': result['drawdown'].min(),
+        'annual_turnover': result['turnover'].sum() / years,
+    }
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""转债市场历史指标序列
+
+从转债快照仓库一次读出 转债 × 日期 的长表，按日期分组一次算出每天的
+市场总量、低估转债市场总量、平均价格、平均溢价率，不再逐日调用 get_bonds。
+
+每天的指标只依赖当天的快照，算过的日期保存在本地，每天刷新时只需要计算新增的交易日:
+
+    path/bond_factors_<underrate_price>.csv: date, total_markets, underrate_markets, avg_prices, avg_premium_ratios
+
+get_quantiles 用滑动窗口百分位一次算出每天的平均价格、平均溢价率在历史区间中的百分位，不再每天重新排序整个窗口。
+"""
+
+import os
+import pandas as pd
+from datetime import datetime, timedelta
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from bond_panel import get_bond_panel
+from provider import get_provider, to_date
+from rolling_rank import rolling_quantile
+
+# 默认的本地存储目录，设为None时只在内存中缓存
+BOND_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.qianlong', 'bond_history')
+
+BOND_FACTOR_COLUMNS = ['total_markets', 'underrate_markets', 'avg_prices', 'avg_premium_ratios']
+
+# 计算指标需要从快照中读取的列
+PANEL_COLUMNS = ['par', 'issue_par', 'current_fund_volume', 'convert_price', 'price', 'stock_price']
+
+
+def compute_bonds_factors(panel, underrate_price):
+    """
+    按日期分组计算转债市场指标，算法与 ConvertBondBeta.get_bonds_factors 一致
+
+    input:
+        panel: BondPanelStore.get_panel 返回的长表，至少包含 date 和 PANEL_COLUMNS
+        underrate_price: 低于这个价格的转债看作低估
+
+    output:
+        DataFrame, index为日期，列为 BOND_FACTOR_COLUMNS
+    """
+    if len(panel) == 0:
+        return pd.DataFrame(columns=BOND_FACTOR_COLUMNS)
+
+    # 有部分还没有公布信息的的转债用债券面值计算价格
+    price = panel['price'].astype(float).fillna(panel['par'].astype(float))
+    market = price * panel['current_fund_volume'].astype(float) / panel['issue_par'].astype(float)
+    convert_value = 100 / panel['convert_price'].astype(float) * panel['stock_price'].astype(float)
+
+    df = pd.DataFrame({
+        'date': panel['date'],
+        'total_markets': market,
+        'underrate_markets': market.where(price <= underrate_price, 0.0),
+        'avg_prices': price,
+        'avg_premium_ratios': (price - convert_value) / convert_value,
+    })
+    grouped = df.groupby('date')
+    result = grouped[['total_markets', 'underrate_markets']].sum().join(
+        grouped[['avg_prices', 'avg_premium_ratios']].mean())
+    return result[BOND_FACTOR_COLUMNS]
+
+
+class BondFactorHistory(object):
+
+    def __init__(self, path=BOND_HISTORY_PATH, underrate_price=110, panel=None):
+        """
+        input:
+            path: 本地存储目录，为None时只缓存在内存中
+            underrate_price: 低于这个价格的转债看作低估
+            panel: 转债快照仓库，默认使用进程内共享的 BondPanelStore
+        """
+        self._path = path
+        self._underrate_price = underrate_price
+        self._panel = panel
+        self._factors = None
+
+    def _factors_file(self):
+        return os.path.join(self._path, 'bond_factors_{}.csv'.format(self._underrate_price))
+
+    def _load(self):
+        if self._factors is None:
+            if self._path and os.path.exists(self._factors_file()):
+                df = pd.read_csv(self._factors_file(), index_col=0, float_precision='round_trip')
+                df.index = pd.to_datetime(df.index).date
+                self._factors = df
+            else:
+                self._factors = pd.DataFrame(columns=BOND_FACTOR_COLUMNS)
+        return self._factors
+
+    def _save(self):
+        if not self._path:
+            return
+
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+        self._factors.to_csv(self._factors_file(), index_label='date')
+
+    def get_factors(self, days):
+        """
+        获取多个日期的转债市场指标，本地没有的日期从快照仓库批量计算
+
+        input:
+            days: 日期列表
+
+        output:
+            DataFrame, index为日期，列为 BOND_FACTOR_COLUMNS，没有转债的日期不在结果中
+        """
+        days = sorted(set(to_date(day) for day in days))
+        factors = self._load()
+
+        missing_days = [day for day in days if day not in factors.index]
+        if missing_days:
+            panel = self._panel if self._panel is not None else get_bond_panel()
+            new_factors = compute_bonds_factors(panel.get_panel(missing_days, PANEL_COLUMNS), self._underrate_price)
+
+            # 当天还没有收盘，不记录，下次再算
+            today = datetime.now().date()
+            saved = new_factors[[day < today for day in new_factors.index]]
+            if len(saved):
+                self._factors = factors = pd.concat([factors, saved]).sort_index()
+                self._save()
+            factors = pd.concat([factors, new_factors[~new_factors.index.isin(saved.index)]])
+
+        return factors[factors.index.isin(days)].sort_index().astype('float64')
+
+    def get_quantiles(self, days, history_days=365*3):
+        """
+        每天的平均价格、平均溢价率在 [day - history_days, day] 之间的历史百分位，
+        与 BoudStrategy(ConvertBondBeta(base_date=day, history_days)) 中的百分位一致
+
+        input:
+            days: 日期列表
+            history_days: 历史区间的自然日数
+
+        output:
+            DataFrame, index为日期，列为 avg_price_quantile, premium_ratio_quantile，没有转债的日期不在结果中
+        """
+        days = sorted(set(to_date(day) for day in days))
+        if not days:
+            return pd.DataFrame(columns=['avg_price_quantile', 'premium_ratio_quantile'])
+
+        history = self.get_factors(get_provider().get_trade_days(start_date=days[0] - timedelta(history_days),
+                                                                 end_date=days[-1]))
+        current = history[history.index.isin(days)]
+        # 窗口包含两端
+        return pd.DataFrame({
+            'avg_price_quantile': rolling_quantile(history['avg_prices'], history_days=history_days + 1,
+                                                   queries=current['avg_prices'], include_current=True),
+            'premium_ratio_quantile': rolling_quantile(history['avg_premium_ratios'], history_days=history_days + 1,
+                                                       queries=current['avg_premium_ratios'], include_current=True),
+        })
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""转债存续区间索引
+
+get_bonds(date) 每天都要按 interest_begin_date、last_cash_date、list_date、list_status_id 过滤 CONBOND_BASIC_INFO，
+未上市的转债还要逐只去 BOND_BASIC_INFO 确认。这些字段与查询日期无关，这里把整张表取一次缓存在本地，
+每只转债换算成一个存续区间:
+
+    [max(interest_begin_date + 1天, list_date), last_cash_date]
+
+区间按起始日排序后，某一天存续的转债用二分查找得到；一段日期的存续转债对每只转债在交易日列表上二分查找，
+多年的回测不用再访问数据源，也不用每天重新扫描全表。
+
+数据源中的表每天都可能更新(新发行、上市)，本地缓存每个自然日刷新一次。
+"""
+
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from datetime import datetime
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from provider import get_provider, to_date
+
+# 默认的本地存储文件，设为None时只在内存中缓存
+BOND_LIFECYCLE_PATH = os.path.join(os.path.expanduser('~'), '.qianlong', 'bond_lifecycle.pkl')
+
+# 未上市
+UNLISTED_STATUS_ID = '301099'
+
+
+def fetch_bond_lifecycle():
+    """
+    从数据源获取所有转债的基本信息，BOND_BASIC_INFO 中确认仍未上市的转债一次查询后剔除
+
+    output:
+        DataFrame, 与 CONBOND_BASIC_INFO 字段一致，按code排序
+    """
+    df = get_provider().get_all_conbond_basic_info()
+
+    # issue-2: CONBOND_BASIC_INO表中数据更新不及时，需要去BOND_BASIC_INFO中确认一下
+    unlisted = df['list_status_id'].astype(str) == UNLISTED_STATUS_ID
+    if unlisted.any():
+        bond_basic_info = get_provider().get_bond_basic_info(list(df['code'][unlisted]))
+        still_unlisted = bond_basic_info['code'][bond_basic_info['list_status_id'].astype(str) == UNLISTED_STATUS_ID]
+        df = df[~(unlisted & df['code'].isin(still_unlisted))]
+
+    return df.sort_values('code').reset_index(drop=True)
+
+
+def _to_datetime64(values):
+    """date/None 列 -> datetime64[D] 数组，None为NaT"""
+    return pd.to_datetime(pd.Series(values, dtype=object)).values.astype('datetime64[D]')
+
+
+class BondLifecycle(object):
+    """转债存续区间，按起始日排序，二分查找某天或一段日期存续的转债"""
+
+    def __init__(self, path=BOND_LIFECYCLE_PATH, fetcher=fetch_bond_lifecycle):
+        """
+        input:
+            path: 本地缓存文件，为None时只缓存在内存中
+            fetcher: 数据源函数，返回所有转债的基本信息
+        """
+        self._path = path
+        self._fetcher = fetcher
+        self._updated = None
+        self._table = None
+        # 按起始日排序的存续区间，以及对应的 _table 行号
+        self._starts = None
+        self._ends = None
+        self._rows = None
+
+    def _load(self):
+        today = datetime.now().date()
+        if self._table is not None and self._updated >= today:
+            return
+
+        if self._path and os.path.exists(self._path):
+            with open(self._path, 'rb') as f:
+                self._updated, self._table = pickle.load(f)
+
+        if self._table is None or self._updated < today:
+            self._updated, self._table = today, self._fetcher()
+            self._save()
+        self._build_index()
+
+    def _save(self):
+        if not self._path:
+            return
+
+        if not os.path.exists(os.path.dirname(self._path)):
+            os.makedirs(os.path.dirname(self._path))
+        with open(self._path, 'wb') as f:
+            pickle.dump((self._updated, self._table), f)
+
+    def _build_index(self):
+        # interest_begin_date < day 即 day >= interest_begin_date + 1天；没有上市日期时不限制
+        starts = _to_datetime64(self._table['interest_begin_date']) + np.timedelta64(1, 'D')
+        list_dates = _to_datetime64(self._table['list_date'])
+        starts = np.where(list_dates > starts, list_dates, starts)
+        ends = _to_datetime64(self._table['last_cash_date'])
+
+        # 没有计息或兑付日期的转债永远不在存续期内
+        valid = ~(np.isnat(starts) | np.isnat(ends)) & (starts <= ends)
+        rows = np.flatnonzero(valid)
+        order = np.argsort(starts[rows], kind='mergesort')
+        self._rows = rows[order]
+        self._starts = starts[self._rows]
+        self._ends = ends[self._rows]
+
+    def refresh(self):
+        """丢弃缓存，重新从数据源获取"""
+        self._table = None
+        self._updated = None
+        if self._path and os.path.exists(self._path):
+            os.remove(self._path)
+        self._load()
+
+    def get_table(self):
+        """所有转债的基本信息，按code排序"""
+        self._load()
+        return self._table
+
+    def get_alive_rows(self, day):
+        """某天存续的转债在 get_table() 中的行号，升序(即按code排序)"""
+        self._load()
+        day = np.datetime64(to_date(day), 'D')
+        count = np.searchsorted(self._starts, day, side='right')
+        return np.sort(self._rows[:count][self._ends[:count] >= day])
+
+    def get_alive(self, day):
+        """
+        指定日期存续的转债，与 get_conbond_basic_info(day) 之后剔除未上市转债的结果一致
+
+        output:
+            DataFrame, 与 CONBOND_BASIC_INFO 字段一致，按code排序
+        """
+        rows = self.get_alive_rows(day)
+        return self._table.iloc[rows].reset_index(drop=True)
+
+    def get_alive_codes(self, day):
+        """指定日期存续的转债代码列表，按code排序"""
+        rows = self.get_alive_rows(day)
+        return list(self._table['code'].values[rows])
+
+    def get_alive_range(self, begin=None, end=None, days=None):
+        """
+        一段日期中每天存续的转债
+
+        input:
+            begin, end: 日期区间，取其中的交易日
+            days: 直接给出日期列表，此时忽略 begin, end
+
+        output:
+            DataFrame, 列为 date, code，按 date, code 排序
+        """
+        self._load()
+        if days is None:
+            days = get_provider().get_trade_days(start_date=begin, end_date=end)
+        days = sorted(set(to_date(day) for day in days))
+        day_values = np.array(days, dtype='datetime64[D]')
+
+        # 每只转债在日期列表中存续的 [first, last) 区间
+        first = np.searchsorted(day_values, self._starts, side='left')
+        last = np.searchsorted(day_values, self._ends, side='right')
+        counts = np.maximum(last - first, 0)
+
+        total = counts.sum()
+        rows = np.repeat(self._rows, counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        day_positions = np.repeat(first, counts) + offsets
+
+        df = pd.DataFrame({
+            'date': np.array(days, dtype=object)[day_positions] if total else np.array([], dtype=object),
+            'code': self._table['code'].values[rows],
+            'position': day_positions,
+            'row': rows,
+        })
+        return df.sort_values(['position', 'row']).reset_index(drop=True)[['date', 'code']]
+
+
+_bond_lifecycle = None
+
+
+def get_bond_lifecycle():
+    """进程内共享的转债存续区间索引"""
+    global _bond_lifecycle
+    if _bond_lifecycle is None:
+        _bond_lifecycle = BondLifecycle()
+    return _bond_lifecycle
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""可转债每日快照仓库
+
+每个交易日保存一份全市场存续转债的快照，按日期分区落盘:
+
+    path/2020/2020-03-02.parquet (没有安装 pyarrow/fastparquet 时为 .pkl)
+
+回测或统计历史时 get_bonds(date) 只是读取一个文件，不再每天从原始表重新拼出转债列表；
+跨多年扫描时可以只读需要的列。
+"""
+
+import os
+import pandas as pd
+from datetime import datetime
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from bond_lifecycle import get_bond_lifecycle
+from provider import get_provider, to_date
+
+# 默认的本地存储目录，设为None时只在内存中缓存
+BOND_PANEL_PATH = os.path.join(os.path.expanduser('~'), '.qianlong', 'bond_panel')
+
+# 快照的列
+BOND_PANEL_COLUMNS = ['code', 'short_name', 'stock_code', 'list_status_id', 'list_date', 'last_cash_date',
+                      'par', 'issue_par', 'raise_fund_volume', 'current_fund_volume', 'acc_convert_ratio',
+                      'convert_price', 'price', 'money', 'stock_price']
+
+try:
+    import pyarrow
+    PANEL_FORMAT = 'parquet'
+except ImportError:
+    try:
+        import fastparquet
+        PANEL_FORMAT = 'parquet'
+    except ImportError:
+        PANEL_FORMAT = 'pkl'
+
+
+def fetch_bond_snapshot(date):
+    """
+    从全局数据源批量获取指定日期正常存续的转债，每张表对所有转债只查询一次，存续的转债列表来自 BondLifecycle
+
+        已经上市(或BOND_BASIC_INFO确认已上市)、累计转股比例低于99.5%的转债
+        raise_fund_volume / current_fund_volume: 发行总量 / 当前存量(元)
+        convert_price: 下修后的转股价
+        price, money: 截止到当天最后一个交易日的收盘价和成交额，没有行情时为NaN
+        stock_price: 正股收盘价
+
+    output:
+        DataFrame, 列为 BOND_PANEL_COLUMNS，按code排序
+    """
+    date = to_date(date)
+
+    # 存续的转债直接从本地的存续区间索引中二分查找，已经剔除了未上市和还没有正式上市的转债
+    df_bonds = get_bond_lifecycle().get_alive(date)
+    if df_bonds.empty:
+        return pd.DataFrame(columns=BOND_PANEL_COLUMNS)
+
+    df = df_bonds.rename(columns={'company_code': 'stock_code'}).set_index('code')
+    df['list_status_id'] = df['list_status_id'].astype(str)
+    codes = list(df.index)
+
+    # 发行总量，部分转债没有实际发行量，这个时候用计划发行量来代替
+    df['raise_fund_volume'] = df['actual_raise_fund'].astype(float).fillna(df['plan_raise_fund'].astype(float)) * 10000
+    df['current_fund_volume'] = df['raise_fund_volume']
+
+    # 转股信息，如果99%转股，就代表强赎退市，暂不记入，另外要修正存量；转股价如果有下修，取下修转股价
+    df['convert_price'] = df['convert_price'].astype(float)
+    bond_stock = get_provider().get_conbond_last_convert(codes, date)
+    has_convert = df.index.isin(bond_stock.index)
+    bond_stock = bond_stock.reindex(index=df.index, columns=['acc_convert_ratio', 'convert_price']).astype(float)
+    df['acc_convert_ratio'] = bond_stock['acc_convert_ratio']
+    df.loc[has_convert, 'current_fund_volume'] = df['raise_fund_volume'] * (100.0 - bond_stock['acc_convert_ratio']) / 100.0
+    df.loc[has_convert, 'convert_price'] = bond_stock['convert_price']
+    df = df[~(df['acc_convert_ratio'] >= 99.5)].copy()
+
+    # 当前市场收盘价格和成交额
+    bond_market = get_provider().get_conbond_last_price(list(df.index), date)
+    bond_market = bond_market.reindex(index=df.index, columns=['close', 'money']).astype(float)
+    df['price'] = bond_market['close']
+    df['money'] = bond_market['money']
+
+    # 正股价格
+    stock_prices = get_provider().get_last_prices(sorted(set(df['stock_code'])), date, count=7, field='close')
+    df['stock_price'] = df['stock_code'].map(stock_prices).astype(float)
+
+    return df.reset_index()[BOND_PANEL_COLUMNS]
+
+
+class BondPanelStore(object):
+    """每个交易日一份转债快照，按日期分区保存在 path 下:
+
+        path/2020/2020-03-02.parquet
+    """
+
+    def __init__(self, path=BOND_PANEL_PATH, fetcher=fetch_bond_snapshot):
+        """
+        input:
+            path: 本地存储目录，为None时只缓存在内存中
+            fetcher: 数据源函数，输入日期，返回当天的转债快照 DataFrame
+        """
+        self._path = path
+        self._fetcher = fetcher
+        # date -> DataFrame
+        self._snapshots = {}
+
+    def _snapshot_file(self, day):
+        return os.path.join(self._path, str(day.year), '{}.{}'.format(day.strftime('%Y-%m-%d'), PANEL_FORMAT))
+
+    def _read_snapshot(self, day, columns=None):
+        if PANEL_FORMAT == 'parquet':
+            return pd.read_parquet(self._snapshot_file(day), columns=columns)
+
+        df = pd.read_pickle(self._snapshot_file(day))
+        return df[columns] if columns is not None else df
+
+    def _save_snapshot(self, day, df):
+        if not self._path:
+            return
+
+        year_path = os.path.join(self._path, str(day.year))
+        if not os.path.exists(year_path):
+            os.makedirs(year_path)
+
+        if PANEL_FORMAT == 'parquet':
+            df.to_parquet(self._snapshot_file(day), index=False)
+        else:
+            df.to_pickle(self._snapshot_file(day))
+
+    def has_date(self, day):
+        """本地是否已经有该日期的快照"""
+        day = to_date(day)
+        return day in self._snapshots or bool(self._path and os.path.exists(self._snapshot_file(day)))
+
+    def _fetch(self, day):
+        df = self._fetcher(day)
+        if len(df) and day < datetime.now().date():
+            # 当天还没有收盘、或者数据源还没有数据时不记录，下次再取
+            self._snapshots[day] = df
+            self._save_snapshot(day, df)
+        return df
+
+    def fill(self, days):
+        """
+        从数据源补齐本地没有的日期
+
+        input:
+            days: 日期列表
+
+        output:
+            实际从数据源拉取的日期个数
+        """
+        missing_days = [day for day in sorted(set(to_date(day) for day in days)) if not self.has_date(day)]
+        for day in missing_days:
+            self._fetch(day)
+        return len(missing_days)
+
+    def get_snapshot(self, day, columns=None):
+        """
+        获取指定日期的转债快照，本地没有时先从数据源补齐
+
+        input:
+            day: 日期
+            columns: 需要的列，默认全部
+
+        output:
+            DataFrame, 列为 BOND_PANEL_COLUMNS (或 columns)，按code排序
+        """
+        day = to_date(day)
+        if day in self._snapshots:
+            df = self._snapshots[day]
+        elif self._path and os.path.exists(self._snapshot_file(day)):
+            df = self._read_snapshot(day, columns)
+            if columns is None:
+                self._snapshots[day] = df
+        else:
+            df = self._fetch(day)
+
+        return df[list(columns)] if columns is not None else df
+
+    def get_panel(self, days, columns=None):
+        """
+        一次读取多个日期的快照，跨多年扫描时只读需要的列
+
+        input:
+            days: 日期列表
+            columns: 需要的列，默认全部
+
+        output:
+            DataFrame, 第一列为date，其余为快照的列
+        """
+        frames = []
+        for day in sorted(set(to_date(day) for day in days)):
+            df = self.get_snapshot(day, columns)
+            if len(df):
+                frames.append(df.assign(date=day))
+
+        columns = list(columns) if columns is not None else BOND_PANEL_COLUMNS
+        if not frames:
+            return pd.DataFrame(columns=['date'] + columns)
+        return pd.concat(frames, ignore_index=True)[['date'] + columns]
+
+
+_bond_panel = None
+
+
+def get_bond_panel():
+    """进程内共享的转债快照仓库"""
+    global _bond_panel
+    if _bond_panel is None:
+        _bond_panel = BondPanelStore()
+    return _bond_panel
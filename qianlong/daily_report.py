@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""每日筛选结果的变化报告
+
+每天发送的消息原来是几个筛选结果各自 to_html() 再拼接，内容随筛选条件的个数成倍增长，而且大部分每天都不变。
+这里把所有筛选结果合成一张表(screen, rank, code, ...)，与上一个交易日保存的结果按 (screen, code) 对比，只输出:
+
+    新增: 今天进入筛选结果的转债
+    剔除: 昨天在、今天不在筛选结果中的转债
+    变动: 排名变化 >= rank_threshold 或 双低值变化 >= double_low_threshold 的转债
+
+变化表只渲染一次 HTML。每天的筛选结果按日期保存在本地，第一次运行时所有转债都记为新增。
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from provider import to_date
+
+# 默认的本地存储目录，设为None时只在内存中保存
+SCREEN_REPORT_PATH = os.path.join(os.path.expanduser('~'), '.qianlong', 'screen_report')
+
+# 每个筛选结果中保存的字段
+SCREEN_COLUMNS = ['code', 'short_name', 'price', 'convert_premium_ratio', 'double_low']
+
+# 报告中的变化类型，按这个顺序输出
+CHANGE_ADDED = '新增'
+CHANGE_DROPPED = '剔除'
+CHANGE_MOVED = '变动'
+CHANGE_ORDER = [CHANGE_ADDED, CHANGE_DROPPED, CHANGE_MOVED]
+
+REPORT_COLUMNS = ['screen', 'change', 'code', 'short_name', 'rank', 'prev_rank', 'double_low', 'prev_double_low',
+                  'price', 'convert_premium_ratio']
+
+
+def build_screen_frame(screens):
+    """
+    多个筛选结果合成一张表
+
+    input:
+        screens: {筛选名称: get_support_bonds 的结果(按双低值排序的列表或DataFrame)}
+
+    output:
+        DataFrame, 列为 screen, rank(从1开始), SCREEN_COLUMNS
+    """
+    frames = []
+    for name, bonds in screens.items():
+        df = pd.DataFrame(bonds, columns=SCREEN_COLUMNS) if len(bonds) == 0 else pd.DataFrame(bonds)[SCREEN_COLUMNS]
+        frames.append(df.assign(screen=name, rank=np.arange(1, len(df) + 1)))
+
+    if not frames:
+        return pd.DataFrame(columns=['screen', 'rank'] + SCREEN_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[['screen', 'rank'] + SCREEN_COLUMNS]
+
+
+def diff_screens(previous, current, rank_threshold=3, double_low_threshold=2.0):
+    """
+    对比两天的筛选结果
+
+    input:
+        previous, current: build_screen_frame 的结果，previous 为None时所有转债都记为新增
+        rank_threshold: 排名变化达到多少名时报告
+        double_low_threshold: 双低值变化达到多少时报告
+
+    output:
+        DataFrame, 列为 REPORT_COLUMNS，按 screen, change, rank 排序，没有变化时为空表
+    """
+    if previous is None:
+        previous = current.iloc[:0]
+
+    merged = pd.merge(current, previous[['screen', 'code', 'short_name', 'rank', 'double_low']],
+                      on=['screen', 'code'], how='outer', suffixes=('', '_prev'), indicator=True)
+    merged = merged.rename(columns={'rank_prev': 'prev_rank', 'double_low_prev': 'prev_double_low'})
+    merged['short_name'] = merged['short_name'].fillna(merged['short_name_prev'])
+
+    moved = (((merged['rank'] - merged['prev_rank']).abs() >= rank_threshold) |
+             ((merged['double_low'] - merged['prev_double_low']).abs() >= double_low_threshold))
+    merged['change'] = np.select(
+        [merged['_merge'] == 'left_only', merged['_merge'] == 'right_only', moved],
+        [CHANGE_ADDED, CHANGE_DROPPED, CHANGE_MOVED], default='')
+
+    report = merged[merged['change'] != ''].copy()
+    report['change_order'] = report['change'].map({change: i for i, change in enumerate(CHANGE_ORDER)})
+    report['sort_rank'] = report['rank'].fillna(report['prev_rank'])
+
+    # 保持筛选条件传入的顺序
+    screen_order = {name: i for i, name in enumerate(pd.unique(pd.concat([current['screen'], previous['screen']])))}
+    report['screen_order'] = report['screen'].map(screen_order)
+    report = report.sort_values(['screen_order', 'change_order', 'sort_rank'], kind='mergesort')
+    for column in ['rank', 'prev_rank']:
+        report[column] = report[column].astype('Int64')
+    return report.reset_index(drop=True)[REPORT_COLUMNS]
+
+
+def render_report(report, title=None):
+    """
+    变化表 -> HTML，一次渲染
+
+    output:
+        HTML文本，没有变化时只有标题和说明
+    """
+    lines = [title] if title else []
+    if len(report) == 0:
+        lines.append('筛选结果没有变化')
+    else:
+        lines.append(report.to_html(index=False, na_rep='', float_format=lambda value: '{:.2f}'.format(value)))
+    return '\r\n'.join(lines)
+
+
+class ScreenReport(object):
+    """保存每天的筛选结果，与上一个交易日对比后生成变化报告"""
+
+    def __init__(self, path=SCREEN_REPORT_PATH, rank_threshold=3, double_low_threshold=2.0):
+        """
+        input:
+            path: 本地存储目录，为None时只在内存中保存
+            rank_threshold: 排名变化达到多少名时报告
+            double_low_threshold: 双低值变化达到多少时报告
+        """
+        self._path = path
+        self._rank_threshold = rank_threshold
+        self._double_low_threshold = double_low_threshold
+        # date -> DataFrame
+        self._frames = {}
+
+    def _frame_file(self, day):
+        return os.path.join(self._path, '{}.csv'.format(day.strftime('%Y-%m-%d')))
+
+    def _saved_days(self):
+        days = set(self._frames)
+        if self._path and os.path.exists(self._path):
+            days.update(to_date(name[:-len('.csv')]) for name in os.listdir(self._path) if name.endswith('.csv'))
+        return sorted(days)
+
+    def _load(self, day):
+        if day not in self._frames:
+            self._frames[day] = pd.read_csv(self._frame_file(day), dtype={'code': str}, float_precision='round_trip')
+        return self._frames[day]
+
+    def _save(self, day, df):
+        self._frames[day] = df
+        if not self._path:
+            return
+
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+        df.to_csv(self._frame_file(day), index=False)
+
+    def get_previous(self, day):
+        """day之前最近一次保存的筛选结果，没有时返回None"""
+        day = to_date(day)
+        days = [saved_day for saved_day in self._saved_days() if saved_day < day]
+        return self._load(days[-1]) if days else None
+
+    def update(self, day, screens):
+        """
+        保存当天的筛选结果并与上一次对比，同一天重复运行时覆盖当天的结果
+
+        input:
+            day: 日期
+            screens: {筛选名称: get_support_bonds 的结果}
+
+        output:
+            diff_screens 的变化表
+        """
+        day = to_date(day)
+        current = build_screen_frame(screens)
+        report = diff_screens(self.get_previous(day), current, self._rank_threshold, self._double_low_threshold)
+        self._save(day, current)
+        return report
+
+    def render(self, day, screens):
+        """update 之后渲染为HTML"""
+        return render_report(self.update(day, screens), '{} 筛选结果变化'.format(to_date(day).strftime('%Y-%m-%d')))
@@ -11,15 +11,19 @@ display(HTML("<style>.container { width:100% !important; }</style>"))
 # In[2]:
 
 
-import bisect
-import copy
 import logging
 import math
 from statistics import mean
 import pandas as pd
-from jqdata import get_all_trade_days
-from jqdata import bond
 from datetime import datetime, timedelta
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from bond_panel import get_bond_panel
+from distribution import HistoryDistribution
+from parallel_fetch import RateLimitedProvider, parallel_map
+from provider import get_provider
+from redemption import REDEMPTION_WINDOW, get_redemption_tracker
+from valuation_history import get_stock_valuation_history
+from ytm import compute_ytm
 
 logging.basicConfig(format='%(asctime)s:%(levelname)s:%(message)s', level=logging.DEBUG)
 
@@ -61,7 +65,7 @@ class ConvertBondBeta(object):
         self._end_date = self._end_date.strftime('%Y-%m-%d')
         self._base_date = self._base_date.strftime('%Y-%m-%d')
         
-    def get_bonds(self, date=None):
+    def get_bonds(self, date=None, bulk=True):
         """
         获取指定日期的可转债市场正常存续的转债的基本信息
         
@@ -76,7 +80,12 @@ class ConvertBondBeta(object):
             stock_price: 正股价格
             last_cash_date: 最终兑付日(到期时间)
             double_low: 转债价格+溢价率X100
-            ytm: 计算方式比较复杂，暂缺失
+            ytm: 到期收益率 (只有bulk方式提供)
+            ytm_after_tax: 税后到期收益率 (只有bulk方式提供)
+            days_to_trigger: 离触发强赎最少还需要的交易日数，0为已经触发 (只有bulk方式提供)
+            
+        input:
+            bulk: 每张表对所有转债只查询一次，再按代码关联；为False时逐只转债查询
         """
         
         if date is None:
@@ -84,14 +93,10 @@ class ConvertBondBeta(object):
         else:
             date = datetime.strptime(date, '%Y-%m-%d').date()
         
-        df_bonds = bond.run_query(
-                query(bond.CONBOND_BASIC_INFO).filter(
-                                    bond.CONBOND_BASIC_INFO.bond_type_id == 703013,
-                                    bond.CONBOND_BASIC_INFO.list_status_id.in_(['301001', '301099']),
-                                    bond.CONBOND_BASIC_INFO.interest_begin_date < date,
-                                    bond.CONBOND_BASIC_INFO.last_cash_date >= date
-                                ).order_by('code').limit(10000)
-            )        
+        if bulk:
+            return self.get_bonds_frame(date).to_dict('records')
+        
+        df_bonds = get_provider().get_conbond_basic_info(date)
     
         bond_list = []
         
@@ -107,11 +112,7 @@ class ConvertBondBeta(object):
             
             if str(row['list_status_id']) == '301099':
                 # issue-2: CONBOND_BASIC_INO表中数据更新不及时，需要去BOND_BASIC_INFO中确认一下
-                bond_basic_info = bond.run_query(
-                                query(bond.BOND_BASIC_INFO).filter(
-                                    bond.BOND_BASIC_INFO.code == row['code']
-                                )
-                              )            
+                bond_basic_info = get_provider().get_bond_basic_info([row['code']])
                 if str(bond_basic_info['list_status_id'][0]) == '301099':
                     # 未上市
                     continue            
@@ -129,12 +130,7 @@ class ConvertBondBeta(object):
             bond_info['current_fund_volume'] = bond_info['raise_fund_volume']
             
             # 转股信息
-            bond_stock = bond.run_query(
-                query(bond.CONBOND_DAILY_CONVERT).filter(
-                                    bond.CONBOND_DAILY_CONVERT.code == bond_info['code'], 
-                                    bond.CONBOND_DAILY_CONVERT.date <= date,
-                                )
-            )   
+            bond_stock = get_provider().get_conbond_daily_convert([bond_info['code']], date)
             
             # 统计转股信息，如果99%转股，就代表强赎退市，暂不记入，另外要修正存量债券数目
             if not bond_stock['acc_convert_ratio'].empty:
@@ -149,12 +145,7 @@ class ConvertBondBeta(object):
                 bond_info['convert_price'] =  float(bond_stock['convert_price'].iloc[-1])                
             
             # 当前市场收盘价格
-            bond_market = bond.run_query(
-                query(bond.CONBOND_DAILY_PRICE).filter(
-                                    bond.CONBOND_DAILY_PRICE.code == bond_info['code'], 
-                                    bond.CONBOND_DAILY_PRICE.date <= date,
-                                )
-            )
+            bond_market = get_provider().get_conbond_daily_price([bond_info['code']], date)
             try:
                 bond_info['price'] =  float(bond_market['close'].iloc[-1])
                 bond_info['day_market_volume'] = float(bond_market['money'].iloc[-1])
@@ -169,11 +160,7 @@ class ConvertBondBeta(object):
 
                 
             # 获取正股价格
-            df_stock_price = get_price(bond_info['stock_code'],
-                                       count = 7,
-                                       end_date= date,
-                                       frequency='daily', 
-                                       fields=['close'])
+            df_stock_price = get_provider().get_price(bond_info['stock_code'], end_date=date, count=7, fields=['close'])
             bond_info['stock_price'] = df_stock_price['close'][-1]
             bond_info['convert_premium_ratio'] = (bond_info['price'] - 100/bond_info['convert_price']*bond_info['stock_price']) /  (100/bond_info['convert_price']*bond_info['stock_price'])
             bond_info['double_low'] = bond_info['price'] + bond_info['convert_premium_ratio'] * 100
@@ -182,6 +169,44 @@ class ConvertBondBeta(object):
             
         bond_list = sorted(bond_list, key=lambda x: x['double_low'])
         return bond_list
+    
+    def get_bonds_frame(self, date):
+        """
+        从转债快照仓库获取指定日期的转债基本信息，字段和筛选规则与逐只转债查询的 get_bonds 一致
+        
+        output:
+            DataFrame, 每行一只转债，按双低值排序
+        """
+        columns = ['code', 'short_name', 'stock_code', 'convert_price', 'last_cash_date', 'raise_fund_volume',
+                   'current_fund_volume', 'price', 'day_market_volume', 'stock_price', 'convert_premium_ratio', 'double_low',
+                   'ytm', 'ytm_after_tax', 'days_to_trigger']
+        
+        df = get_bond_panel().get_snapshot(date)
+        
+        # 有部分还没有公布信息的先跳过，价格小于1的为停牌
+        df = df[df['price'] >= 1].rename(columns={'money': 'day_market_volume'})
+        
+        # 计算溢价率和双低值
+        convert_value = 100 / df['convert_price'] * df['stock_price']
+        df['convert_premium_ratio'] = (df['price'] - convert_value) / convert_value
+        df['double_low'] = df['price'] + df['convert_premium_ratio'] * 100
+        
+        # 到期收益率，所有转债一次求解
+        df['ytm'], df['ytm_after_tax'] = compute_ytm(df['code'], df['price'], date)
+        
+        # 强赎状态由进程内共享的 RedemptionTracker 增量更新，逐日调用时只追加当天的快照，
+        # 第一次调用或者日期不连续时才读取之前 REDEMPTION_WINDOW 个交易日的快照
+        trade_days = [day for day in get_provider().get_all_trade_days() if day <= date][-(REDEMPTION_WINDOW + 1):]
+        if trade_days:
+            day, previous_day = trade_days[-1], trade_days[-2] if len(trade_days) > 1 else None
+            status = get_redemption_tracker().advance(
+                day, previous_day, get_bond_panel().get_snapshot(day),
+                lambda: get_bond_panel().get_panel(trade_days[:-1], ['code', 'stock_price', 'convert_price']))
+            df['days_to_trigger'] = df['code'].map(status['days_to_trigger'])
+        else:
+            df['days_to_trigger'] = float('nan')
+        
+        return df.sort_values('double_low', kind='mergesort').reset_index(drop=True)[columns]
         
             
     def get_bonds_factors(self, bond_list=None):
@@ -209,16 +234,19 @@ class ConvertBondBeta(object):
 
 class StockBeta(object):
     
-    def __init__(self, stock_code, index_type=0, base_date=None, history_days=365*5):
+    def __init__(self, stock_code, index_type=0, base_date=None, history_days=365*5, provider=None):
         """
         input:
             index_code: 要查询指数的代码
             index_type: 1为等权重方式计算，0为按市值加权计算
             base_date: 查询时间，格式为'yyyy-MM-dd'，默认为当天
             history_days: 默认历史区间位前八年
+            provider: 数据源，默认为 get_provider()，可以传入 RateLimitedProvider 限速
         """
+        self._provider = provider if provider is not None else get_provider()
         self._stock_code = stock_code
         self._index_type = index_type
+        self._history_days = history_days
         if not base_date:
             self._base_date = datetime.now().date() - timedelta(1)
         else:
@@ -244,14 +272,7 @@ class StockBeta(object):
         if not day:
             day = datetime.strptime(self._base_date, '%Y-%m-%d')
         
-        stocks = [self._stock_code]
-        q = query(
-            valuation.pe_ratio, valuation.pb_ratio, valuation.circulating_market_cap
-        ).filter(
-            valuation.code.in_(stocks)
-        )
-
-        df = get_fundamentals(q, day)
+        df = self._provider.get_valuation(day, [self._stock_code])
 
         df = df[df['pe_ratio']>0]
 
@@ -277,25 +298,12 @@ class StockBeta(object):
         output：
             result:  指数历史估值的 DataFrame，index 为时间，列为pe，pb,roe
         """
-        all_days = get_all_trade_days()
-
         pes = []
         roes = []
         pbs = []
         days = []
 
-        begin = datetime.strptime(self._begin_date, '%Y-%m-%d').date()
-        end = datetime.strptime(self._end_date, '%Y-%m-%d').date()  
-        i = 0
-        for day in all_days:
-            if(day <= begin or day >= end):
-                continue
-
-            i += 1
-
-            if(i % interval != 0):
-                continue
-
+        for day in self.get_sample_days(interval):
             pe, pb, roe = self.get_stock_beta_factor(day)
             if pe and pb and roe:
                 pes.append(pe)
@@ -306,6 +314,45 @@ class StockBeta(object):
         result = pd.DataFrame({'pe':pes,'pb':pbs, 'roe':roes}, index=days)
         return result
     
+    def get_sample_days(self, interval=7):
+        """
+        历史估值的采样日，从 begin_date 之后开始数，每 interval 个交易日取一个
+        
+        output:
+            begin_date < day < end_date 范围内的采样日列表
+        """
+        begin = datetime.strptime(self._begin_date, '%Y-%m-%d').date()
+        end = datetime.strptime(self._end_date, '%Y-%m-%d').date()
+        all_days = self._provider.get_all_trade_days()
+        return [day for day in all_days if day > begin and day < end][interval-1::interval]
+    
+    def get_stock_valuation(self, interval=7):
+        """
+        获取当前的 pe, pb, roe 和历史估值，与 get_stock_beta_factor、get_stock_beta_history_factors 的结果一致。
+        历史估值从进程内共享的 StockValuationHistory 中取出: 每只正股一份逐日序列，按正股保存在本地，
+        只补算缺失的交易日，不同日期、历史区间和采样间隔共用同一份序列
+        
+        output:
+            (pe, pb, roe, history_factors)，正股报表有问题时 pe, pb 为None，history_factors 也为None
+        """
+        pe, pb, roe = self.get_stock_beta_factor()
+        if pe is None or pb is None:
+            return (pe, pb, roe, None)
+        
+        series = get_stock_valuation_history().get_history(self._stock_code, self._index_type, 1,
+                                                           self._begin_date, self._end_date)
+        return (pe, pb, roe, series.reindex(self.get_sample_days(interval)).dropna())
+    
+    def prefetch(self, stock_codes):
+        """
+        一次补齐多只正股在同一历史区间内缺失的逐日估值，每个交易日只读取一次全市场估值，
+        之后各只正股的 get_stock_valuation 只从序列中切片
+
+        input:
+            stock_codes: 正股代码列表
+        """
+        get_stock_valuation_history().update_many(stock_codes, [self._index_type], 1, self._begin_date, self._end_date)
+    
     def get_quantile_of_history_factors(self, factor, history_list):
         """
             获取某个因子在历史上的百分位，比如当前PE处于历史上的70%区间，意味着历史PE有70%都在当前值之下
@@ -317,124 +364,175 @@ class StockBeta(object):
         output:
             quantile: 历史估值百分位 (0.7)
         """
-        factors = [history_list.quantile(i / 10.0)  for i in range(11)]    
-        idx = bisect.bisect(factors, factor)
-        if idx < 10:
-            quantile = idx - (factors[idx] - factor) / (factors[idx] - factors[idx-1])   
-            return quantile / 10.0    
-        else:
-            return 1.0
+        return HistoryDistribution(history_list).quantile(factor)
 
 
 # In[4]:
 
 
 DOUBLE_LOW_VALUE = 130
+DOUBLE_LOW_PRICE = 105
 
 class DLowStrategy(object):
     
     # 双低策略转债个数
     EXPECTED_ITEMS_COUNT = 20
     
+    # 默认的筛选条件，名称对应 _filter_<名称> 方法，每个方法对整张转债表返回一个布尔掩码
+    BASE_FILTERS = ['current_fund_volume', 'current_market_volume', 'convert_premium_ratio', 'double_low', 'last_cash_date']
+    
+    # 依赖正股估值信息的筛选条件，先用其它条件筛选，只对剩下的转债获取正股信息
+    STOCK_INFO_FILTERS = ['pb', 'pb_pe_quantile', 'stock_marketcap']
+    
+    # 并行获取正股估值的线程数，所有线程合计每秒最多调用数据源的次数(None为不限速)，每次调用失败后的重试次数
+    STOCK_FETCH_WORKERS = 8
+    STOCK_FETCH_RATE = 50
+    STOCK_FETCH_RETRIES = 3
+    
     def __init__(self, bond_list, base_date):
-        self._bond_list = copy.deepcopy(bond_list)
+        """
+        input:
+            bond_list: ConvertBondBeta.get_bonds 返回的转债列表，或者 get_bonds_frame 返回的 DataFrame
+            base_date: 查询时间，格式为'yyyy-MM-dd'
+        """
+        self._bonds = pd.DataFrame(bond_list).reset_index(drop=True)
         self._base_date = datetime.strptime(base_date, "%Y-%m-%d").date()
         
         
-    def _set_stock_info(self, bond_list):
-        """增加正股估值信息
+    def _set_stock_info(self, bonds):
+        """增加正股估值信息，同一只正股只计算一次，历史估值一次补齐到进程内共享的 StockValuationHistory 中，
+        当前估值多只正股并行查询
         
             stock_pb: pb
             stock_pe: pe
             stock_pb_quantile: pb百分位
             stock_pe_quantile: pe百分位
+            circulating_market_cap: 正股流通市值(元)
         """
-        for bond in bond_list:
-            stock = StockBeta(bond['stock_code'])
-            bond['stock_pe'], bond['stock_pb'], bond['stock_roe'] = stock.get_stock_beta_factor()
-            
-            if bond['stock_pe'] is None or bond['stock_pb'] is None:
-                # 正股报表有问题，剔除
-                if bond in self._bond_list:
-                    self._bond_list.remove(bond)
+        stock_codes = list(bonds['stock_code'].unique())
+        # 限速和重试作用在每次数据源调用上，任务本身不再整体重试
+        provider = RateLimitedProvider(get_provider(), rate=self.STOCK_FETCH_RATE, retries=self.STOCK_FETCH_RETRIES)
+        stocks = [StockBeta(stock_code, provider=provider) for stock_code in stock_codes]
+        
+        # 所有正股的历史估值一次补齐，并行任务中只从序列中切片；不再查询的正股的序列文件过期后删除
+        if stocks:
+            stocks[0].prefetch(stock_codes)
+        get_stock_valuation_history().cleanup()
+        valuations = parallel_map(lambda stock: stock.get_stock_valuation(), stocks,
+                                  max_workers=self.STOCK_FETCH_WORKERS, retries=0)
+        
+        stock_info = {}
+        for stock_code, (pe, pb, roe, history_factors) in zip(stock_codes, valuations):
+            if pe is None or pb is None:
                 continue
             
-            history_factors = stock.get_stock_beta_history_factors()
-            bond['stock_pb_quantile'] = stock.get_quantile_of_history_factors(
-                                                bond['stock_pb'], history_factors['pb'])
-            bond['stock_pe_quantile'] = stock.get_quantile_of_history_factors(
-                                                bond['stock_pe'], history_factors['pe'])
-            
-    def _filter_last_cash_date(self, bond_list):
+            stock_info[stock_code] = {
+                'stock_pe': pe,
+                'stock_pb': pb,
+                'stock_roe': roe,
+                'stock_pb_quantile': HistoryDistribution(history_factors['pb']).quantile(pb),
+                'stock_pe_quantile': HistoryDistribution(history_factors['pe']).quantile(pe),
+            }
+        stock_info = pd.DataFrame.from_dict(stock_info, orient='index',
+                                            columns=['stock_pe', 'stock_pb', 'stock_roe', 'stock_pb_quantile', 'stock_pe_quantile'])
+        
+        # 流通市值一次批量查询，单位由亿元换算为元
+        if len(stock_info):
+            valuation = get_provider().get_valuation(self._base_date, list(stock_info.index))
+            stock_info['circulating_market_cap'] = valuation['circulating_market_cap'].reindex(stock_info.index) * pow(10, 8)
+        else:
+            stock_info['circulating_market_cap'] = []
+        
+        # 正股报表有问题，剔除
+        bad_codes = bonds['code'][~bonds['stock_code'].isin(stock_info.index)]
+        self._bonds = self._bonds[~self._bonds['code'].isin(bad_codes)]
+        
+        return bonds.join(stock_info, on='stock_code', how='inner')
+    
+    def _filter_last_cash_date(self, bonds):
         """筛选掉最近到期项
         """
-        filter_bond_list = filter(
-            lambda x: x['last_cash_date'] - self._base_date > timedelta(360),
-            bond_list
-        )
-        return list(filter_bond_list)
-        
+        return pd.to_datetime(bonds['last_cash_date']) - pd.Timestamp(self._base_date) > pd.Timedelta(days=360)
             
-    def _filter_pb_pe_quantile(self, bond_list):
+    def _filter_pb_pe_quantile(self, bonds):
         """筛选pb, pe历史百分位
         """
-        self._set_stock_info(bond_list)
-        filter_bond_list = filter(
-            lambda x: x['stock_pb'] > 1.3 and x['stock_pb_quantile'] < 0.8 and x['stock_pe_quantile'] < 0.8,
-            bond_list
-        )
-        return list(filter_bond_list)
+        return (bonds['stock_pb'] > 1.3) & (bonds['stock_pb_quantile'] < 0.8) & (bonds['stock_pe_quantile'] < 0.8)
         
-    def _filter_pb(self, bond_list):
+    def _filter_pb(self, bonds):
         """筛选PB>1.3防止下修转股价时破净限制
         """
-        self._set_stock_info(bond_list)
-        filter_bond_list = filter(
-            lambda x: x.get('stock_pb', None) and x['stock_pb'] > 1.3,
-            bond_list
-        )
-        return list(filter_bond_list)
-
+        return bonds['stock_pb'] > 1.3
         
-        
-    def _filter_current_fund_volume(self, bond_list):
+    def _filter_current_fund_volume(self, bonds):
         """剩余规模>1亿，且<10亿元的转债
         """
-        filter_bond_list = filter(
-            lambda x: x['current_fund_volume'] > pow(10, 8) and x['current_fund_volume'] < pow(10, 9),
-            bond_list
-        )
-        return list(filter_bond_list)
+        return (bonds['current_fund_volume'] > pow(10, 8)) & (bonds['current_fund_volume'] < pow(10, 9))
 
-    def _filter_current_market_volume(self, bond_list):
+    def _filter_current_market_volume(self, bonds):
         """当日市场成交额>100万
         """
-        filter_bond_list = filter(
-            lambda x: x['day_market_volume'] > pow(10, 6),
-            bond_list
-        )
-        return list(filter_bond_list)
+        return bonds['day_market_volume'] > pow(10, 6)
         
-    def _filter_convert_premium_ratio(self, bond_list):
+    def _filter_convert_premium_ratio(self, bonds):
         """溢价率小于15%
         """
-        filter_bond_list = filter(
-            lambda x: x['convert_premium_ratio'] < 0.15,
-            bond_list
-        )
-        return list(filter_bond_list)
-        
+        return bonds['convert_premium_ratio'] < 0.15
         
-    def _filter_double_low(self, bond_list):
+    def _filter_double_low(self, bonds):
         """双低小于125-130
         """
-        filter_bond_list = filter(
-            lambda x: x['double_low'] < DOUBLE_LOW_VALUE,
-            bond_list
-        )
-        return list(filter_bond_list)
+        return bonds['double_low'] < DOUBLE_LOW_VALUE
     
-    def get_support_bonds(self, filter_pb=False, filter_pb_pe_quantile=False):
+    def _filter_ytm(self, bonds):
+        """到期税后收益率大于0
+        """
+        return bonds['ytm_after_tax'] > 0
+    
+    def _filter_redemption(self, bonds):
+        """剔除已经触发强赎条件的转债
+        """
+        return bonds['days_to_trigger'] > 0
+    
+    def _filter_price(self, bonds):
+        """价格过滤
+        """
+        return bonds['price'] < DOUBLE_LOW_PRICE
+    
+    def _filter_stock_marketcap(self, bonds):
+        """过滤流通市值<10亿或股价<3元的转债
+        """
+        return (bonds['circulating_market_cap'] > pow(10, 9)) & (bonds['stock_price'] > 3)
+    
+    def _get_mask(self, bonds, filters):
+        """多个筛选条件的布尔掩码取交集"""
+        mask = pd.Series(True, index=bonds.index)
+        for name in filters:
+            mask &= getattr(self, '_filter_' + name)(bonds).fillna(False).astype(bool)
+        return mask
+    
+    def select(self, filters):
+        """
+        按筛选条件列表筛选转债，不复制转债表，所有条件在同一个掩码上组合
+        
+        input:
+            filters: 筛选条件名称列表，比如 BASE_FILTERS + ['price']
+            
+        output:
+            DataFrame, 筛选后的转债，保持原来的顺序
+        """
+        bonds = self._bonds
+        column_filters = [name for name in filters if name not in self.STOCK_INFO_FILTERS]
+        stock_filters = [name for name in filters if name in self.STOCK_INFO_FILTERS]
+        
+        bonds = bonds[self._get_mask(bonds, column_filters)]
+        if stock_filters and len(bonds):
+            bonds = self._set_stock_info(bonds)
+            bonds = bonds[self._get_mask(bonds, stock_filters)]
+        return bonds
+    
+    def get_support_bonds(self, filter_pb=False, filter_pb_pe_quantile=False, filter_price=False, filter_stock_marketcap=False,
+                          filter_ytm=False, filter_redemption=False):
         """
         剩余规模>1亿，且<10亿元的转债
         
@@ -452,22 +550,36 @@ class DLowStrategy(object):
         筛选PB>1.3防止下修转股价时破净限制
         
         filter_pb_pe_quantile=True, 筛选pb, pe历史百分位
+        
+        filter_price=True, 价格<DOUBLE_LOW_PRICE
+        
+        filter_stock_marketcap=True, 正股流通市值>10亿，股价>3元
+        
+        filter_ytm=True, 到期税后收益率大于0
+        
+        filter_redemption=True, 剔除已经触发强赎条件的转债
         """
-        support_bond_list = self._bond_list
+        filters = list(self.BASE_FILTERS)
         
-        support_bond_list = self._filter_current_fund_volume(support_bond_list)
-        support_bond_list = self._filter_current_market_volume(support_bond_list)
-        support_bond_list = self._filter_convert_premium_ratio(support_bond_list)
-        support_bond_list = self._filter_double_low(support_bond_list)
-        support_bond_list = self._filter_last_cash_date(support_bond_list)
+        if filter_ytm:
+            filters.append('ytm')
+        
+        if filter_redemption:
+            filters.append('redemption')
+        
+        if filter_price:
+            filters.append('price')
         
         if filter_pb:
-            support_bond_list = self._filter_pb(support_bond_list)
+            filters.append('pb')
         
         if filter_pb_pe_quantile:
-            support_bond_list = self._filter_pb_pe_quantile(support_bond_list)
+            filters.append('pb_pe_quantile')
             
-        return support_bond_list
+        if filter_stock_marketcap:
+            filters.append('stock_marketcap')
+            
+        return self.select(filters).to_dict('records')
 
 
 # In[5]:
@@ -519,9 +631,14 @@ pd.DataFrame(bond_list_c)
 # In[9]:
 
 
-bond_list_a_text = pd.DataFrame(bond_list_a).to_html()
-bond_list_b_text = pd.DataFrame(bond_list_b).to_html()
-bond_list_c_text = pd.DataFrame(bond_list_c).to_html()
+# 只报告与上一个交易日相比的变化: 新增、剔除、排名或双低值变化较大的转债，所有筛选结果合在一张表中
+from daily_report import ScreenReport
+
+screen_report_text = ScreenReport().render(base_date, {
+    '不用百分位': bond_list_a,
+    'pb>1.3': bond_list_b,
+    'pe/pb百分位': bond_list_c,
+})
 
 
 # 取得几个统计值：市场总量，小于110元转债总量，价格算术平均值，溢价率算术平均值
@@ -535,6 +652,5 @@ total_market_text = "市场总量{}亿元, 小于110元转债总量{}亿元, 价
 split_text = '=================================================='
 print(total_market_text)
 
-send_message_text = "{}\r\n{}\r\n{}\r\n{}\r\n{}\r\n{}\r\n".format(
-    bond_list_a_text, split_text, bond_list_b_text, bond_list_c_text, split_text, total_market_text)
+send_message_text = "{}\r\n{}\r\n{}\r\n".format(screen_report_text, split_text, total_market_text)
 #print(send_message_text)
\ No newline at end of file
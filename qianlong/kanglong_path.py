@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+"""共用模块的导入路径
+
+数据源(provider)、历史百分位(distribution, rolling_rank)放在 kanglong 目录中，两个策略共用一份。
+qianlong 的模块在导入它们之前先 import kanglong_path，把 ../kanglong 加到 sys.path 的末尾:
+qianlong 目录排在前面，同名的 oracle 仍然导入 qianlong 自己的版本。
+
+在聚宽研究环境中如果没有上传 kanglong 目录，需要把 provider.py、distribution.py、rolling_rank.py
+和 qianlong 的模块放在同一目录下，此时这里不做任何修改。
+"""
+
+import os
+import sys
+
+KANGLONG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kanglong')
+
+if os.path.isdir(KANGLONG_PATH) and KANGLONG_PATH not in sys.path:
+    sys.path.append(KANGLONG_PATH)
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
-import bisect
 import logging
 import math
 from statistics import mean
 import pandas as pd
-from jqdata import get_all_trade_days
-from jqdata import bond
 from datetime import datetime, timedelta
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from bond_history import BondFactorHistory
+from bond_panel import get_bond_panel
+from distribution import HistoryDistribution
+from provider import get_provider
 
 logging.basicConfig(format='%(asctime)s:%(levelname)s:%(message)s', level=logging.DEBUG)
 
@@ -33,6 +35,8 @@ class BoudStrategy(object):
         self._index_bond = index_bond
         self._total_market, self._underrate_market, self._avg_price, self._avg_premium_ratio = self._index_bond.get_bonds_factors()
         self._history_factors = self._index_bond.get_bonds_history_factors()
+        self._premium_ratio_distribution = HistoryDistribution(self._history_factors['avg_premium_ratios'])
+        self._avg_price_distribution = HistoryDistribution(self._history_factors['avg_prices'])
 
     def get_win_rate(self):
         """
@@ -44,11 +48,9 @@ class BoudStrategy(object):
 
         """
         cheap_bond_quantile = self._underrate_market / self._total_market
-        self._premium_ratio_quantile = self._index_bond.get_quantile_of_history_factors(
-                                        self._avg_premium_ratio, self._history_factors['avg_premium_ratios'])
+        self._premium_ratio_quantile = self._premium_ratio_distribution.quantile(self._avg_premium_ratio)
 
-        self._avg_price_quantile = self._index_bond.get_quantile_of_history_factors(
-                                        self._avg_price, self._history_factors['avg_prices'])
+        self._avg_price_quantile = self._avg_price_distribution.quantile(self._avg_price)
 
         win_rate = min([cheap_bond_quantile, 1-self._premium_ratio_quantile, 1-self._avg_price_quantile])
 
@@ -135,7 +137,7 @@ class ConvertBondBeta(object):
         self._end_date = self._end_date.strftime('%Y-%m-%d')
         self._base_date = self._base_date.strftime('%Y-%m-%d')
 
-    def get_bonds(self, date=None):
+    def get_bonds(self, date=None, bulk=True):
         """
         获取指定日期的可转债市场正常存续的转债的基本信息
 
@@ -148,6 +150,9 @@ class ConvertBondBeta(object):
             convert_price: 转股价格 (如果没有下修的话就是约定转股价)
             stock_price: 正股价格
             last_cash_date: 最终兑付日(到期时间)
+
+        input:
+            bulk: 每张表对所有转债只查询一次，再按代码关联；为False时逐只转债查询
         """
 
         if date is None:
@@ -155,14 +160,10 @@ class ConvertBondBeta(object):
         else:
             date = datetime.strptime(date, '%Y-%m-%d').date()
 
-        df_bonds = bond.run_query(
-                query(bond.CONBOND_BASIC_INFO).filter(
-                                    bond.CONBOND_BASIC_INFO.bond_type_id == 703013,
-                                    bond.CONBOND_BASIC_INFO.list_status_id.in_(['301001', '301099']),
-                                    bond.CONBOND_BASIC_INFO.interest_begin_date < date,
-                                    bond.CONBOND_BASIC_INFO.last_cash_date >= date
-                                ).order_by('code').limit(10000)
-            )
+        if bulk:
+            return self.get_bonds_frame(date).to_dict('records')
+
+        df_bonds = get_provider().get_conbond_basic_info(date)
 
         bond_list = []
 
@@ -178,11 +179,7 @@ class ConvertBondBeta(object):
 
             if str(row['list_status_id']) == '301099':
                 # issue-2: CONBOND_BASIC_INO表中数据更新不及时，需要去BOND_BASIC_INFO中确认一下
-                bond_basic_info = bond.run_query(
-                                query(bond.BOND_BASIC_INFO).filter(
-                                    bond.BOND_BASIC_INFO.code == row['code']
-                                )
-                              )
+                bond_basic_info = get_provider().get_bond_basic_info([row['code']])
                 if str(bond_basic_info['list_status_id'][0]) == '301099':
                     continue
 
@@ -203,12 +200,7 @@ class ConvertBondBeta(object):
             bond_info['current_fund_count'] = bond_info['raise_fund_count']
 
             # 转股信息
-            bond_stock = bond.run_query(
-                query(bond.CONBOND_DAILY_CONVERT).filter(
-                                    bond.CONBOND_DAILY_CONVERT.code == bond_info['code'],
-                                    bond.CONBOND_DAILY_CONVERT.date <= date,
-                                )
-            )
+            bond_stock = get_provider().get_conbond_daily_convert([bond_info['code']], date)
 
             # 统计转股信息，如果99%转股，就代表强赎退市，暂不记入，另外要修正存量债券数目
             if not bond_stock['acc_convert_ratio'].empty:
@@ -223,12 +215,7 @@ class ConvertBondBeta(object):
                 bond_info['convert_price'] =  float(bond_stock['convert_price'].iloc[-1])
 
             # 当前市场收盘价格
-            bond_market = bond.run_query(
-                query(bond.CONBOND_DAILY_PRICE).filter(
-                                    bond.CONBOND_DAILY_PRICE.code == bond_info['code'],
-                                    bond.CONBOND_DAILY_PRICE.date <= date,
-                                )
-            )
+            bond_market = get_provider().get_conbond_daily_price([bond_info['code']], date)
             try:
                 bond_info['price'] =  float(bond_market['close'].iloc[-1])
             except Exception:
@@ -239,11 +226,7 @@ class ConvertBondBeta(object):
 
 
             # 获取正股价格
-            df_stock_price = get_price(bond_info['company_code'],
-                                       count = 7,
-                                       end_date= date,
-                                       frequency='daily',
-                                       fields=['close'])
+            df_stock_price = get_provider().get_price(bond_info['company_code'], end_date=date, count=7, fields=['close'])
             bond_info['stock_price'] = df_stock_price['close'][-1]
             bond_info['convert_premium_ratio'] = (bond_info['price'] - 100/bond_info['convert_price']*bond_info['stock_price']) / (100/bond_info['convert_price']*bond_info['stock_price'])
 
@@ -252,6 +235,33 @@ class ConvertBondBeta(object):
         return bond_list
 
 
+    def get_bonds_frame(self, date):
+        """
+        从转债快照仓库获取指定日期的转债基本信息，字段和筛选规则与逐只转债查询的 get_bonds 一致
+
+        output:
+            DataFrame, 每行一只转债，按code排序
+        """
+        columns = ['code', 'short_name', 'company_code', 'convert_price', 'last_cash_date',
+                   'raise_fund_count', 'current_fund_count', 'price', 'stock_price', 'convert_premium_ratio']
+
+        df = get_bond_panel().get_snapshot(date).rename(columns={'stock_code': 'company_code'})
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+
+        # 发行总数量、当前存量总数量，一般都是100元一张
+        df['raise_fund_count'] = df['raise_fund_volume'] / df['issue_par'].astype(float)
+        df['current_fund_count'] = df['current_fund_volume'] / df['issue_par'].astype(float)
+
+        # 有部分还没有公布信息的的转债用债券面值计算价格
+        df['price'] = df['price'].fillna(df['par'].astype(float))
+
+        # 转股溢价=（100/转股价格）*正股收盘价-可转债收盘价）
+        convert_value = 100 / df['convert_price'] * df['stock_price']
+        df['convert_premium_ratio'] = (df['price'] - convert_value) / convert_value
+
+        return df[columns]
+
     def get_bonds_factors(self, bond_list=None):
         """
         获取当前时间的市场总量, 低估转债市场总量，指数平均价格，指数平均溢价率
@@ -270,18 +280,19 @@ class ConvertBondBeta(object):
         return (total_market, underrate_market, avg_price, avg_premium_ratio)
 
 
-    def get_bonds_history_factors(self, interval=1):
+    def get_bonds_history_factors(self, interval=1, bulk=True):
         """
         获取任意指数一段时间的历史转债指数算术平均价格、转债指数溢价率 估值列表，通过计算当前的估值在历史估值的百分位，来判断当前市场的估值高低。
         由于加权方式可能不同，可能各个指数公开的估值数据有差异，但用于判断估值相对高低没有问题
 
         input：
             interval: 计算指数估值的间隔天数，增加间隔时间可提高计算性能
+            bulk: 从转债快照仓库一次读出所有日期，按日期分组计算，算过的日期不再重复计算；为False时逐日调用 get_bonds
 
         output：
             result:  指数历史估值的 DataFrame，index 为时间，列为市场总量，低估转债总量，平均价格， 溢价率
         """
-        all_days = get_all_trade_days()
+        all_days = get_provider().get_all_trade_days()
 
         total_markets = []
         underrate_markets = []
@@ -292,6 +303,13 @@ class ConvertBondBeta(object):
 
         begin = datetime.strptime(self._begin_date, '%Y-%m-%d').date()
         end = datetime.strptime(self._end_date, '%Y-%m-%d').date()
+
+        if bulk:
+            sample_days = [day for day in all_days if begin <= day <= end][interval-1::interval]
+            result = BondFactorHistory(underrate_price=UNDERRATE_PRICE).get_factors(sample_days)
+            logging.debug("转债历史统计: {} ~ {}, {}个交易日".format(self._begin_date, self._end_date, len(result)))
+            return result
+
         i = 0
         for day in all_days:
             if(day < begin or day > end):
@@ -337,13 +355,7 @@ class ConvertBondBeta(object):
         output:
             quantile: 历史估值百分位 (0.7)
         """
-        factors = [history_list.quantile(i / 10.0)  for i in range(11)]
-        idx = bisect.bisect(factors, factor)
-        if idx < 10:
-            quantile = idx - (factors[idx] - factor) / (factors[idx] - factors[idx-1])
-            return quantile / 10.0
-        else:
-            return 1.0
+        return HistoryDistribution(history_list).quantile(factor)
 
 # 测试
 
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""有并发上限的并行取数
+
+几百只正股逐只查询估值时，大部分时间都在等数据源返回。
+这里用线程池并行执行，同时:
+
+    max_workers: 限制同时访问数据源的线程数
+    TokenBucket: 令牌桶限速，平均每秒不超过 rate 次，允许 burst 次突发，避免超过数据源的调用配额
+    retries / backoff: 失败后按 backoff, 2*backoff, 4*backoff ... 秒退避重试
+
+结果按输入的顺序返回。一个任务可能包含很多次数据源调用(逐日计算一只正股的历史估值要查询上百次)，
+限速和重试应该作用在每次数据源调用上，而不是每个任务上，用 RateLimitedProvider 包装数据源:
+
+    provider = RateLimitedProvider(get_provider(), rate=50)
+    parallel_map(lambda code: StockBeta(code, provider=provider).get_stock_valuation(), codes, retries=0)
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket(object):
+    """令牌桶，线程安全"""
+
+    def __init__(self, rate, burst=None):
+        """
+        input:
+            rate: 每秒补充的令牌数
+            burst: 桶的容量，默认与rate相同
+        """
+        self._rate = float(rate)
+        self._capacity = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self._capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取得tokens个令牌，令牌不够时等待"""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+def call_with_retry(func, args=(), retries=3, backoff=0.5, rate_limiter=None, kwargs=None):
+    """
+    调用func(*args, **kwargs)，失败时退避重试，重试retries次之后仍然失败则抛出最后一次的异常
+
+    input:
+        rate_limiter: TokenBucket，每次调用前先取得一个令牌
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args, **(kwargs or {}))
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = backoff * pow(2, attempt)
+            logging.warning("调用失败，{:.1f}秒后第{}次重试: {}".format(delay, attempt + 1, e))
+            time.sleep(delay)
+            attempt += 1
+
+
+class RateLimitedProvider(object):
+    """数据源的包装，每次调用数据源的方法前先取得一个令牌，失败时只重试这一次调用，多个线程共用一个令牌桶"""
+
+    def __init__(self, provider, rate=None, burst=None, retries=3, backoff=0.5):
+        """
+        input:
+            provider: 被包装的数据源，比如 get_provider()
+            rate: 每秒最多调用数据源的次数，为None时不限速
+            burst: 令牌桶容量，默认与rate相同
+            retries, backoff: 与 call_with_retry 相同
+        """
+        self._provider = provider
+        self._rate_limiter = TokenBucket(rate, burst) if rate else None
+        self._retries = retries
+        self._backoff = backoff
+
+    def __getattr__(self, name):
+        method = getattr(self._provider, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            return call_with_retry(method, args, self._retries, self._backoff, self._rate_limiter, kwargs)
+        return call
+
+
+def parallel_map(func, items, max_workers=8, rate=None, burst=None, retries=3, backoff=0.5):
+    """
+    并行计算 [func(item) for item in items]
+
+    input:
+        func: 单参数函数
+        items: 输入列表
+        max_workers: 最多同时执行的线程数，为1时在当前线程顺序执行
+        rate: 每秒最多调用func的次数，为None时不限速
+        burst: 令牌桶容量，默认与rate相同
+        retries: 失败后重试的次数
+        backoff: 第一次重试前等待的秒数，之后每次翻倍
+
+    output:
+        结果列表，顺序与items一致
+    """
+    items = list(items)
+    rate_limiter = TokenBucket(rate, burst) if rate else None
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [call_with_retry(func, (item,), retries, backoff, rate_limiter) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(call_with_retry, func, (item,), retries, backoff, rate_limiter) for item in items]
+        return [future.result() for future in futures]
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""双低值实时排名
+
+盘中转债价格、正股价格不断变化，双低排名也跟着变化，每次都重新 get_bonds 再排序太慢。
+这里把筛选后的转债按 (双低值, 代码) 保存在有序表中，一只转债或者它的正股价格变化时，
+只删除、插入这一只转债，O(log n) 更新排名，并且只报告进入、离开前N名的转债。
+
+行情可以来自实时推送，也可以从本地文件回放(replay_ticks)。
+"""
+
+import bisect
+import pandas as pd
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:
+    SortedList = None
+
+
+class _BisectList(object):
+    """没有安装 sortedcontainers 时使用的有序表"""
+
+    def __init__(self):
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, idx):
+        return self._items[idx]
+
+    def add(self, item):
+        bisect.insort(self._items, item)
+
+    def remove(self, item):
+        del self._items[bisect.bisect_left(self._items, item)]
+
+    def bisect_left(self, item):
+        return bisect.bisect_left(self._items, item)
+
+
+def get_double_low(price, convert_price, stock_price):
+    """双低值 = 转债价格 + 转股溢价率 * 100"""
+    convert_value = 100 / convert_price * stock_price
+    return price + (price - convert_value) / convert_value * 100
+
+
+class DoubleLowRanking(object):
+
+    def __init__(self, bonds, top_n=20):
+        """
+        input:
+            bonds: 筛选后的转债，ConvertBondBeta.get_bonds / DLowStrategy.get_support_bonds 的结果，
+                   需要 code, stock_code, price, convert_price, stock_price 字段
+            top_n: 关注的前N名，默认与 DLowStrategy.EXPECTED_ITEMS_COUNT 一致
+        """
+        self._top_n = top_n
+        self._sorted = SortedList() if SortedList is not None else _BisectList()
+        # code -> {'price', 'convert_price', 'stock_price', 'stock_code'}
+        self._bonds = {}
+        # code -> 当前在有序表中的 (double_low, code)
+        self._keys = {}
+        # stock_code -> [code]
+        self._stock_bonds = {}
+
+        for bond in pd.DataFrame(bonds).to_dict('records'):
+            self._bonds[bond['code']] = {
+                'price': float(bond['price']),
+                'convert_price': float(bond['convert_price']),
+                'stock_price': float(bond['stock_price']),
+                'stock_code': bond['stock_code'],
+            }
+            self._stock_bonds.setdefault(bond['stock_code'], []).append(bond['code'])
+            self._insert(bond['code'])
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def _insert(self, code):
+        bond = self._bonds[code]
+        double_low = get_double_low(bond['price'], bond['convert_price'], bond['stock_price'])
+        if double_low != double_low:
+            # 价格缺失，暂不参与排名
+            return
+        self._keys[code] = (double_low, code)
+        self._sorted.add(self._keys[code])
+
+    def _in_top(self, key):
+        return self._sorted.bisect_left(key) < self._top_n
+
+    def _reorder(self, code):
+        """
+        重新计算一只转债的双低值并调整位置
+
+        output:
+            (entered, left): 进入、离开前N名的转债代码列表
+        """
+        entered, left = [], []
+
+        old_key = self._keys.pop(code, None)
+        was_top = old_key is not None and self._in_top(old_key)
+        if old_key is not None:
+            self._sorted.remove(old_key)
+
+        self._insert(code)
+        new_key = self._keys.get(code)
+        is_top = new_key is not None and self._in_top(new_key)
+
+        # 一次只移动一只转债，前N名最多只有一进一出
+        if was_top and not is_top:
+            left.append(code)
+            if len(self._sorted) >= self._top_n:
+                entered.append(self._sorted[self._top_n - 1][1])
+        elif is_top and not was_top:
+            entered.append(code)
+            if len(self._sorted) > self._top_n:
+                left.append(self._sorted[self._top_n][1])
+        return entered, left
+
+    def update_bond_price(self, code, price):
+        """
+        转债价格变化
+
+        output:
+            (entered, left): 进入、离开前N名的转债代码列表
+        """
+        if code not in self._bonds:
+            return [], []
+        self._bonds[code]['price'] = float(price)
+        return self._reorder(code)
+
+    def update_stock_price(self, stock_code, price):
+        """
+        正股价格变化，对应的所有转债一起调整
+
+        output:
+            (entered, left): 进入、离开前N名的转债代码列表
+        """
+        entered, left = [], []
+        for code in self._stock_bonds.get(stock_code, []):
+            self._bonds[code]['stock_price'] = float(price)
+            code_entered, code_left = self._reorder(code)
+            entered, left = self._merge(entered, left, code_entered, code_left)
+        return entered, left
+
+    @staticmethod
+    def _merge(entered, left, new_entered, new_left):
+        """合并多次调整的进出，先进后出或先出后进的互相抵消"""
+        for code in new_entered:
+            if code in left:
+                left.remove(code)
+            else:
+                entered.append(code)
+        for code in new_left:
+            if code in entered:
+                entered.remove(code)
+            else:
+                left.append(code)
+        return entered, left
+
+    def on_tick(self, code, price):
+        """
+        处理一条行情，code可以是转债代码也可以是正股代码
+
+        output:
+            (entered, left): 进入、离开前N名的转债代码列表
+        """
+        if code in self._bonds:
+            return self.update_bond_price(code, price)
+        return self.update_stock_price(code, price)
+
+    def get_double_low(self, code):
+        key = self._keys.get(code)
+        return key[0] if key is not None else None
+
+    def get_rank(self, code):
+        """从0开始的排名，不在排名中时返回None"""
+        key = self._keys.get(code)
+        return self._sorted.bisect_left(key) if key is not None else None
+
+    def top(self, n=None):
+        """
+        output:
+            前n名(默认top_n)的 [(code, double_low)]
+        """
+        n = self._top_n if n is None else n
+        return [(self._sorted[i][1], self._sorted[i][0]) for i in range(min(n, len(self._sorted)))]
+
+
+def read_ticks(path):
+    """
+    读取本地行情文件(csv/parquet)，列为 time, code, price，按 time 排序
+    """
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, dtype={'code': str})
+    return df.sort_values('time', kind='mergesort').reset_index(drop=True)
+
+
+def replay_ticks(ranking, ticks):
+    """
+    按时间顺序回放行情，只在前N名有变化时产出
+
+    input:
+        ranking: DoubleLowRanking
+        ticks: read_ticks 返回的 DataFrame 或行情文件路径
+
+    output:
+        生成器，每次产出 (time, entered, left)
+    """
+    if isinstance(ticks, str):
+        ticks = read_ticks(ticks)
+
+    for time, code, price in zip(ticks['time'], ticks['code'], ticks['price']):
+        entered, left = ranking.on_tick(code, price)
+        if entered or left:
+            yield time, entered, left
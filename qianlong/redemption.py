@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""强赎条件检测
+
+转债的有条件赎回条款一般为: 连续30个交易日中至少有15个交易日正股收盘价不低于转股价的130%。
+get_bonds 只能在累计转股比例超过99.5%之后才知道转债已经被强赎，这里提前计算每只转债离触发强赎还有多少天:
+
+    hit: 正股收盘价 >= 转股价 * REDEMPTION_RATIO 的交易日
+    trigger_count: 最近 REDEMPTION_WINDOW 个交易日中满足条件的天数
+    days_to_trigger: 假设之后每天都满足条件，最少还需要多少个交易日触发强赎，0代表已经触发
+
+对 日期 × 转债 的矩阵用累计和一次算出所有日期的滚动计数，每天也可以只追加一行增量更新:
+get_redemption_tracker() 是进程内共享的 RedemptionTracker，逐日调用时每天只读取当天的快照。
+"""
+
+import numpy as np
+import pandas as pd
+
+# 强赎条件: 最近 REDEMPTION_WINDOW 个交易日中至少 REDEMPTION_REQUIRED 个交易日正股收盘价不低于转股价的 REDEMPTION_RATIO
+REDEMPTION_WINDOW = 30
+REDEMPTION_REQUIRED = 15
+REDEMPTION_RATIO = 1.3
+
+
+def get_hits(panel, ratio=REDEMPTION_RATIO):
+    """
+    转债快照长表 -> 日期 × 转债 的0/1矩阵，没有数据的日期为0
+
+    input:
+        panel: 至少包含 date, code, stock_price, convert_price 列
+    """
+    hit = (panel['stock_price'] >= panel['convert_price'] * ratio).astype(float)
+    hits = pd.DataFrame({'date': panel['date'], 'code': panel['code'], 'hit': hit})
+    return hits.pivot_table(index='date', columns='code', values='hit', aggfunc='max').fillna(0.0).sort_index()
+
+
+def count_triggers(hits, window=REDEMPTION_WINDOW, required=REDEMPTION_REQUIRED):
+    """
+    按日期滚动计算强赎计数
+
+    input:
+        hits: 日期 × 转债 的0/1矩阵，按日期升序
+
+    output:
+        (trigger_count, days_to_trigger): 两个与hits形状相同的 DataFrame
+    """
+    values = hits.values
+    cumsum = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    rows = np.arange(1, len(values) + 1)
+
+    def recent(length):
+        """每个日期最近length个交易日满足条件的天数"""
+        start = np.maximum(rows - length, 0)
+        return cumsum[rows] - cumsum[start]
+
+    trigger_count = recent(window)
+
+    # 再过k天触发: 最近 window-k 天的计数 + k >= required，k 最大为 required
+    days_to_trigger = np.full(values.shape, float(required))
+    for k in range(required - 1, -1, -1):
+        days_to_trigger = np.where(recent(window - k) + k >= required, k, days_to_trigger)
+
+    return (pd.DataFrame(trigger_count, index=hits.index, columns=hits.columns),
+            pd.DataFrame(days_to_trigger, index=hits.index, columns=hits.columns))
+
+
+def compute_redemption_status(panel, window=REDEMPTION_WINDOW, required=REDEMPTION_REQUIRED, ratio=REDEMPTION_RATIO):
+    """
+    计算快照长表中每只转债每天的强赎状态
+
+    output:
+        DataFrame, 列为 date, code, trigger_count, days_to_trigger，与panel的行一一对应
+    """
+    if len(panel) == 0:
+        return pd.DataFrame(columns=['date', 'code', 'trigger_count', 'days_to_trigger'])
+
+    trigger_count, days_to_trigger = count_triggers(get_hits(panel, ratio), window, required)
+    status = pd.DataFrame({
+        'trigger_count': trigger_count.stack(),
+        'days_to_trigger': days_to_trigger.stack(),
+    })
+    status.index.names = ['date', 'code']
+    keys = pd.MultiIndex.from_arrays([panel['date'], panel['code']])
+    return status.reindex(keys).reset_index()
+
+
+class RedemptionTracker(object):
+    """每天追加一行，增量更新强赎状态，只保留最近 window 个交易日"""
+
+    def __init__(self, window=REDEMPTION_WINDOW, required=REDEMPTION_REQUIRED, ratio=REDEMPTION_RATIO):
+        self._window = window
+        self._required = required
+        self._ratio = ratio
+        self._hits = pd.DataFrame(dtype=float)
+        # 最后更新的交易日
+        self._day = None
+
+    def warm_up(self, panel):
+        """用最近的历史快照初始化"""
+        if len(panel) == 0:
+            self._hits = pd.DataFrame(dtype=float)
+            self._day = None
+            return
+
+        self._hits = get_hits(panel, self._ratio).iloc[-self._window:]
+        self._day = self._hits.index[-1]
+
+    def advance(self, day, previous_day, bonds, load_history):
+        """
+        把强赎状态推进到 day: 上次更新的是前一个交易日或者 day 本身时只追加当天一行，
+        否则(第一次调用、跳过了交易日、查询更早的日期)先用历史快照重新初始化
+
+        input:
+            day: 交易日
+            previous_day: day 的前一个交易日
+            bonds: 当天的转债快照，至少包含 code, stock_price, convert_price 列
+            load_history: 无参数的函数，返回 day 之前最近 window 个交易日的快照长表
+
+        output:
+            与 update 相同
+        """
+        if self._day is None or self._day not in (day, previous_day):
+            self.warm_up(load_history())
+        return self.update(day, bonds)
+
+    def update(self, day, bonds):
+        """
+        追加一天的转债快照
+
+        input:
+            day: 交易日
+            bonds: 当天的转债，至少包含 code, stock_price, convert_price 列
+
+        output:
+            DataFrame, index为code，列为 trigger_count, days_to_trigger
+        """
+        hit = pd.Series((bonds['stock_price'] >= bonds['convert_price'] * self._ratio).astype(float).values,
+                        index=bonds['code'].values)
+        row = pd.DataFrame([hit], index=[day])
+        self._hits = pd.concat([self._hits[self._hits.index != day], row]).fillna(0.0).iloc[-self._window:]
+        self._day = day
+
+        trigger_count, days_to_trigger = count_triggers(self._hits, self._window, self._required)
+        return pd.DataFrame({
+            'trigger_count': trigger_count.iloc[-1],
+            'days_to_trigger': days_to_trigger.iloc[-1],
+        }).reindex(bonds['code'].values)
+
+
+_redemption_tracker = None
+
+
+def get_redemption_tracker():
+    """进程内共享的强赎状态"""
+    global _redemption_tracker
+    if _redemption_tracker is None:
+        _redemption_tracker = RedemptionTracker()
+    return _redemption_tracker
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""离线测试用的小数据集
+
+LocalDataProvider 的数据表只包含测试用到的交易日、转债票面利率和到期赎回价，现金流缓存只放在内存中，
+测试不会读写 ~/.qianlong。double_low.py 是 notebook 导出的脚本，导入时会访问聚宽，这里只测试可以单独导入的模块。
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+QIANLONG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if QIANLONG_DIR not in sys.path:
+    sys.path.insert(0, QIANLONG_DIR)
+
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+import provider
+import ytm
+
+DATA_BEGIN_DATE = '2019-10-01'
+DATA_END_DATE = '2020-03-31'
+
+# 测试转债的票面利率(%)，每年一期，最后一期 2025-01-10 到期
+BOND_COUPONS = [0.3, 0.5, 1.0, 1.5, 1.8, 2.0]
+BOND_CODES = ['110001', '110002', '110003']
+
+# 到期赎回价(含最后一期利息)，110002 没有数据，按 面值 + 最后一期利息 计算
+REDEMPTION_PRICES = {'110001': 110.0, '110003': 108.0}
+
+
+def write_dataset(root):
+    """在 root 下生成 LocalDataProvider 的数据表"""
+    days = pd.bdate_range(DATA_BEGIN_DATE, DATA_END_DATE).strftime('%Y-%m-%d')
+    pd.DataFrame({'date': days}).to_csv(os.path.join(root, 'trade_days.csv'), index=False)
+
+    rows = [(code, '{}-01-10'.format(2019 + i), '{}-01-10'.format(2020 + i), coupon)
+            for code in BOND_CODES for i, coupon in enumerate(BOND_COUPONS)]
+    pd.DataFrame(rows, columns=['code', 'coupon_start_date', 'coupon_end_date', 'coupon']).to_csv(
+        os.path.join(root, 'BOND_COUPON.csv'), index=False)
+
+    pd.DataFrame({'code': BOND_CODES, 'redemption_price': [REDEMPTION_PRICES.get(code) for code in BOND_CODES]}).to_csv(
+        os.path.join(root, 'CONBOND_BASIC_INFO.csv'), index=False)
+
+
+@pytest.fixture(scope='session')
+def local_data(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('qianlong_data'))
+    write_dataset(root)
+    return root
+
+
+@pytest.fixture
+def local_provider(local_data):
+    """全局数据源换成本地数据集，现金流缓存放在内存中，测试结束后恢复"""
+    saved = (provider._provider, ytm._coupon_schedules)
+
+    provider.set_provider(provider.LocalDataProvider(local_data))
+    ytm._coupon_schedules = ytm.CouponSchedules(path=None)
+    try:
+        yield provider.get_provider()
+    finally:
+        provider._provider, ytm._coupon_schedules = saved
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from backtest import DoubleLowBacktest
+
+FEE_RATE = 0.001
+SLIPPAGE = 0.002
+COST_RATE = FEE_RATE + SLIPPAGE
+
+DAYS = [day.date() for day in pd.bdate_range('2020-01-02', '2020-01-15')]
+
+# 转股价值都是100，双低值 = 2 * 价格 - 100，价格越低排名越靠前；110002 在第3个交易日之后没有快照(强赎退市)
+PRICES = {
+    '110001': [100, 102, 101, 103, 103, 104, 104, 105, 105, 106],
+    '110002': [110, 112, 115],
+    '110003': [120, 120, 121, 121, 122, 120, 121, 122, 123, 124],
+}
+
+
+class FramePanel(object):
+    """与 BondPanelStore.get_panel 接口相同的内存快照"""
+
+    def __init__(self, frame):
+        self._frame = frame
+
+    def get_panel(self, days, columns):
+        return self._frame[self._frame['date'].isin(days)][['date'] + columns]
+
+
+def make_panel():
+    rows = []
+    for code, prices in PRICES.items():
+        for day, price in zip(DAYS, prices):
+            rows.append({'date': day, 'code': code, 'short_name': code, 'stock_code': code,
+                         'last_cash_date': DAYS[0].replace(year=2025), 'raise_fund_volume': 5e8,
+                         'current_fund_volume': 5e8, 'convert_price': 10.0, 'price': float(price),
+                         'money': 1e7, 'stock_price': 10.0})
+    return FramePanel(pd.DataFrame(rows))
+
+
+def test_cash_out_after_last_snapshot(local_provider):
+    result = DoubleLowBacktest(DAYS[0], DAYS[-1], items_count=2, rebalance_interval=5, fee_rate=FEE_RATE,
+                               slippage=SLIPPAGE, initial_capital=10000.0, screen=lambda bonds, day: bonds,
+                               panel=make_panel()).run()
+
+    # 第1天等权买入 110001、110002，买入金额 = 初始资金 * (1 - 费率)，再按费率付手续费和滑点
+    buy_value = 10000.0 * (1 - COST_RATE)
+    shares_1, shares_2 = buy_value / 2 / 100, buy_value / 2 / 110
+    cash = 10000.0 - buy_value * (1 + COST_RATE)
+    assert np.isclose(result['turnover'].iloc[0], 1 - COST_RATE)
+    assert np.isclose(result['equity'].iloc[0], 10000.0 - COST_RATE * buy_value)
+    assert np.isclose(result['equity'].iloc[2], cash + shares_1 * 101 + shares_2 * 115)
+
+    # 110002 最后一个快照之后的第一个交易日按最后价格兑付，不计费用
+    cash += shares_2 * 115
+    assert result['holdings'].iloc[3] == 1
+    assert np.isclose(result['equity'].iloc[3], cash + shares_1 * 103)
+    assert result['turnover'].iloc[1:5].sum() == 0
+
+    # 第6天调仓: 卖出部分 110001，买入 110003
+    equity = cash + shares_1 * 104
+    target_value = equity * (1 - COST_RATE) / 2
+    sell_value = shares_1 * 104 - target_value
+    cash += sell_value * (1 - COST_RATE) - target_value * (1 + COST_RATE)
+    assert np.isclose(result['turnover'].iloc[5], (sell_value + target_value) / equity)
+    assert np.isclose(result['equity'].iloc[5], equity - COST_RATE * (sell_value + target_value))
+
+    assert list(result['holdings'].iloc[5:]) == [2] * 5
+    assert np.isclose(result['equity'].iloc[-1], cash + target_value / 104 * 106 + target_value / 120 * 124)
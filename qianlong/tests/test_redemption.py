@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from redemption import REDEMPTION_WINDOW, RedemptionTracker, compute_redemption_status, count_triggers, get_hits
+
+DAYS = [day.date() for day in pd.bdate_range('2020-01-02', periods=REDEMPTION_WINDOW + 5)]
+
+# 转股价10元，正股13元正好是130%，计为满足条件；12.99元不满足
+HIT_PRICE = 13.0
+MISS_PRICE = 12.99
+
+
+def make_panel():
+    """
+    110001: 前15天不满足，后15天满足，第30天正好触发
+    110002: 第2、4、...、30天满足
+    110003: 第1~14天满足，之后不满足，最多只有14天
+    """
+    hit_days = {
+        '110001': set(range(15, 30)),
+        '110002': set(range(1, 30, 2)),
+        '110003': set(range(14)),
+    }
+    rows = [{'date': day, 'code': code, 'convert_price': 10.0, 'stock_price': HIT_PRICE if i in hits else MISS_PRICE}
+            for code, hits in hit_days.items() for i, day in enumerate(DAYS)]
+    return pd.DataFrame(rows)
+
+
+def test_count_triggers_on_window():
+    hits = get_hits(make_panel())
+    assert hits.loc[DAYS[0], '110003'] == 1.0 and hits.loc[DAYS[0], '110001'] == 0.0
+
+    trigger_count, days_to_trigger = count_triggers(hits)
+
+    # 第30天(第一个完整窗口)，110003 的14天都在窗口开头，之后每天满足条件时它们也会移出窗口，还要15天
+    day = DAYS[REDEMPTION_WINDOW - 1]
+    assert list(trigger_count.loc[day]) == [15, 15, 14]
+    assert list(days_to_trigger.loc[day]) == [0, 0, 15]
+
+    # 第29天: 110001、110002 各14天，再满足1天就触发
+    day = DAYS[REDEMPTION_WINDOW - 2]
+    assert list(trigger_count.loc[day]) == [14, 14, 14]
+    assert list(days_to_trigger.loc[day]) == [1, 1, 1]
+
+    # 第1天: 110001 要连续15天满足
+    assert list(days_to_trigger.loc[DAYS[0]]) == [15, 15, 14]
+
+    # 窗口再滑过5天(第6~35天)，110002 只剩第6、8、...、30天，之后4天都满足时窗口中正好15天
+    assert list(trigger_count.loc[DAYS[-1]]) == [15, 13, 9]
+    assert list(days_to_trigger.loc[DAYS[-1]]) == [0, 4, 15]
+
+
+def test_tracker_matches_full_computation():
+    panel = make_panel()
+    expected = compute_redemption_status(panel).set_index(['date', 'code'])
+    loads = []
+
+    def load_history(i):
+        loads.append(i)
+        return panel[(panel['date'] >= DAYS[max(i - REDEMPTION_WINDOW, 0)]) & (panel['date'] < DAYS[i])]
+
+    tracker = RedemptionTracker()
+    # 逐日推进，中间跳过两天，最后再回到更早的日期，这三次需要读取历史快照
+    steps = list(range(REDEMPTION_WINDOW - 3, REDEMPTION_WINDOW + 1)) + [REDEMPTION_WINDOW + 3, REDEMPTION_WINDOW + 4, 5]
+    for i in steps:
+        status = tracker.advance(DAYS[i], DAYS[i - 1], panel[panel['date'] == DAYS[i]], lambda: load_history(i))
+        day_expected = expected.loc[DAYS[i]].loc[status.index]
+        np.testing.assert_array_equal(status['trigger_count'].values, day_expected['trigger_count'].values)
+        np.testing.assert_array_equal(status['days_to_trigger'].values, day_expected['days_to_trigger'].values)
+
+    assert loads == [REDEMPTION_WINDOW - 3, REDEMPTION_WINDOW + 3, 5]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from conftest import BOND_COUPONS
+from ytm import COUPON_TAX_RATE, compute_ytm, get_coupon_schedules, solve_ytm
+
+
+def test_solve_ytm():
+    # 两年后到期，第一年付息1.8元，到期赎回价110元(含最后一期利息)；半年后一次还本付息；没有未来现金流
+    times = np.array([[1.0, 2.0], [0.5, 0.0], [0.0, 0.0]])
+    cash = np.array([[1.8, 110.0], [101.0, 0.0], [0.0, 0.0]])
+    prices = [1.8 / 1.05 + 110.0 / 1.05 ** 2, 101.0 / 1.03 ** 0.5, 100.0]
+
+    result = solve_ytm(prices, times, cash)
+
+    np.testing.assert_allclose(result[:2], [0.05, 0.03], rtol=1e-9)
+    assert np.isnan(result[2])
+
+
+def test_compute_ytm_with_redemption_premium(local_provider):
+    # 2023-01-10 之后还有两期: 2024-01-10 付息1.8%，2025-01-10 按到期赎回价兑付
+    t1, t2 = 365 / 365.0, 731 / 365.0
+    coupon = BOND_COUPONS[-2]
+    after_tax_coupon = coupon * (1 - COUPON_TAX_RATE)
+
+    def price(rate, first, last):
+        return first / (1 + rate) ** t1 + last / (1 + rate) ** t2
+
+    # 110001 到期赎回价110元，超过面值的10元按利息缴税；110002 没有赎回价，按 100 + 2.0
+    codes = ['110001', '110001', '110002']
+    prices = [price(0.05, coupon, 110.0),
+              price(0.04, after_tax_coupon, 100 + 10 * (1 - COUPON_TAX_RATE)),
+              price(0.03, coupon, 102.0)]
+    ytm, ytm_after_tax = compute_ytm(codes, prices, '2023-01-10')
+
+    np.testing.assert_allclose(ytm[[0, 2]], [0.05, 0.03], rtol=1e-9)
+    np.testing.assert_allclose(ytm_after_tax[1], 0.04, rtol=1e-9)
+    assert ytm_after_tax[0] < ytm[0]
+    assert get_coupon_schedules().get(['110001'])['110001'][1][-1] == 110.0
+
+    # 传入的 redemption_prices 覆盖缓存中的到期赎回价
+    ytm, _ = compute_ytm(['110002'], [price(0.03, coupon, 106.0)], '2023-01-10', redemption_prices={'110002': 106.0})
+    np.testing.assert_allclose(ytm, [0.03], rtol=1e-9)
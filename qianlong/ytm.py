@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""可转债到期收益率
+
+按 bond.BOND_COUPON 的每期票面利率和到期赎回价生成每只转债的现金流(按代码缓存)，
+然后对所有转债(或者整个 转债 × 日期 长表)一次性求解:
+
+    价格 = sum(现金流 / (1 + ytm) ^ 距付息日年数)
+
+先用牛顿法迭代，没有收敛的再用二分法，全部是 numpy 向量运算。
+
+税后到期收益率: 利息按 COUPON_TAX_RATE 缴税，到期赎回价中超过面值的部分同样按利息缴税。
+到期赎回价(含最后一期利息，一般为面值的106%~115%)从可转债基本资料中读取，没有数据的转债按 面值 + 最后一期利息 计算，
+也可以用 compute_ytm 的 redemption_prices 参数覆盖。
+"""
+
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import kanglong_path  # noqa: F401 共用模块在 ../kanglong 中
+from provider import get_provider
+
+# 默认的本地存储文件，设为None时只在内存中缓存；旧的 coupon_schedule.pkl 中到期现金流按面值计算，不再读取
+YTM_SCHEDULE_PATH = os.path.join(os.path.expanduser('~'), '.qianlong', 'coupon_schedule_v2.pkl')
+
+# 利息所得税税率
+COUPON_TAX_RATE = 0.2
+
+# 债券面值
+BOND_PAR = 100.0
+
+# 二分法求解的区间
+YTM_LOWER = -0.9999
+YTM_UPPER = 10.0
+
+
+def build_schedule(coupons, par=BOND_PAR, redemption_price=None):
+    """
+    一只债券的 BOND_COUPON 记录 -> 现金流
+
+    input:
+        coupons: 一只债券的 BOND_COUPON 记录
+        par: 面值
+        redemption_price: 到期赎回价(含最后一期利息)，为None时按 面值 + 最后一期利息
+
+    output:
+        (付息日 datetime64[D] 数组, 每期利息 数组)，最后一期为到期赎回价
+    """
+    coupons = coupons.sort_values('coupon_start_date')
+    pay_dates = pd.to_datetime(coupons['coupon_end_date']).values.astype('datetime64[D]')
+    cash = coupons['coupon'].astype(float).values / 100.0 * par
+    cash[-1] = redemption_price if redemption_price is not None else cash[-1] + par
+    return pay_dates, cash
+
+
+class CouponSchedules(object):
+    """按债券代码缓存的现金流，票面利率和到期赎回价在发行时就确定了，每只债券只查询一次"""
+
+    def __init__(self, path=YTM_SCHEDULE_PATH):
+        """
+        input:
+            path: 本地缓存文件，为None时只缓存在内存中
+        """
+        self._path = path
+        self._schedules = None
+
+    def _load(self):
+        if self._schedules is None:
+            self._schedules = {}
+            if self._path and os.path.exists(self._path):
+                with open(self._path, 'rb') as f:
+                    self._schedules = pickle.load(f)
+        return self._schedules
+
+    def _save(self):
+        if not self._path:
+            return
+
+        if not os.path.exists(os.path.dirname(self._path)):
+            os.makedirs(os.path.dirname(self._path))
+        with open(self._path, 'wb') as f:
+            pickle.dump(self._schedules, f)
+
+    def get(self, codes):
+        """
+        output:
+            {code: (付息日数组, 现金流数组)}，没有票面利率数据的债券不在结果中
+        """
+        schedules = self._load()
+        # 没有数据的债券不记录(旧缓存文件中的None也当作没有)，新上市的转债票面利率晚一两天入库，下次再查
+        missing = sorted(code for code in set(codes) if schedules.get(code) is None)
+        if missing:
+            coupons = get_provider().get_bond_coupon(missing)
+            redemption_prices = get_provider().get_conbond_redemption_prices(missing)
+            for code, df in coupons.groupby('code'):
+                schedules[code] = build_schedule(df, redemption_price=redemption_prices.get(code))
+            if len(coupons):
+                self._save()
+        return {code: schedules[code] for code in set(codes) if schedules.get(code) is not None}
+
+
+def _present_value(ytm, times, cash):
+    """现金流按ytm折现的现值及其对ytm的导数"""
+    discount = np.power(1 + ytm[:, None], -times)
+    pv = (cash * discount).sum(axis=1)
+    dpv = -(cash * times * discount).sum(axis=1) / (1 + ytm)
+    return pv, dpv
+
+
+def solve_ytm(prices, times, cash, tol=1e-10, max_iter=50):
+    """
+    向量化求解到期收益率
+
+    input:
+        prices: (n,) 债券价格
+        times: (n, m) 距每次付息的年数，不足m期的用0补齐
+        cash: (n, m) 每次付息的现金流，不足m期的用0补齐
+
+    output:
+        (n,) 到期收益率，没有未来现金流或者超出 [YTM_LOWER, YTM_UPPER] 的为NaN
+    """
+    prices = np.asarray(prices, dtype='float64')
+    has_cash = (cash > 0).any(axis=1) & (prices > 0)
+
+    # 牛顿法
+    ytm = np.full(len(prices), 0.02)
+    with np.errstate(all='ignore'):
+        for _ in range(max_iter):
+            pv, dpv = _present_value(ytm, times, cash)
+            step = (pv - prices) / dpv
+            ytm = np.clip(ytm - step, YTM_LOWER, YTM_UPPER)
+            if np.all(~has_cash | (np.abs(step) < tol)):
+                break
+
+        pv, _ = _present_value(ytm, times, cash)
+        unsolved = has_cash & ~(np.abs(pv - prices) < 1e-8 * np.maximum(prices, 1))
+
+        # 没有收敛的用二分法，现值随ytm单调递减
+        if unsolved.any():
+            low = np.full(unsolved.sum(), YTM_LOWER)
+            high = np.full(unsolved.sum(), YTM_UPPER)
+            sub_times, sub_cash, sub_prices = times[unsolved], cash[unsolved], prices[unsolved]
+            for _ in range(100):
+                mid = (low + high) / 2
+                pv, _ = _present_value(mid, sub_times, sub_cash)
+                low = np.where(pv > sub_prices, mid, low)
+                high = np.where(pv > sub_prices, high, mid)
+            mid = (low + high) / 2
+            mid[(mid - YTM_LOWER < 1e-8) | (YTM_UPPER - mid < 1e-8)] = np.nan
+            ytm[unsolved] = mid
+
+    ytm[~has_cash] = np.nan
+    return ytm
+
+
+def compute_ytm(codes, prices, dates, redemption_prices=None, schedules=None):
+    """
+    计算到期收益率和税后到期收益率，可以一次传入整个 转债 × 日期 长表
+
+    input:
+        codes: 转债代码数组
+        prices: 价格数组
+        dates: 日期数组，或者所有转债共用的一个日期
+        redemption_prices: {code: 到期赎回价(含最后一期利息)}，覆盖现金流缓存中的到期赎回价
+        schedules: CouponSchedules，默认使用进程内共享的缓存
+
+    output:
+        (ytm, ytm_after_tax)，两个与codes等长的 ndarray
+    """
+    codes = np.asarray(codes, dtype=object)
+    prices = np.asarray(prices, dtype='float64')
+    if np.ndim(dates) == 0:
+        dates = np.full(len(codes), np.datetime64(pd.Timestamp(dates), 'D'))
+    else:
+        dates = pd.to_datetime(pd.Series(dates)).values.astype('datetime64[D]')
+    redemption_prices = redemption_prices or {}
+
+    schedules = (schedules if schedules is not None else get_coupon_schedules()).get(set(codes))
+    width = max([len(schedule[1]) for schedule in schedules.values()] or [1])
+    times = np.zeros((len(codes), width))
+    cash = np.zeros((len(codes), width))
+    cash_after_tax = np.zeros((len(codes), width))
+
+    # 同一只转债的所有日期一起展开
+    for code, rows in pd.Series(np.arange(len(codes))).groupby(codes):
+        if code not in schedules:
+            continue
+
+        pay_dates, amounts = schedules[code]
+        amounts = amounts.copy()
+        if code in redemption_prices:
+            amounts[-1] = redemption_prices[code]
+        amounts_after_tax = amounts * (1 - COUPON_TAX_RATE)
+        amounts_after_tax[-1] = BOND_PAR + (amounts[-1] - BOND_PAR) * (1 - COUPON_TAX_RATE)
+
+        rows = rows.values
+        years = (pay_dates[None, :] - dates[rows][:, None]).astype('float64') / 365.0
+        future = years > 0
+        n = len(amounts)
+        times[rows, :n] = np.where(future, years, 0.0)
+        cash[rows, :n] = np.where(future, amounts, 0.0)
+        cash_after_tax[rows, :n] = np.where(future, amounts_after_tax, 0.0)
+
+    return solve_ytm(prices, times, cash), solve_ytm(prices, times, cash_after_tax)
+
+
+_coupon_schedules = None
+
+
+def get_coupon_schedules():
+    """进程内共享的现金流缓存"""
+    global _coupon_schedules
+    if _coupon_schedules is None:
+        _coupon_schedules = CouponSchedules()
+    return _coupon_schedules